@@ -0,0 +1,108 @@
+"""
+Compare the session of a user whose CAS releases 20 attributes and 200
+groups (distinguished names), stored as released, with only the 3
+attributes the application reads kept (`CAS_KEEP_ATTRIBUTES`), and with
+those encoded compactly (`CAS_COMPACT_ATTRIBUTES`).
+
+Prints the size of the serialized session and of the signed session
+cookie, then times loading the cookie and the attributes (every
+request) and saving it (every login).
+
+Usage:
+    python benchmarks/bench_attributes.py
+    python benchmarks/bench_attributes.py -k load --json attributes.json
+"""
+
+import sys
+
+import flask
+
+from flask_cas.attributes import AttributeCodec
+
+import harness
+
+GROUPS = 200
+
+RELEASED = dict(('cas:' + name, value) for name, value in {
+    'uid': 'bob',
+    'displayName': 'Bob Smith',
+    'givenName': 'Bob',
+    'sn': 'Smith',
+    'cn': 'Bob Smith',
+    'mail': 'bob@example.edu',
+    'telephoneNumber': '+1 503 555 0100',
+    'employeeNumber': '900123456',
+    'departmentNumber': '4021',
+    'title': 'Research Assistant',
+    'ou': 'Department of Computer Science',
+    'postalAddress': '1825 SW Broadway, Portland, OR 97201',
+    'eduPersonPrincipalName': 'bob@example.edu',
+    'eduPersonAffiliation': ['member', 'staff', 'student'],
+    'eduPersonPrimaryAffiliation': 'staff',
+    'preferredLanguage': 'en',
+    'isFromNewLogin': 'true',
+    'authenticationDate': '2024-01-01T00:00:00.000Z',
+    'longTermAuthenticationRequestTokenUsed': 'false',
+    'memberOf': [
+        'cn=group{0},ou=groups,dc=example,dc=edu'.format(number)
+        for number in range(GROUPS)],
+}.items())
+KEEP = ['mail', 'displayName', 'memberOf']
+
+app = flask.Flask(__name__)
+app.secret_key = 'SECRET_KEY'
+serializer = app.session_interface.get_signing_serializer(app)
+codecs = [
+    ('released', None),
+    ('kept', AttributeCodec(KEEP)),
+    ('compact', AttributeCodec(KEEP, compact=True)),
+]
+
+
+def session_of(codec):
+    if codec is None:
+        attributes = dict(RELEASED)
+    else:
+        attributes = codec.encode(codec.project(RELEASED))
+    return {'CAS_USERNAME': 'bob', '_CAS_TOKEN': 'ST-1-cas',
+            'CAS_ATTRIBUTES': attributes}
+
+
+def load_scenario(codec):
+    cookie = serializer.dumps(session_of(codec))
+
+    def load():
+        attributes = serializer.loads(cookie)['CAS_ATTRIBUTES']
+        if codec is not None:
+            codec.decode(attributes)
+    return load
+
+
+def save_scenario(codec):
+    session = session_of(codec)
+
+    def save():
+        serializer.dumps(session)
+    return save
+
+
+def report_sizes():
+    print('{0:<10} {1:>14} {2:>14}'.format(
+        'session', 'serialized (B)', 'cookie (B)'))
+    for name, codec in codecs:
+        session = session_of(codec)
+        print('{0:<10} {1:>14} {2:>14}'.format(
+            name, len(serializer.serializer.dumps(session)),
+            len(serializer.dumps(session))))
+    print('')
+
+
+SCENARIOS = []
+for name, codec in codecs:
+    SCENARIOS.append(('load {0}'.format(name), load_scenario(codec)))
+    SCENARIOS.append(('save {0}'.format(name), save_scenario(codec)))
+
+
+if __name__ == '__main__':
+    report_sizes()
+    sys.exit(harness.main(SCENARIOS, __doc__))
@@ -0,0 +1,99 @@
+"""
+Cost of the group checks of a request, for users with 5000 groups.
+
+The session holds `cas:memberOf` as the list parsed at validation; every
+request decodes it into new strings and checks the groups of the user
+once. Compared, per request:
+
+- list: a linear scan of the list, as before the group sets.
+- reparse: the list parsed and interned again before building the
+  shared set (what `Principal.groups` used to do).
+- set: the shared set built from the list as it is, for tickets
+  validated by another process.
+- cached: the set built when the user logged in, looked up by session
+  token and username.
+
+Then the memory kept by the cache of the group sets for 200 users with
+the same groups, with and without sharing equal sets.
+
+Usage: python benchmarks/bench_groups.py
+"""
+
+import json
+import timeit
+import tracemalloc
+
+from flask_cas.cache import TTLCache
+from flask_cas.groups import group_set
+from flask_cas.groups import parse_member_of
+
+GROUPS = 5000
+USERS = 200
+REQUESTS = 200
+MEMBER_OF = parse_member_of('[' + ', '.join(
+    'cn=group{0}'.format(number) for number in range(GROUPS)) + ']')
+# The worst case for a linear scan
+REQUIRED = 'cn=group{0}'.format(GROUPS - 1)
+SESSION = json.dumps(MEMBER_OF)
+
+
+def sessions():
+    # The lists of as many requests, as decoded from their session
+    return [json.loads(SESSION) for _ in range(REQUESTS)]
+
+
+def list_path(member_of):
+    return REQUIRED in member_of
+
+
+def reparse_path(member_of):
+    return REQUIRED in group_set(parse_member_of(member_of))
+
+
+def set_path(member_of):
+    return REQUIRED in group_set(member_of)
+
+
+CACHE = TTLCache(maxsize=4096, ttl=float('inf'))
+CACHE.set('ST-1', ('bob', group_set(MEMBER_OF)))
+
+
+def cached_path(member_of):
+    return REQUIRED in CACHE.get('ST-1')[1]
+
+
+def per_request(path):
+    best = None
+    for _ in range(5):
+        lists = sessions()
+        seconds = timeit.timeit(
+            lambda: [path(member_of) for member_of in lists], number=1)
+        best = seconds if best is None else min(best, seconds)
+    return best / REQUESTS
+
+
+def memory(build):
+    tracemalloc.start()
+    cache = TTLCache(maxsize=4096, ttl=float('inf'))
+    for user in range(USERS):
+        # The strings of the session are kept only by a set of their own
+        cache.set('ST-{0}'.format(user),
+                  ('user', build(json.loads(SESSION))))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def main():
+    for name, path in [('list', list_path), ('reparse', reparse_path),
+                       ('set', set_path), ('cached', cached_path)]:
+        print('{0:<8} {1:10.2f} us per request'.format(
+            name, per_request(path) * 1e6))
+    print('Group sets of {0} users with the same {1} groups:'.format(
+        USERS, GROUPS))
+    print('  one set per user  {0:8.1f} MB'.format(memory(frozenset) / 1e6))
+    print('  shared sets       {0:8.1f} MB'.format(memory(group_set) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
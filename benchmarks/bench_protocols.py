@@ -0,0 +1,96 @@
+"""
+Compare the cost of parsing the validation response of each protocol:
+the CAS 2.0/3.0 XML serviceResponse, the CAS 3.0 JSON serviceResponse
+and the SAML 1.1 response of samlValidate, for a user with a few
+attributes and for one with 5000 group values.
+
+Usage:
+    python benchmarks/bench_protocols.py
+    python benchmarks/bench_protocols.py -k huge --json protocols.json
+"""
+
+import io
+import json
+import sys
+
+from flask_cas.parsing import JSONResponseParser
+from flask_cas.parsing import SAMLResponseParser
+from flask_cas.parsing import ServiceResponseParser
+from flask_cas.parsing import parse_response
+
+import harness
+
+GROUPS = 5000
+
+SMALL = {
+    'displayName': ['Bob Smith'],
+    'email': ['bob@example.com'],
+    'memberOf': ['cn=admins', 'cn=users'],
+}
+HUGE = dict(SMALL, group=[
+    'cn=group{0}'.format(number) for number in range(GROUPS)])
+
+
+def xml_response(attributes):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+        '<cas:authenticationSuccess><cas:user>bob</cas:user>'
+        '<cas:attributes>{0}</cas:attributes>'
+        '</cas:authenticationSuccess></cas:serviceResponse>'.format(''.join(
+            '<cas:{0}>{1}</cas:{0}>'.format(name, value)
+            for name, values in sorted(attributes.items())
+            for value in values))).encode('utf-8')
+
+
+def json_response(attributes):
+    return json.dumps({'serviceResponse': {'authenticationSuccess': {
+        'user': 'bob', 'attributes': attributes}}}).encode('utf-8')
+
+
+def saml_response(attributes):
+    return (
+        '<SOAP-ENV:Envelope'
+        ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<SOAP-ENV:Body>'
+        '<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol">'
+        '<samlp:Status><samlp:StatusCode Value="samlp:Success"/>'
+        '</samlp:Status>'
+        '<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:1.0:assertion">'
+        '<saml:AuthenticationStatement><saml:Subject>'
+        '<saml:NameIdentifier>bob</saml:NameIdentifier>'
+        '</saml:Subject></saml:AuthenticationStatement>'
+        '<saml:AttributeStatement>{0}</saml:AttributeStatement>'
+        '</saml:Assertion></samlp:Response>'
+        '</SOAP-ENV:Body></SOAP-ENV:Envelope>'.format(''.join(
+            '<saml:Attribute AttributeName="{0}">{1}</saml:Attribute>'.format(
+                name, ''.join('<saml:AttributeValue>{0}</saml:AttributeValue>'
+                              .format(value) for value in values))
+            for name, values in sorted(attributes.items())))).encode('utf-8')
+
+
+FORMATS = [
+    ('xml', xml_response, ServiceResponseParser),
+    ('json', json_response, JSONResponseParser),
+    ('saml', saml_response, SAMLResponseParser),
+]
+
+
+def parse_scenario(body, parser_class):
+    def parse():
+        parse_response(io.BytesIO(body), None, parser_class)
+    return parse
+
+
+SCENARIOS = []
+for size, attributes, options in (('small', SMALL, {}),
+                                  ('huge', HUGE, {'batches': 50})):
+    for name, render, parser_class in FORMATS:
+        body = render(attributes)
+        SCENARIOS.append((
+            'parse {0} {1} ({2} KB)'.format(name, size, len(body) // 1024),
+            parse_scenario(body, parser_class), options))
+
+
+if __name__ == '__main__':
+    sys.exit(harness.main(SCENARIOS, __doc__))
@@ -0,0 +1,125 @@
+"""
+Startup cost of the extension, each measurement in a fresh interpreter:
+
+- the time taken by `import flask_cas` (Flask itself already imported),
+  and which of the heavier standard library modules it loaded;
+- the latency of the first `/login/?ticket=...` of a new process
+  against a stub CAS (`flask_cas.testing.StubCAS`), with and without
+  `CAS.warmup`, and the time the warmup itself took.
+
+The best of `--runs` runs is reported. Everything runs offline.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20 --latency 0.01
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+# Loaded on demand by the extension, see the README
+LAZY_MODULES = [
+    'concurrent.futures',
+    'queue',
+    'sqlite3',
+    'urllib.request',
+    'xml.sax.saxutils',
+]
+
+
+def child_import():
+    import flask  # noqa: F401
+    started = perf_counter()
+    import flask_cas  # noqa: F401
+    elapsed = perf_counter() - started
+    return {'seconds': elapsed,
+            'loaded': [name for name in LAZY_MODULES if name in sys.modules]}
+
+
+def child_login(warm, latency):
+    import flask
+    from flask_cas import CAS
+    from flask_cas.testing import StubCAS
+
+    with StubCAS(latency=latency) as stub:
+        app = flask.Flask(__name__)
+
+        @app.route('/')
+        def root():
+            return 'ok'
+
+        app.secret_key = 'SECRET_KEY'
+        app.config['CAS_SERVER'] = stub.url
+        app.config['CAS_AFTER_LOGIN'] = 'root'
+        app.config['SERVER_NAME'] = 'localhost'
+        cas = CAS(app)
+        warmup = 0
+        if warm:
+            started = perf_counter()
+            cas.warmup(app)
+            warmup = perf_counter() - started
+        ticket = stub.issue_ticket('http://localhost/login/')
+        client = app.test_client()
+        started = perf_counter()
+        response = client.get('/login/?ticket=' + ticket)
+        elapsed = perf_counter() - started
+        assert response.status_code == 302, response.status_code
+        assert 'ticket' not in response.headers['Location']
+    return {'seconds': elapsed, 'warmup': warmup}
+
+
+def run_child(arguments):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child'] + arguments)
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def best(arguments, runs):
+    results = [run_child(arguments) for _ in range(runs)]
+    return min(results, key=lambda result: result['seconds'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added by the stub CAS to validations')
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        mode = options.child[0]
+        if mode == 'import':
+            result = child_import()
+        else:
+            result = child_login(mode == 'warm', float(options.child[1]))
+        print(json.dumps(result))
+        return 0
+
+    result = best(['import'], options.runs)
+    print('import flask_cas: {0:8.2f} ms'.format(result['seconds'] * 1e3))
+    print('lazy modules loaded: {0}'.format(
+        ', '.join(result['loaded']) or 'none'))
+    latency = str(options.latency)
+    for mode in ('cold', 'warm'):
+        result = best([mode, latency], options.runs)
+        line = 'first login, {0}: {1:8.2f} ms'.format(
+            mode, result['seconds'] * 1e3)
+        if mode == 'warm':
+            line += ' (warmup {0:.2f} ms)'.format(result['warmup'] * 1e3)
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
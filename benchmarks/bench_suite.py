@@ -0,0 +1,140 @@
+"""
+Benchmark suite of the flask_cas hot paths.
+
+Scenarios:
+
+- building urls with `create_url` and the `create_cas_*_url` helpers
+- parsing small and huge serviceResponse documents, directly and
+  through `routing.validate`
+- post-processing of `cas:memberOf`
+- full `/login/` round trips through the Flask test client
+
+Usage:
+    python benchmarks/bench_suite.py                     # all scenarios
+    python benchmarks/bench_suite.py -k login            # a subset
+    python benchmarks/bench_suite.py --json base.json    # save results
+    python benchmarks/bench_suite.py --compare base.json # find regressions
+"""
+
+import io
+import sys
+
+import flask
+
+from flask_cas import CAS
+from flask_cas import routing
+from flask_cas.cas_urls import create_cas_login_url
+from flask_cas.cas_urls import create_cas_logout_url
+from flask_cas.cas_urls import create_cas_proxy_url
+from flask_cas.cas_urls import create_cas_validate_url
+from flask_cas.cas_urls import create_url
+from flask_cas.parsing import ValidationResult
+from flask_cas.parsing import parse_response
+from flask_cas.transport import Transport
+
+import harness
+
+SERVER = 'https://sso.pdx.edu'
+SERVICE = 'http://localhost:5000/login/'
+TICKET = 'ST-58274-x839euFek492ou832Eena7ee-cas'
+GROUPS = 5000
+
+
+def service_response(attributes):
+    return (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+        b'<cas:authenticationSuccess><cas:user>bob</cas:user>'
+        b'<cas:attributes>' + attributes + b'</cas:attributes>'
+        b'</cas:authenticationSuccess></cas:serviceResponse>')
+
+
+MEMBER_OF = '[' + ', '.join(
+    'cn=group{0}'.format(number) for number in range(GROUPS)) + ']'
+
+SMALL = service_response(
+    b'<cas:displayName>Bob Smith</cas:displayName>'
+    b'<cas:email>bob@example.com</cas:email>'
+    b'<cas:memberOf>[cn=admins, cn=users]</cas:memberOf>')
+
+HUGE = service_response(
+    b''.join(b'<cas:group>cn=group' + str(number).encode('ascii') +
+             b'</cas:group>' for number in range(GROUPS)) +
+    b'<cas:memberOf>' + MEMBER_OF.encode('ascii') + b'</cas:memberOf>')
+
+
+class CannedTransport(Transport):
+    """ Answers every request with the same body. """
+
+    def __init__(self, body):
+        self.body = body
+
+    def open(self, url, timeout=None):
+        return io.BytesIO(self.body)
+
+
+def create_app(body, ticket_cache=True):
+    app = flask.Flask(__name__)
+
+    @app.route('/')
+    def root():
+        return ''
+
+    app.secret_key = 'SECRET_KEY'
+    app.config['CAS_SERVER'] = SERVER
+    app.config['CAS_AFTER_LOGIN'] = 'root'
+    if ticket_cache:
+        app.config['CAS_TICKET_CACHE_SIZE'] = 1024
+    cas = CAS(app)
+    cas.transport = CannedTransport(body)
+    return app
+
+
+def validate_scenario(body):
+    app = create_app(body, ticket_cache=False)
+
+    def validate():
+        with app.test_request_context('/login/'):
+            routing.validate(TICKET)
+    return validate
+
+
+def login_scenario(body, ticket_cache):
+    client = create_app(body, ticket_cache).test_client()
+
+    def login():
+        client.get('/login/?ticket=' + TICKET)
+    return login
+
+
+def member_of():
+    routing._finish_validation(ValidationResult(
+        True, 'bob', {'cas:memberOf': MEMBER_OF}))
+
+
+SCENARIOS = [
+    ('create_url', lambda: create_url(
+        SERVER, '/cas', ('service', SERVICE), ('renew', 'true'))),
+    ('create_cas_login_url', lambda: create_cas_login_url(
+        SERVER, '/cas', SERVICE)),
+    ('create_cas_logout_url', lambda: create_cas_logout_url(
+        SERVER, '/cas/logout', 'http://localhost:5000')),
+    ('create_cas_validate_url', lambda: create_cas_validate_url(
+        SERVER, '/cas/serviceValidate', SERVICE, TICKET)),
+    ('create_cas_proxy_url', lambda: create_cas_proxy_url(
+        SERVER, '/cas/proxy', 'PGT-1', SERVICE)),
+    ('parse_response small', lambda: parse_response(io.BytesIO(SMALL))),
+    ('parse_response huge', lambda: parse_response(io.BytesIO(HUGE)),
+     {'batches': 50}),
+    ('validate small', validate_scenario(SMALL)),
+    ('validate huge', validate_scenario(HUGE), {'batches': 50}),
+    ('memberOf {0} groups'.format(GROUPS), member_of, {'batches': 50}),
+    ('login round trip', login_scenario(SMALL, ticket_cache=False)),
+    ('login round trip, cached ticket', login_scenario(SMALL, True)),
+    ('login round trip huge', login_scenario(HUGE, ticket_cache=False),
+     {'batches': 50}),
+]
+
+
+if __name__ == '__main__':
+    sys.exit(harness.main(SCENARIOS, __doc__))
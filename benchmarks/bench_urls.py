@@ -0,0 +1,49 @@
+"""
+Compare building the CAS urls with `create_url` on every request against
+the per service `CASURLs` templates used by the blueprint.
+
+Usage: python benchmarks/bench_urls.py
+"""
+
+import timeit
+
+from flask_cas.cas_urls import CASURLs
+from flask_cas.cas_urls import create_cas_login_url
+from flask_cas.cas_urls import create_cas_logout_url
+from flask_cas.cas_urls import create_cas_validate_url
+
+SERVER = 'https://sso.pdx.edu'
+SERVICE = 'http://localhost:5000/login/'
+TICKET = 'ST-58274-x839euFek492ou832Eena7ee-cas'
+NUMBER = 20000
+
+
+def create_url_path():
+    create_cas_login_url(SERVER, '/cas', SERVICE)
+    create_cas_logout_url(SERVER, '/cas/logout', 'http://localhost:5000')
+    create_cas_validate_url(SERVER, '/cas/serviceValidate', SERVICE, TICKET)
+
+
+URLS = CASURLs(SERVER, '/cas', '/cas/logout', '/cas/serviceValidate',
+               SERVICE, 'http://localhost:5000')
+
+
+def template_path():
+    URLS.login
+    URLS.logout
+    URLS.validate(TICKET)
+
+
+def main():
+    results = []
+    for name, function in [('create_url', create_url_path),
+                           ('CASURLs', template_path)]:
+        seconds = min(timeit.repeat(function, number=NUMBER, repeat=5))
+        results.append(seconds)
+        print('{0:<12} {1:8.2f} us/request'.format(
+            name, seconds / NUMBER * 1e6))
+    print('speedup      {0:8.1f}x'.format(results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Small benchmark harness shared by the benchmark scripts.
+
+Each scenario is timed in batches after a warmup, with the garbage
+collector disabled, and reports:
+
+- ops/sec, from the median batch
+- p50, p90 and p99 latency per operation, over the batches
+- the tracemalloc peak of a single operation, measured in a separate
+  run so tracing does not slow the timings down
+
+Results can be saved as JSON and compared against a previous run to
+catch regressions.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+
+class Result(object):
+    """ The measurements of one scenario. """
+
+    def __init__(self, name, latencies, peak_memory):
+        self.name = name
+        latencies = sorted(latencies)
+        self.p50 = _percentile(latencies, 50)
+        self.p90 = _percentile(latencies, 90)
+        self.p99 = _percentile(latencies, 99)
+        self.ops_per_sec = 1.0 / self.p50 if self.p50 else float('inf')
+        self.peak_memory = peak_memory
+
+    def as_dict(self):
+        return {
+            'ops_per_sec': self.ops_per_sec,
+            'p50_us': self.p50 * 1e6,
+            'p90_us': self.p90 * 1e6,
+            'p99_us': self.p99 * 1e6,
+            'peak_memory_bytes': self.peak_memory,
+        }
+
+
+def _percentile(values, percent):
+    index = min(len(values) - 1,
+                int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(name, function, batches=200, inner=None, warmup=0.2,
+            setup=None):
+    """ Time `function` and return a `Result`.
+
+    Keyword arguments:
+    name -- The name of the scenario.
+    function -- Callable without arguments, one operation.
+    batches -- Number of timed batches.
+    inner -- Operations per batch, chosen so a batch lasts about 1ms if
+             None.
+    warmup -- Seconds the function runs before timing starts.
+    setup -- Callable run before each batch, outside of the timing.
+    """
+    deadline = perf_counter() + warmup
+    calls = 0
+    while perf_counter() < deadline or calls == 0:
+        function()
+        calls += 1
+    if inner is None:
+        inner = max(1, int(calls / (warmup / 0.001)))
+
+    latencies = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(batches):
+            if setup is not None:
+                setup()
+            start = perf_counter()
+            for _ in range(inner):
+                function()
+            latencies.append((perf_counter() - start) / inner)
+    finally:
+        if enabled:
+            gc.enable()
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return Result(name, latencies, peak)
+
+
+def report(results, stream=sys.stdout):
+    """ Print `results` as a table. """
+    stream.write('{0:<36} {1:>12} {2:>10} {3:>10} {4:>10} {5:>10}\n'.format(
+        'scenario', 'ops/sec', 'p50 us', 'p90 us', 'p99 us', 'peak KB'))
+    for result in results:
+        stream.write(
+            '{0:<36} {1:>12.0f} {2:>10.2f} {3:>10.2f} {4:>10.2f} '
+            '{5:>10.1f}\n'.format(
+                result.name, result.ops_per_sec, result.p50 * 1e6,
+                result.p90 * 1e6, result.p99 * 1e6,
+                result.peak_memory / 1024.0))
+
+
+def compare(results, baseline, threshold):
+    """ Return the names of the scenarios whose p50 is more than
+    `threshold` (a fraction) slower than in `baseline`. """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous is None:
+            continue
+        if result.p50 * 1e6 > previous['p50_us'] * (1 + threshold):
+            regressions.append(result.name)
+    return regressions
+
+
+def main(scenarios, description=None):
+    """ Command line entry point of a benchmark script.
+
+    `scenarios` is a list of (name, function) pairs or
+    (name, function, options) triples, options being keyword arguments
+    of `measure`. Returns the exit status: 1 if a regression was found
+    by `--compare`.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-k', dest='match', default='',
+                        help='only run scenarios containing this string')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare',
+                        help='compare against results saved by --json')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression (0.1)')
+    options = parser.parse_args()
+
+    results = []
+    for scenario in scenarios:
+        name, function = scenario[:2]
+        if options.match not in name:
+            continue
+        kwargs = scenario[2] if len(scenario) > 2 else {}
+        results.append(measure(name, function, **kwargs))
+    report(results)
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump(dict((result.name, result.as_dict())
+                           for result in results), output, indent=2,
+                      sort_keys=True)
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  options.threshold)
+        for name in regressions:
+            print('REGRESSION {0}'.format(name))
+        return 1 if regressions else 0
+    return 0
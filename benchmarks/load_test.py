@@ -0,0 +1,167 @@
+"""
+End-to-end load test of the `/login/` ticket flow over real sockets.
+
+A stub CAS (`flask_cas.testing.StubCAS`) and a Flask application using
+the extension are started on local ports. N simulated browsers, each
+with its own cookie jar, repeatedly go through the full flow:
+
+    GET /login/ -> CAS login -> /login/?ticket=... -> CAS_AFTER_LOGIN
+
+and the throughput and latency percentiles of the flows are reported.
+Everything runs offline.
+
+Usage:
+    python benchmarks/load_test.py --browsers 50 --duration 10
+    python benchmarks/load_test.py --latency 0.05 --failure-rate 0.01
+"""
+
+import argparse
+import threading
+import time
+
+try:
+    from cookielib import CookieJar
+    from urllib2 import HTTPCookieProcessor
+    from urllib2 import build_opener
+except ImportError:
+    from http.cookiejar import CookieJar
+    from urllib.request import HTTPCookieProcessor
+    from urllib.request import build_opener
+
+import flask
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.serving import make_server
+
+from flask_cas import CAS
+from flask_cas import login_required
+from flask_cas.testing import StubCAS
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def create_app(cas_url, options):
+    app = flask.Flask(__name__)
+
+    @app.route('/')
+    @login_required
+    def root():
+        return 'ok'
+
+    app.secret_key = 'SECRET_KEY'
+    app.config['CAS_SERVER'] = cas_url
+    app.config['CAS_AFTER_LOGIN'] = 'root'
+    app.config['CAS_CONNECTION_POOL'] = not options.no_pool
+    app.config['CAS_POOL_SIZE'] = options.browsers
+    if options.attribute_store:
+        app.config['CAS_ATTRIBUTE_STORE'] = options.attribute_store
+    CAS(app)
+    return app
+
+
+def browse(url, deadline, iterations, latencies, errors):
+    """ Log in again and again as a new browser until `deadline`. """
+    count = 0
+    while perf_counter() < deadline and (iterations is None or
+                                         count < iterations):
+        count += 1
+        # A new browser: no cookies, a new connection
+        opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        start = perf_counter()
+        try:
+            response = opener.open(url + '/login/')
+            body = response.read()
+            if body != b'ok':
+                raise ValueError('Unexpected page {0!r}'.format(body[:100]))
+        except Exception as error:
+            errors.append(error)
+        else:
+            latencies.append(perf_counter() - start)
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    index = min(len(values) - 1,
+                int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--browsers', type=int, default=20,
+                        help='concurrent simulated browsers (20)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds the test runs (10)')
+    parser.add_argument('--iterations', type=int, default=None,
+                        help='logins per browser, instead of --duration')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the CAS takes to validate (0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random extra validation seconds (0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of failing validations (0)')
+    parser.add_argument('--attributes', type=int, default=10,
+                        help='attribute values released per login (10)')
+    parser.add_argument('--attribute-store', default=None,
+                        help='CAS_ATTRIBUTE_STORE of the application')
+    parser.add_argument('--no-pool', action='store_true',
+                        help='open a new connection per validation')
+    options = parser.parse_args()
+
+    stub = StubCAS(latency=options.latency, jitter=options.jitter,
+                   failure_rate=options.failure_rate,
+                   attributes=options.attributes, seed=0).start()
+    server = make_server('127.0.0.1', 0, create_app(stub.url, options),
+                         threaded=True, request_handler=QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    url = 'http://127.0.0.1:{0}'.format(server.server_port)
+
+    latencies = []
+    errors = []
+    if options.iterations is not None:
+        deadline = float('inf')
+    else:
+        deadline = perf_counter() + options.duration
+    browsers = [threading.Thread(target=browse, args=(
+        url, deadline, options.iterations, latencies, errors))
+        for _ in range(options.browsers)]
+    start = perf_counter()
+    for browser in browsers:
+        browser.start()
+    for browser in browsers:
+        browser.join()
+    elapsed = perf_counter() - start
+
+    server.shutdown()
+    stub.stop()
+
+    latencies.sort()
+    print('browsers      {0}'.format(options.browsers))
+    print('logins        {0} ok, {1} failed'.format(
+        len(latencies), len(errors)))
+    print('throughput    {0:.1f} logins/sec'.format(
+        len(latencies) / elapsed))
+    for percent in (50, 90, 99):
+        print('p{0:<12} {1:.2f} ms'.format(
+            percent, percentile(latencies, percent) * 1e3))
+    if latencies:
+        print('max           {0:.2f} ms'.format(latencies[-1] * 1e3))
+    print('CAS           {0[validations]} validations, '
+          '{0[failures]} failures'.format(stub.stats))
+    if errors:
+        print('first error   {0!r}'.format(errors[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,8 +14,31 @@ except ImportError:
     from flask import _request_ctx_stack as stack
 
 from . import routing
+from .attributes import create_attribute_codec
+from .breaker import CircuitBreaker
+from .cache import TTLCache
+from .flight import create_single_flight
+from .limits import create_rate_limiter
+from .settings import Settings
+from .metrics import PrometheusSink
+from .nodes import TicketAffinity
+from .nodes import create_node_set
+from .nodes import server_urls
+from .storage import MemorySessionIndex
+from .storage import create_attribute_store
+from .tenants import create_tenant_set
+from .transport import create_transport
 
+from collections import deque
 from functools import wraps
+import os
+import threading
+
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    def iscoroutinefunction(function):
+        return False
 
 class CAS(object):
     """
@@ -37,8 +60,66 @@ class CAS(object):
     |CAS_LOGOUT_ROUTE           | '/cas/logout'         |
     |CAS_VALIDATE_ROUTE         | '/cas/serviceValidate'|
     |CAS_AFTER_LOGOUT           | None                  |
+    |CAS_CONNECTION_POOL        | True                  |
+    |CAS_POOL_SIZE              | 10                    |
+    |CAS_POOL_MAX_IDLE          | 60                    |
+    |CAS_POOL_MAX_PER_HOST      | None                  |
+    |CAS_CONNECT_TIMEOUT        | 5                     |
+    |CAS_READ_TIMEOUT           | 10                    |
+    |CAS_VALIDATE_TIMEOUT       | 15                    |
+    |CAS_BREAKER_THRESHOLD      | 5                     |
+    |CAS_BREAKER_RECOVERY_TIME  | 30                    |
+    |CAS_UNAVAILABLE_ENDPOINT   | None                  |
+    |CAS_MAX_RESPONSE_SIZE      | 1048576               |
+    |CAS_TICKET_CACHE_SIZE      | 0                     |
+    |CAS_TICKET_CACHE_TTL       | 300                   |
+    |CAS_VALIDATE_CONCURRENCY   | 10                    |
+    |CAS_PROXY_ROUTE            | '/cas/proxy'          |
+    |CAS_PROXY_VALIDATE_ROUTE   | '/cas/proxyValidate'  |
+    |CAS_PROXY_CALLBACK         | False                 |
+    |CAS_ACCEPT_PROXY_TICKETS   | False                 |
+    |CAS_PGT_SESSION_KEY        | _CAS_PGT_IOU          |
+    |CAS_PGT_STORE_SIZE         | 1024                  |
+    |CAS_PGT_STORE_TTL          | 7200                  |
+    |CAS_SINGLE_LOGOUT          | False                 |
+    |CAS_SESSION_ID_KEY         | _CAS_SESSION_ID       |
+    |CAS_SESSION_INDEX_SIZE     | 100000                |
+    |CAS_SESSION_INDEX_TTL      | 86400                 |
+    |CAS_SLO_BATCH_SIZE         | 100                   |
+    |CAS_ATTRIBUTE_STORE        | None                  |
+    |CAS_ATTRIBUTE_STORE_PATH   | 'cas_attributes.db'   |
+    |CAS_ATTRIBUTE_STORE_SIZE   | 10000                 |
+    |CAS_ATTRIBUTE_STORE_TTL    | 86400                 |
+    |CAS_ATTRIBUTES_HANDLE_KEY  | _CAS_ATTRIBUTES_HANDLE|
+    |CAS_METRICS                | False                 |
+    |CAS_METRICS_ENDPOINT       | False                 |
+    |CAS_SERVER_TIMING          | False                 |
+    |CAS_PROFILE_HOOK           | None                  |
+    |CAS_PROTOCOL               | '2.0'                 |
+    |CAS_HEDGE_DELAY            | None                  |
+    |CAS_NODE_EWMA_ALPHA        | 0.3                   |
+    |CAS_NODE_PROBE_INTERVAL    | 5                     |
+    |CAS_NODE_PROBE_ROUTE       | None                  |
+    |CAS_TICKET_AFFINITY        | None                  |
+    |CAS_GATEWAY_SESSION_KEY    | _CAS_GATEWAY          |
+    |CAS_GATEWAY_WINDOW         | 300                   |
+    |CAS_KEEP_ATTRIBUTES        | None                  |
+    |CAS_COMPACT_ATTRIBUTES     | False                 |
+    |CAS_GROUP_CACHE_SIZE       | 4096                  |
+    |CAS_GROUP_CACHE_TTL        | None                  |
+    |CAS_SINGLE_FLIGHT          | True                  |
+    |CAS_NEGATIVE_CACHE_SIZE    | 1024                  |
+    |CAS_NEGATIVE_CACHE_TTL     | 60                    |
+    |CAS_RATE_LIMIT             | None                  |
+    |CAS_RATE_LIMIT_BURST       | 10                    |
+    |CAS_RATE_LIMIT_CLIENTS     | 10000                 |
+    |CAS_WARMUP                 | False                 |
+    |CAS_TENANTS                | None                  |
+    |CAS_TENANT_SELECTOR        | 'host'                |
     """
 
+    blueprint = routing.blueprint
+
     def __init__(self, app=None, url_prefix=None):
         self._app = app
         if app is not None:
@@ -54,8 +135,103 @@ class CAS(object):
         app.config.setdefault('CAS_VALIDATE_ROUTE', '/cas/serviceValidate')
         # Requires CAS 2.0
         app.config.setdefault('CAS_AFTER_LOGOUT', None)
+        # HTTP connection pool used to validate tickets
+        app.config.setdefault('CAS_CONNECTION_POOL', True)
+        app.config.setdefault('CAS_POOL_SIZE', 10)
+        app.config.setdefault('CAS_POOL_MAX_IDLE', 60)
+        app.config.setdefault('CAS_POOL_MAX_PER_HOST', None)
+        # Time budget and circuit breaker of the validation request
+        app.config.setdefault('CAS_CONNECT_TIMEOUT', 5)
+        app.config.setdefault('CAS_READ_TIMEOUT', 10)
+        app.config.setdefault('CAS_VALIDATE_TIMEOUT', 15)
+        app.config.setdefault('CAS_BREAKER_THRESHOLD', 5)
+        app.config.setdefault('CAS_BREAKER_RECOVERY_TIME', 30)
+        app.config.setdefault('CAS_UNAVAILABLE_ENDPOINT', None)
+        # Larger validation responses are rejected
+        app.config.setdefault('CAS_MAX_RESPONSE_SIZE', 1024 * 1024)
+        # Validated tickets remembered in process for the session which
+        # validated them, 0 disables the cache
+        app.config.setdefault('CAS_TICKET_CACHE_SIZE', 0)
+        app.config.setdefault('CAS_TICKET_CACHE_TTL', 300)
+        # Threads used by validate_many
+        app.config.setdefault('CAS_VALIDATE_CONCURRENCY', 10)
+        # CAS 2.0 proxy tickets
+        app.config.setdefault('CAS_PROXY_ROUTE', '/cas/proxy')
+        app.config.setdefault('CAS_PROXY_VALIDATE_ROUTE', '/cas/proxyValidate')
+        app.config.setdefault('CAS_PROXY_CALLBACK', False)
+        app.config.setdefault('CAS_ACCEPT_PROXY_TICKETS', False)
+        app.config.setdefault('CAS_PGT_SESSION_KEY', '_CAS_PGT_IOU')
+        app.config.setdefault('CAS_PGT_STORE_SIZE', 1024)
+        app.config.setdefault('CAS_PGT_STORE_TTL', 7200)
+        # Back-channel logout requests from the CAS
+        app.config.setdefault('CAS_SINGLE_LOGOUT', False)
+        app.config.setdefault('CAS_SESSION_ID_KEY', '_CAS_SESSION_ID')
+        app.config.setdefault('CAS_SESSION_INDEX_SIZE', 100000)
+        app.config.setdefault('CAS_SESSION_INDEX_TTL', 86400)
+        app.config.setdefault('CAS_SLO_BATCH_SIZE', 100)
+        # Server side storage of the attributes: None, 'memory' or 'sqlite'
+        app.config.setdefault('CAS_ATTRIBUTE_STORE', None)
+        app.config.setdefault('CAS_ATTRIBUTE_STORE_PATH', 'cas_attributes.db')
+        app.config.setdefault('CAS_ATTRIBUTE_STORE_SIZE', 10000)
+        app.config.setdefault('CAS_ATTRIBUTE_STORE_TTL', 86400)
+        app.config.setdefault(
+            'CAS_ATTRIBUTES_HANDLE_KEY', '_CAS_ATTRIBUTES_HANDLE')
+        # Instrumentation, and the /metrics route exposing it
+        app.config.setdefault('CAS_METRICS', False)
+        app.config.setdefault('CAS_METRICS_ENDPOINT', False)
+        # Per phase timing of the login route, as a Server-Timing header
+        # and/or passed to a callable
+        app.config.setdefault('CAS_SERVER_TIMING', False)
+        app.config.setdefault('CAS_PROFILE_HOOK', None)
+        # Validation protocol, see flask_cas.protocols
+        app.config.setdefault('CAS_PROTOCOL', '2.0')
+        # CAS clusters, when CAS_SERVER is a list of urls: seconds before
+        # a validation is also sent to a second node (None to never),
+        # weight of the latest response time in the latency average,
+        # and probes of unhealthy nodes
+        app.config.setdefault('CAS_HEDGE_DELAY', None)
+        app.config.setdefault('CAS_NODE_EWMA_ALPHA', 0.3)
+        app.config.setdefault('CAS_NODE_PROBE_INTERVAL', 5)
+        app.config.setdefault('CAS_NODE_PROBE_ROUTE', None)
+        # CAS urls keyed by the node suffix of the tickets they issue
+        app.config.setdefault('CAS_TICKET_AFFINITY', None)
+        # Time of the last gateway check in the session, and seconds it
+        # is trusted by login_optional (None for the whole session)
+        app.config.setdefault('CAS_GATEWAY_SESSION_KEY', '_CAS_GATEWAY')
+        app.config.setdefault('CAS_GATEWAY_WINDOW', 300)
+        # Attributes kept for the user (None for all of them) and their
+        # encoding in the session, see flask_cas.attributes
+        app.config.setdefault('CAS_KEEP_ATTRIBUTES', None)
+        app.config.setdefault('CAS_COMPACT_ATTRIBUTES', False)
+        # Group sets of the logged in users kept in process, and seconds
+        # they are kept (None for the permanent session lifetime)
+        app.config.setdefault('CAS_GROUP_CACHE_SIZE', 4096)
+        app.config.setdefault('CAS_GROUP_CACHE_TTL', None)
+        # Concurrent validations of the same ticket share one request
+        app.config.setdefault('CAS_SINGLE_FLIGHT', True)
+        # Tickets rejected by the CAS remembered in process, 0 disables
+        # the cache
+        app.config.setdefault('CAS_NEGATIVE_CACHE_SIZE', 1024)
+        app.config.setdefault('CAS_NEGATIVE_CACHE_TTL', 60)
+        # Validation attempts per second and client IP (None for no
+        # limit), burst allowed, and number of clients tracked
+        app.config.setdefault('CAS_RATE_LIMIT', None)
+        app.config.setdefault('CAS_RATE_LIMIT_BURST', 10)
+        app.config.setdefault('CAS_RATE_LIMIT_CLIENTS', 10000)
+        # Check the configuration and connect to the CAS in init_app,
+        # see CAS.warmup
+        app.config.setdefault('CAS_WARMUP', False)
+        # CAS_* overrides keyed by tenant, and how the tenant of a
+        # request is found: 'host', 'prefix' or a callable, see
+        # flask_cas.tenants
+        app.config.setdefault('CAS_TENANTS', None)
+        app.config.setdefault('CAS_TENANT_SELECTOR', 'host')
+        # Per application state shared with the blueprint
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['cas'] = _CASState(app)
         # Register Blueprint
-        app.register_blueprint(routing.blueprint, url_prefix=url_prefix)
+        app.register_blueprint(self.blueprint, url_prefix=url_prefix)
 
         # Use the newstyle teardown_appcontext if it's available,
         # otherwise fall back to the request context
@@ -64,6 +240,9 @@ class CAS(object):
         else:
             app.teardown_request(self.teardown)
 
+        if app.config['CAS_WARMUP']:
+            self.warmup(app)
+
     def teardown(self, exception):
         ctx = stack.top
     
@@ -71,20 +250,411 @@ class CAS(object):
     def app(self):
         return self._app or current_app
 
+    @property
+    def principal(self):
+        """ The `Principal` of the current request. """
+        return routing.get_principal()
+
     @property
     def username(self):
-        return flask.session.get(
-            self.app.config['CAS_USERNAME_SESSION_KEY'], None)
+        return routing.get_principal().username
 
     @property
     def attributes(self):
-        return flask.session.get(
-            self.app.config['CAS_ATTRIBUTES_SESSION_KEY'], None)
+        return routing.get_principal().attributes
+
+    @property
+    def groups(self):
+        """ Frozenset of the groups (`cas:memberOf`) of the user. """
+        return routing.get_principal().groups
+
+    @property
+    def attribute_store(self):
+        """ The `AttributeStore`, or None if attributes are kept in the
+        session. """
+        return routing._state(self._app).attribute_store
+
+    @attribute_store.setter
+    def attribute_store(self, store):
+        routing._state(self._app).attribute_store = store
 
     @property
     def token(self):
-        return flask.session.get(
-            self.app.config['CAS_TOKEN_SESSION_KEY'], None)
+        return routing.get_principal().token
+
+    @property
+    def transport(self):
+        return routing._state(self._app).transport
+
+    @transport.setter
+    def transport(self, transport):
+        routing._state(self._app).transport = transport
+
+    @property
+    def breaker(self):
+        """ The `CircuitBreaker` guarding calls to the CAS. """
+        return routing._state(self._app).breaker
+
+    @property
+    def nodes(self):
+        """ The `NodeSet` of the CAS cluster, or None if `CAS_SERVER`
+        is a single url. Each node has its own breaker. """
+        return routing._state(self._app).nodes
+
+    @property
+    def ticket_cache(self):
+        """ The `TTLCache` of validated tickets. """
+        return routing._state(self._app).ticket_cache
+
+    @property
+    def rejected_tickets(self):
+        """ The `TTLCache` of tickets recently rejected by the CAS. """
+        return routing._state(self._app).rejected_tickets
+
+    @property
+    def rate_limiter(self):
+        """ The `RateLimiter` of validation attempts per client IP, or
+        None if `CAS_RATE_LIMIT` is not set. """
+        return routing._state(self._app).rate_limiter
+
+    @property
+    def pgt_store(self):
+        """ The store mapping PGTIOUs to proxy granting tickets. """
+        return routing._state(self._app).pgt_store
+
+    @pgt_store.setter
+    def pgt_store(self, store):
+        routing._state(self._app).pgt_store = store
+
+    @property
+    def session_index(self):
+        """ The `SessionIndex` used by single logout. """
+        return routing._state(self._app).session_index
+
+    @session_index.setter
+    def session_index(self, index):
+        routing._state(self._app).session_index = index
+
+    @property
+    def metrics(self):
+        """ The `MetricsSink`, or None if instrumentation is off. """
+        return routing._state(self._app).metrics
+
+    @metrics.setter
+    def metrics(self, sink):
+        routing._state(self._app).metrics = sink
+
+    def get_proxy_ticket(self, target_service):
+        """
+        Return a proxy ticket of the logged in user for `target_service`.
+        See `routing.get_proxy_ticket`.
+        """
+        return routing.get_proxy_ticket(target_service)
+
+    def validate_many(self, tickets, service, tenant=None):
+        """
+        Validate several tickets concurrently, outside of any request.
+        See `routing.validate_many`.
+        """
+        return routing.validate_many(
+            tickets, service, self._app or current_app._get_current_object(),
+            tenant)
+
+    def warmup(self, app=None, url_root=None, connections=1, tenants=False):
+        """
+        Prepare the application for its first login: check the
+        configuration, create the validation machinery, build the CAS
+        urls and open `connections` connections to each CAS server.
+        Raises `ValueError` if the configuration is invalid.
+
+        This freezes the `CAS_*` configuration, so call it once it is
+        complete, and in each worker after the server forks. With
+        `CAS_WARMUP` set, `init_app` calls it. With `tenants`, every
+        tenant of `CAS_TENANTS` is prepared too. See `routing.warmup`.
+
+        Example usage:
+        >>> app = flask.Flask(__name__)
+        >>> app.config['CAS_SERVER'] = 'https://sso.pdx.edu'
+        >>> cas = CAS(app)
+        >>> cas.warmup(app)
+        Traceback (most recent call last):
+            ...
+        ValueError: Invalid CAS configuration: CAS_AFTER_LOGIN is not set
+        """
+        routing.warmup(
+            app or self._app or current_app._get_current_object(),
+            url_root, connections, tenants)
+
+
+class _CASState(object):
+    """
+    State kept per application in `app.extensions['cas']`, and per
+    tenant in its `tenants` (see `flask_cas.tenants`).
+
+    The members are created on first use so that configuration set
+    after `init_app` is honored. The `CAS_*` configuration is frozen
+    into `settings` at that point.
+    """
+
+    def __init__(self, app, config=None, tenant=None):
+        self.app = app
+        # The configuration of a tenant, None for the application's
+        self._config = config
+        self.tenant = tenant
+        self._lock = threading.Lock()
+        self._settings = None
+        self._tenants = None
+        self._tenants_set = False
+        # CASURLs per url root of the requests, see routing._cas_urls
+        self.urls = TTLCache(maxsize=64, ttl=float('inf'))
+        self._transport = None
+        self._breaker = None
+        self._ticket_cache = None
+        self._rejected_tickets = None
+        self._group_sets = None
+        self._rate_limiter = None
+        self._rate_limiter_set = False
+        self._executor = None
+        self._executor_pid = None
+        self._hedge_executor = None
+        self._hedge_executor_pid = None
+        self._pgt_store = None
+        self._session_index = None
+        self._attribute_store = None
+        self._attribute_store_set = False
+        self._metrics = None
+        self._metrics_set = False
+        self._nodes = None
+        self._nodes_set = False
+        self._affinity = None
+        self._affinity_set = False
+        self._attribute_codec = None
+        self._attribute_codec_set = False
+        self._flights = None
+        self._flights_set = False
+        # Single logout requests waiting to be applied, see routing._revoke
+        self.pending_logouts = deque()
+        self.logout_lock = threading.Lock()
+
+    @property
+    def config(self):
+        if self._config is None:
+            return self.app.config
+        return self._config
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            self._settings = Settings(self.config)
+        return self._settings
+
+    @property
+    def tenants(self):
+        if not self._tenants_set:
+            with self._lock:
+                if not self._tenants_set:
+                    self._tenants = create_tenant_set(self)
+                    self._tenants_set = True
+        return self._tenants
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = create_transport(self.config)
+        return self._transport
+
+    @property
+    def breaker(self):
+        if self._breaker is None:
+            with self._lock:
+                if self._breaker is None:
+                    self._breaker = CircuitBreaker(
+                        self.settings.breaker_threshold,
+                        self.settings.breaker_recovery_time)
+        return self._breaker
+
+    @property
+    def ticket_cache(self):
+        if self._ticket_cache is None:
+            with self._lock:
+                if self._ticket_cache is None:
+                    self._ticket_cache = TTLCache(
+                        self.settings.ticket_cache_size,
+                        self.settings.ticket_cache_ttl)
+        return self._ticket_cache
+
+    @property
+    def rejected_tickets(self):
+        if self._rejected_tickets is None:
+            with self._lock:
+                if self._rejected_tickets is None:
+                    self._rejected_tickets = TTLCache(
+                        self.settings.negative_cache_size,
+                        self.settings.negative_cache_ttl)
+        return self._rejected_tickets
+
+    @property
+    def group_sets(self):
+        # The usernames and group sets of the users logged in by this
+        # process, keyed by session token, see routing._load_groups
+        if self._group_sets is None:
+            with self._lock:
+                if self._group_sets is None:
+                    ttl = self.settings.group_cache_ttl
+                    if ttl is None:
+                        ttl = self.app.permanent_session_lifetime
+                        ttl = ttl.total_seconds()
+                    self._group_sets = TTLCache(
+                        self.settings.group_cache_size, ttl)
+        return self._group_sets
+
+    @property
+    def rate_limiter(self):
+        if not self._rate_limiter_set:
+            with self._lock:
+                if not self._rate_limiter_set:
+                    self._rate_limiter = create_rate_limiter(self.settings)
+                    self._rate_limiter_set = True
+        return self._rate_limiter
+
+    @property
+    def executor(self):
+        # Worker threads do not survive a fork, start a new pool in the
+        # child.
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if (self._executor is None or
+                        self._executor_pid != os.getpid()):
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.settings.validate_concurrency)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    @property
+    def hedge_executor(self):
+        # The hedges of validations, see routing._fetch_hedged; the
+        # first request runs on the request thread. Apart from the
+        # executor of validate_many, whose workers wait for them. One
+        # worker per pooled connection to each node.
+        if (self._hedge_executor is None or
+                self._hedge_executor_pid != os.getpid()):
+            with self._lock:
+                if (self._hedge_executor is None or
+                        self._hedge_executor_pid != os.getpid()):
+                    from concurrent.futures import ThreadPoolExecutor
+                    nodes = len(server_urls(self.settings.server))
+                    size = self.config.get('CAS_POOL_SIZE') or 1
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=max(size * nodes, 2))
+                    self._hedge_executor_pid = os.getpid()
+        return self._hedge_executor
+
+    @property
+    def pgt_store(self):
+        if self._pgt_store is None:
+            with self._lock:
+                if self._pgt_store is None:
+                    self._pgt_store = TTLCache(
+                        self.settings.pgt_store_size,
+                        self.settings.pgt_store_ttl)
+        return self._pgt_store
+
+    @property
+    def session_index(self):
+        if self._session_index is None:
+            with self._lock:
+                if self._session_index is None:
+                    self._session_index = MemorySessionIndex(
+                        self.settings.session_index_size,
+                        self.settings.session_index_ttl)
+        return self._session_index
+
+    @property
+    def attribute_store(self):
+        if not self._attribute_store_set:
+            with self._lock:
+                if not self._attribute_store_set:
+                    self._attribute_store = create_attribute_store(
+                        self.settings)
+                    self._attribute_store_set = True
+        return self._attribute_store
+
+    @property
+    def metrics(self):
+        if not self._metrics_set:
+            with self._lock:
+                if not self._metrics_set:
+                    if self.settings.metrics:
+                        self._metrics = PrometheusSink()
+                    self._metrics_set = True
+        return self._metrics
+
+    @property
+    def nodes(self):
+        if not self._nodes_set:
+            with self._lock:
+                if not self._nodes_set:
+                    self._nodes = create_node_set(
+                        self.settings,
+                        lambda url, timeout: self.transport.open(url, timeout))
+                    self._nodes_set = True
+        return self._nodes
+
+    @property
+    def affinity(self):
+        if not self._affinity_set:
+            with self._lock:
+                if not self._affinity_set:
+                    if self.settings.ticket_affinity:
+                        self._affinity = TicketAffinity(
+                            self.settings.ticket_affinity)
+                    self._affinity_set = True
+        return self._affinity
+
+    @property
+    def attribute_codec(self):
+        if not self._attribute_codec_set:
+            with self._lock:
+                if not self._attribute_codec_set:
+                    self._attribute_codec = create_attribute_codec(
+                        self.settings)
+                    self._attribute_codec_set = True
+        return self._attribute_codec
+
+    @property
+    def flights(self):
+        if not self._flights_set:
+            with self._lock:
+                if not self._flights_set:
+                    self._flights = create_single_flight(self.settings)
+                    self._flights_set = True
+        return self._flights
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @pgt_store.setter
+    def pgt_store(self, store):
+        self._pgt_store = store
+
+    @session_index.setter
+    def session_index(self, index):
+        self._session_index = index
+
+    @attribute_store.setter
+    def attribute_store(self, store):
+        self._attribute_store = store
+        self._attribute_store_set = True
+
+    @metrics.setter
+    def metrics(self, sink):
+        self._metrics = sink
+        self._metrics_set = True
+
 
 def login():
     return flask.redirect(flask.url_for('cas.login', _external=True))
@@ -93,11 +663,116 @@ def logout():
     return flask.redirect(flask.url_for('cas.logout', _external=True))
 
 def login_required(function):
+    if iscoroutinefunction(function):
+        from .aio import login_required as async_login_required
+        return async_login_required(function)
+
     @wraps(function)
     def wrap(*args, **kwargs):
-        if 'CAS_USERNAME' not in flask.session:
-            flask.session['CAS_AFTER_LOGIN_SESSION_URL'] = flask.request.url
-            return login()
-        else:
-            return function(*args, **kwargs)
+        response = _login_check()
+        if response is not None:
+            return response
+        return function(*args, **kwargs)
     return wrap
+
+
+def _login_check():
+    """
+    Send the user to the login route if they are not logged in.
+    """
+    if not routing.get_principal().is_authenticated:
+        flask.session['CAS_AFTER_LOGIN_SESSION_URL'] = flask.request.url
+        return login()
+
+
+def login_optional(function):
+    """
+    Decorator logging the user in if they have a single sign-on session
+    with the CAS, and running the view either way.
+
+    Logged out users are sent through a gateway check (see
+    `routing.gateway`) and back, which never shows them the CAS login
+    page. The outcome is remembered for `CAS_GATEWAY_WINDOW` seconds, so
+    the view is reached directly until then.
+
+    Example usage:
+
+        @app.route('/')
+        @login_optional
+        def route_root():
+            ...
+    """
+    if iscoroutinefunction(function):
+        from .aio import login_optional as async_login_optional
+        return async_login_optional(function)
+
+    @wraps(function)
+    def wrap(*args, **kwargs):
+        response = _gateway_check()
+        if response is not None:
+            return response
+        return function(*args, **kwargs)
+    return wrap
+
+
+def _gateway_check():
+    """
+    Send logged out users through a gateway check, unless one was done
+    recently. Only GET requests are redirected, others would lose their
+    body.
+    """
+    if (flask.request.method == 'GET' and
+            not routing.get_principal().is_authenticated and
+            not routing.gateway_checked()):
+        flask.session['CAS_AFTER_LOGIN_SESSION_URL'] = flask.request.url
+        return routing._gateway_redirect()
+
+
+def group_required(*groups):
+    """
+    Decorator requiring the user to be a member of all of `groups`.
+    Logged out users are sent to the login route, users missing a group
+    get a 403 error.
+
+    Example usage:
+
+        @app.route('/admin')
+        @group_required('cn=admins')
+        def route_admin():
+            ...
+    """
+    required = frozenset(groups)
+    return _group_decorator(lambda user_groups: required <= user_groups)
+
+
+def any_group_required(*groups):
+    """
+    Decorator requiring the user to be a member of at least one of
+    `groups`. See `group_required`.
+    """
+    required = frozenset(groups)
+    return _group_decorator(
+        lambda user_groups: not required.isdisjoint(user_groups))
+
+
+def _group_decorator(allowed):
+    def decorator(function):
+        def check():
+            response = _login_check()
+            if response is not None:
+                return response
+            if not allowed(routing.get_principal().groups):
+                flask.abort(403)
+
+        if iscoroutinefunction(function):
+            from .aio import guarded
+            return guarded(function, check)
+
+        @wraps(function)
+        def wrap(*args, **kwargs):
+            response = check()
+            if response is not None:
+                return response
+            return function(*args, **kwargs)
+        return wrap
+    return decorator
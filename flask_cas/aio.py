@@ -0,0 +1,715 @@
+"""
+flask_cas.aio
+
+Asynchronous counterparts of the validation path and the blueprint
+views, for applications using async views or running behind an ASGI
+bridge. Validation runs on asyncio streams, so many logins can wait
+for the CAS on a single event loop without holding a thread each.
+
+Requires Python 3.5+. The synchronous API is not affected by this
+module and does not import it.
+
+Example usage:
+
+    from flask_cas.aio import AsyncCAS
+    from flask_cas.aio import login_required
+
+    cas = AsyncCAS(app)
+
+    @app.route('/')
+    @login_required
+    async def route_root():
+        ...
+"""
+
+import asyncio
+import errno
+import time
+
+from functools import wraps
+from urllib.parse import urlsplit
+
+import flask
+from flask import current_app
+
+from . import CAS
+from . import routing
+from . import timing
+from .breaker import CASUnavailableError
+from .breaker import CircuitOpenError
+from .limits import RateLimitedError
+from .parsing import CHUNK_SIZE
+from .parsing import InvalidResponseError
+from .parsing import ServiceResponseParser
+from .parsing import ValidationResult
+from .transport import DeadlineExceeded
+from .transport import stale_connection
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+class AsyncTransport(object):
+    """ Interface of the object performing CAS requests asynchronously.
+
+    `open` is a coroutine returning a response whose `read` coroutine
+    returns the body. Non 2xx responses must raise `HTTPStatusError`.
+    `data`, if given, is POSTed as an XML document.
+    """
+
+    async def open(self, url, timeout=None, data=None):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class HTTPStatusError(IOError):
+    """ The CAS answered with a non 2xx status. """
+
+    def __init__(self, url, status, reason):
+        IOError.__init__(self, '{0} {1}'.format(status, reason))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class BadResponseError(IOError):
+    """ The CAS answered with something which is not HTTP. """
+
+
+def _wait(awaitable, limit):
+    if limit is None:
+        return awaitable
+    return asyncio.wait_for(awaitable, limit)
+
+
+async def _readline(reader, limit):
+    try:
+        return await _wait(reader.readline(), limit)
+    except ValueError as error:
+        # Longer than the buffer limit of the stream
+        raise BadResponseError(error)
+
+
+class _AsyncResponse(object):
+    """ Response of `AsyncioTransport`. The connection is handed back
+    to the pool once the body has been read completely.
+    """
+
+    def __init__(self, pool, key, reader, writer, status, reason, headers,
+                 timeout):
+        self._pool = pool
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '')
+        self._length = None
+        if not self._chunked and 'content-length' in headers:
+            try:
+                self._length = int(headers['content-length'])
+            except ValueError:
+                raise BadResponseError('Invalid Content-Length {0!r}'.format(
+                    headers['content-length']))
+        self._keep_alive = (headers.get('connection', '').lower() != 'close' and
+                            (self._chunked or self._length is not None))
+        self._done = False
+
+    def _read_timeout(self):
+        if self._timeout is None:
+            return None
+        return self._timeout.read_timeout()
+
+    async def _read_chunk(self):
+        """ Return the next piece of the body, b'' at its end. """
+        if self._done:
+            return b''
+        reader = self._reader
+        if self._chunked:
+            line = await _readline(reader, self._read_timeout())
+            try:
+                size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+            except ValueError:
+                raise BadResponseError('Invalid chunk size {0!r}'.format(line))
+            if size == 0:
+                # Skip trailers up to the empty line
+                while (await _readline(reader, self._read_timeout())).strip():
+                    pass
+                self._done = True
+                return b''
+            data = await _wait(reader.readexactly(size + 2),
+                               self._read_timeout())
+            return data[:-2]
+        if self._length is not None:
+            if self._length == 0:
+                self._done = True
+                return b''
+            data = await _wait(reader.read(min(self._length, 16 * 1024)),
+                               self._read_timeout())
+            if not data:
+                raise asyncio.IncompleteReadError(data, self._length)
+            self._length -= len(data)
+            return data
+        data = await _wait(reader.read(16 * 1024), self._read_timeout())
+        if not data:
+            self._done = True
+        return data
+
+    async def read(self, amt=None):
+        """ Return the whole body, or the next piece of it if `amt` is
+        given. """
+        if amt is not None:
+            try:
+                chunk = await self._read_chunk()
+            except BaseException:
+                self.close()
+                raise
+            if not chunk:
+                self.close()
+            return chunk
+        chunks = []
+        try:
+            while True:
+                chunk = await self._read_chunk()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except BaseException:
+            self.close()
+            raise
+        self.close()
+        return b''.join(chunks)
+
+    def close(self):
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        self._pool._release(self._key, self._reader, writer,
+                            self._done and self._keep_alive)
+
+
+class AsyncioTransport(AsyncTransport):
+    """ HTTP/1.1 client on asyncio streams with keep-alive connections.
+
+    Connections belong to the event loop which opened them, so the pool
+    is kept per loop. Flask runs each coroutine view on an event loop of
+    its own, closed once the view returns: the login view of `AsyncCAS`
+    closes the connections of its loop with `close_idle` before that,
+    so connections are only reused by code validating tickets on a
+    long-lived loop. Connections of loops which have been closed are
+    dropped.
+
+    Keyword arguments:
+    pool_size -- Idle connections kept per host and event loop.
+    max_idle -- Seconds an idle connection may be kept.
+    ssl_context -- The `SSLContext` used for https urls.
+    """
+
+    def __init__(self, pool_size=10, max_idle=60, ssl_context=None):
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        if ssl_context is None and ssl is not None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+        self._idle = {}
+
+    def _pool_key(self, key):
+        return (asyncio.get_event_loop(),) + key
+
+    def _prune(self):
+        for key in [key for key in self._idle if key[0].is_closed()]:
+            del self._idle[key]
+
+    def _release(self, key, reader, writer, reusable):
+        idle = self._idle.setdefault(key, [])
+        if reusable and len(idle) < self.pool_size:
+            idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    async def _connect(self, key, timeout):
+        self._prune()
+        idle = self._idle.get(key)
+        now = time.time()
+        while idle:
+            reader, writer, released_at = idle.pop()
+            if now - released_at <= self.max_idle and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        _, scheme, host, port = key
+        connect = asyncio.open_connection(
+            host, port,
+            ssl=self.ssl_context if scheme == 'https' else None)
+        reader, writer = await _wait(
+            connect, timeout.connect_timeout() if timeout else None)
+        return reader, writer, False
+
+    async def _request(self, reader, writer, host, path, timeout, data=None):
+        if data is None:
+            writer.write(
+                'GET {0} HTTP/1.1\r\nHost: {1}\r\nConnection: keep-alive\r\n'
+                'Accept-Encoding: identity\r\n\r\n'.format(path, host)
+                .encode('latin-1'))
+        else:
+            writer.write(
+                'POST {0} HTTP/1.1\r\nHost: {1}\r\nConnection: keep-alive\r\n'
+                'Accept-Encoding: identity\r\n'
+                'Content-Type: text/xml; charset=utf-8\r\n'
+                'Content-Length: {2}\r\n\r\n'.format(path, host, len(data))
+                .encode('latin-1') + data)
+        limit = timeout.read_timeout() if timeout else None
+        await _wait(writer.drain(), limit)
+        status_line = await _readline(reader, limit)
+        if not status_line:
+            raise ConnectionResetError(
+                errno.ECONNRESET, 'Connection closed by the CAS')
+        version, status, reason = (
+            status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        if not status.isdigit():
+            raise BadResponseError(
+                'Invalid status line {0!r}'.format(status_line))
+        headers = {}
+        while True:
+            line = await _readline(reader, limit)
+            line = line.decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return int(status), reason, headers
+
+    async def open(self, url, timeout=None, data=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = self._pool_key((scheme, parts.hostname, port))
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+
+        timer = timing.current()
+        writer = None
+        try:
+            started = timing.clock()
+            reader, writer, reused = await self._connect(key, timeout)
+            if timer is not None and not reused:
+                # Name resolution and the TLS handshake happen inside
+                # asyncio.open_connection, they are part of this phase
+                started = timer.record('connect', started)
+            try:
+                status, reason, headers = await self._request(
+                    reader, writer, parts.netloc, path, timeout, data)
+            except (OSError, asyncio.IncompleteReadError) as error:
+                if not reused or not stale_connection(error):
+                    raise
+                # The server closed an idle keep-alive connection, retry
+                # once on a fresh one.
+                writer.close()
+                writer = None
+                for stale in self._idle.pop(key, ()):
+                    stale[1].close()
+                reader, writer, reused = await self._connect(key, timeout)
+                status, reason, headers = await self._request(
+                    reader, writer, parts.netloc, path, timeout, data)
+            if timer is not None:
+                timer.record('ttfb', started)
+            response = _AsyncResponse(self, key, reader, writer, status,
+                                      reason, headers, timeout)
+        except BaseException as error:
+            # Failed or cancelled in the middle of the request
+            if writer is not None:
+                writer.close()
+            if isinstance(error, asyncio.TimeoutError):
+                raise DeadlineExceeded('CAS request timed out')
+            raise
+
+        if not 200 <= status < 300:
+            await response.read()
+            raise HTTPStatusError(url, status, reason)
+        return response
+
+    async def close_idle(self):
+        """ Close the idle connections of the running event loop, which
+        cannot be used anymore once it is closed. """
+        loop = asyncio.get_event_loop()
+        for key in [key for key in self._idle if key[0] is loop]:
+            for reader, writer, released_at in self._idle.pop(key):
+                # No TLS shutdown, the socket is closed at once
+                writer.transport.abort()
+        # Let the transports close their sockets
+        await asyncio.sleep(0)
+
+    def close(self):
+        for idle in self._idle.values():
+            for reader, writer, released_at in idle:
+                writer.close()
+        self._idle = {}
+
+
+def _transport():
+    state = routing._state()
+    if getattr(state, 'async_transport', None) is None:
+        state.async_transport = AsyncioTransport(
+            pool_size=state.config['CAS_POOL_SIZE'],
+            max_idle=state.config['CAS_POOL_MAX_IDLE'])
+    return state.async_transport
+
+
+async def urlopen(url, timeout=None, data=None):
+    """
+    Open `url` with the asynchronous transport of the current
+    application. `data`, if given, is POSTed.
+    """
+    if data is None:
+        return await _transport().open(url, timeout)
+    return await _transport().open(url, timeout, data)
+
+
+async def parse_response(response, max_size,
+                         parser_class=ServiceResponseParser):
+    """
+    Coroutine counterpart of `parsing.parse_response`.
+    """
+    parser = parser_class(max_size)
+    timer = timing.current()
+    reading = parsing = 0
+    clock = timing.clock
+    try:
+        while not parser.done:
+            started = clock()
+            chunk = await response.read(CHUNK_SIZE)
+            read_at = clock()
+            reading += read_at - started
+            if not chunk:
+                break
+            parser.feed(chunk)
+            parsing += clock() - read_at
+        size = parser.size
+        started = clock()
+        while parser.done and (max_size is None or size <= max_size):
+            chunk = await response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+        reading += clock() - started
+    finally:
+        response.close()
+    started = clock()
+    result = parser.close()
+    if timer is not None:
+        timer.add('read', reading)
+        timer.add('parse', parsing + clock() - started)
+    return result
+
+
+async def validate(ticket):
+    """
+    Asynchronous counterpart of `routing.validate`. The username and
+    attributes are saved in the session in the same way.
+    """
+
+    state = routing._state()
+    timer = timing.current()
+    started = timing.clock()
+    urls = routing._cas_urls()
+    metrics = state.metrics
+    key = (ticket, urls.service)
+
+    client = flask.request.remote_addr
+    session = flask.session
+    result = routing._cached_validation(state, key, client, session)
+    if result is not None:
+        if timer is not None:
+            timer.record('urls', started)
+            return routing._timed_save(timer, result, ticket)
+        return routing._save_validation(result, ticket)
+
+    flights = state.flights
+    if flights is None:
+        result = await _validate_uncached(state, urls, ticket, started)
+    else:
+        flight_key = routing._flight_key(key, client, session)
+        future, leader = flights.begin(flight_key)
+        if leader:
+            try:
+                result = await _validate_uncached(
+                    state, urls, ticket, started)
+            except BaseException as error:
+                flights.end(flight_key, future, error=error)
+                raise
+            flights.end(flight_key, future, result)
+        else:
+            # Shielded: cancelling this request must not cancel the
+            # call the other requests wait for.
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            routing._count_coalesced(ticket, metrics)
+    if timer is not None:
+        return routing._timed_save(timer, result, ticket)
+    return routing._save_validation(result, ticket)
+
+
+async def _validate_uncached(state, urls, ticket, started):
+    """
+    Validate `ticket` against the CAS, see `validate`.
+    """
+    timer = timing.current()
+    metrics = state.metrics
+    current_app.logger.debug("validating token {0}".format(ticket))
+    nodes = state.nodes
+    affinity = state.affinity
+    server = affinity.lookup(ticket) if affinity is not None else None
+    try:
+        if nodes is None:
+            url = urls.validate(ticket, server=server)
+            if timer is not None:
+                timer.record('urls', started)
+            result = await _fetch(url, urls.protocol, ticket)
+        else:
+            result = await _fetch_from_nodes(nodes, urls, ticket, server)
+    except CASUnavailableError as error:
+        if metrics is not None:
+            routing._count_validation(metrics, error=error)
+        raise
+
+    routing._finish_validation(result)
+    routing._remember_validation(state, (ticket, urls.service), result)
+    if metrics is not None:
+        routing._count_validation(metrics, result)
+    return result
+
+
+async def _fetch_from_nodes(nodes, urls, ticket, prefer=None):
+    """
+    Coroutine counterpart of `routing._fetch_from_nodes`. The hedged
+    request is a task of the same event loop; the request still running
+    when the other one succeeds is cancelled.
+    """
+
+    candidates = nodes.ranked(prefer)
+    delay = routing._settings().hedge_delay
+    error = None
+    if delay is None or len(candidates) < 2:
+        for node in candidates:
+            try:
+                return await _fetch_node(node, urls, ticket)
+            except CASUnavailableError as exc:
+                if error is None or isinstance(error, CircuitOpenError):
+                    error = exc
+        raise error
+
+    pending = list(candidates)
+    tasks = set()
+
+    def start():
+        tasks.add(asyncio.ensure_future(
+            _fetch_node(pending.pop(0), urls, ticket)))
+
+    start()
+    hedged = False
+    failure = None
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, timeout=delay if pending and not hedged else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                start()
+                continue
+            for task in done:
+                try:
+                    result = task.result()
+                except CASUnavailableError as exc:
+                    if error is None or isinstance(error, CircuitOpenError):
+                        error = exc
+                    if pending:
+                        start()
+                    continue
+                if result.success:
+                    return result
+                failure = result
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # Let the cancelled requests close their connections
+            await asyncio.wait(tasks)
+    if failure is not None:
+        return failure
+    raise error
+
+
+async def _fetch_node(node, urls, ticket):
+    return await _fetch(urls.validate(ticket, server=node.url),
+                        urls.protocol, ticket, node)
+
+
+async def _fetch(url, protocol, ticket, node=None):
+    """
+    Coroutine counterpart of `routing._fetch`, validating `ticket` at
+    `url` with `protocol`.
+    """
+
+    state = routing._state()
+    if node is None:
+        breaker = state.breaker
+    else:
+        breaker = node.breaker
+    timeout = routing._prepare_request(url, breaker)
+    metrics = state.metrics
+    started = timing.clock()
+
+    try:
+        result = await parse_response(
+            await urlopen(url, timeout, protocol.body(ticket)),
+            state.settings.max_response_size, protocol.parser_class)
+    except (IOError, asyncio.TimeoutError,
+            asyncio.IncompleteReadError) as error:
+        if node is None:
+            breaker.record_failure()
+        else:
+            state.nodes.record_failure(node)
+        if metrics is not None:
+            metrics.increment('cas_request_errors_total',
+                              (('kind', 'validate'),))
+        raise CASUnavailableError(error)
+    except InvalidResponseError as error:
+        current_app.logger.error(
+            "CAS returned unexpected result: {0}".format(error))
+        result = ValidationResult(False)
+    except BaseException:
+        # Cancelled (ex. the other hedged request won) or unexpected:
+        # nothing to record, give the probe of a half-open breaker back
+        breaker.release()
+        raise
+    elapsed = timing.clock() - started
+    if node is None:
+        breaker.record_success()
+    else:
+        state.nodes.record_success(node, elapsed)
+    if metrics is not None:
+        metrics.observe('cas_request_seconds', elapsed,
+                        (('kind', 'validate'),))
+    return result
+
+
+blueprint = flask.Blueprint('cas', __name__)
+blueprint.before_app_request(routing._check_revoked)
+blueprint.url_value_preprocessor(routing._pop_tenant)
+blueprint.url_defaults(routing._add_tenant)
+# The routes which do not contact the CAS are shared with the
+# synchronous blueprint.
+blueprint.add_url_rule('/proxyCallback/', 'proxy_callback',
+                       routing.proxy_callback)
+blueprint.add_url_rule('/metrics', 'metrics', routing.metrics)
+blueprint.add_url_rule('/gateway/', 'gateway', routing.gateway)
+
+
+@blueprint.route('/login/', endpoint='login', methods=['GET', 'POST'])
+async def login_view():
+    """
+    Asynchronous counterpart of `routing.login`.
+    """
+
+    if flask.request.method == 'POST':
+        return routing.single_logout()
+
+    try:
+        settings = routing._settings()
+        if not settings.server_timing and settings.profile_hook is None:
+            return await _login()
+        # Flask runs each coroutine view on its own event loop, so the
+        # thread's timer is not shared with other requests.
+        timer = timing.start()
+        started = timing.clock()
+        try:
+            response = await _login()
+        finally:
+            timing.stop()
+        timer.record('total', started)
+        return routing._report_timing(timer, response)
+    finally:
+        # The loop is closed after the view, and its connections with it
+        transport = getattr(routing._state(), 'async_transport', None)
+        if transport is not None:
+            await transport.close_idle()
+
+
+async def _login():
+    settings = routing._settings()
+    cas_token_session_key = settings.token_session_key
+
+    if 'ticket' in flask.request.args:
+        flask.session[cas_token_session_key] = flask.request.args['ticket']
+        flask.session.pop(settings.gateway_session_key, None)
+        routing._reset_principal()
+    else:
+        response = routing._gateway_return()
+        if response is not None:
+            return response
+
+    is_valid = False
+    if cas_token_session_key in flask.session:
+        try:
+            is_valid = await validate(flask.session[cas_token_session_key])
+        except CASUnavailableError as error:
+            current_app.logger.error("CAS is unavailable: {0}".format(error))
+            return routing.unavailable()
+        except RateLimitedError as error:
+            return routing.too_many_attempts(error)
+
+    return routing._login_redirect(is_valid)
+
+
+@blueprint.route('/logout/', endpoint='logout')
+async def logout_view():
+    """
+    Asynchronous counterpart of `routing.logout`.
+    """
+    return routing.logout()
+
+
+class AsyncCAS(CAS):
+    """
+    `CAS` registering the asynchronous blueprint. Flask runs its views
+    on an event loop (requires `flask[async]`).
+    """
+
+    blueprint = blueprint
+
+
+def guarded(function, check):
+    """
+    Wrap the coroutine view `function` so that `check` runs first. If
+    `check` returns a response it is returned instead of calling the
+    view.
+    """
+    @wraps(function)
+    async def wrap(*args, **kwargs):
+        response = check()
+        if response is not None:
+            return response
+        return await function(*args, **kwargs)
+    return wrap
+
+
+def login_required(function):
+    """
+    `login_required` for coroutine views.
+    """
+    from . import _login_check
+    return guarded(function, _login_check)
+
+
+def login_optional(function):
+    """
+    `login_optional` for coroutine views.
+    """
+    from . import _gateway_check
+    return guarded(function, _gateway_check)
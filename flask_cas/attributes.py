@@ -0,0 +1,174 @@
+"""
+flask_cas.attributes
+
+The attributes kept in the session, and how they are encoded there.
+
+The CAS usually releases many more attributes than an application
+reads, and the session carries all of them on every request.
+`CAS_KEEP_ATTRIBUTES` keeps only some of them, under their name without
+the namespace prefix (`mail` for `cas:mail`). With
+`CAS_COMPACT_ATTRIBUTES` they are also stored compactly:
+
+- with a list of names, the values are stored in the order of the list
+  and the names are left out;
+- a list of values, such as the groups in `memberOf`, is stored as the
+  suffix its values have in common (the base of distinguished names)
+  and their remaining heads joined in a single string.
+"""
+
+import os
+import zlib
+
+from .groups import parse_member_of
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# Joins the heads of a packed list, see pack_list
+_SEPARATOR = '\n'
+
+
+def strip_prefix(name):
+    """ `name` without its namespace prefix.
+
+    Example usage:
+    >>> strip_prefix('cas:mail')
+    'mail'
+    """
+    return name.rpartition(':')[2]
+
+
+def pack_list(values):
+    """ Encode the list of strings `values` compactly, see `unpack_list`.
+
+    Example usage:
+    >>> pack_list(['cn=admins,ou=groups,dc=pdx,dc=edu',
+    ...            'cn=users,ou=groups,dc=pdx,dc=edu'])
+    [',ou=groups,dc=pdx,dc=edu', 'cn=admins\\ncn=users']
+    """
+    if not values or not all(
+            isinstance(value, _string_types) and _SEPARATOR not in value
+            for value in values):
+        return [None] + list(values)
+    suffix = os.path.commonprefix([value[::-1] for value in values])[::-1]
+    # Cut at a comma, so that the heads remain readable names
+    comma = suffix.find(',')
+    suffix = suffix[comma:] if comma != -1 else ''
+    cut = len(suffix)
+    return [suffix, _SEPARATOR.join(value[:len(value) - cut]
+                                    for value in values)]
+
+
+def unpack_list(packed):
+    """ The list encoded by `pack_list`.
+
+    Example usage:
+    >>> unpack_list([',dc=edu', 'cn=admins\\ncn=users'])
+    ['cn=admins,dc=edu', 'cn=users,dc=edu']
+    """
+    suffix = packed[0]
+    if suffix is None:
+        return packed[1:]
+    return [head + suffix for head in packed[1].split(_SEPARATOR)]
+
+
+def _pack(value):
+    return pack_list(value) if isinstance(value, list) else value
+
+
+def _unpack(value):
+    return unpack_list(value) if isinstance(value, list) else value
+
+
+class AttributeCodec(object):
+    """ Select the attributes kept for the user, and encode them for the
+    session.
+
+    Keyword arguments:
+    keep -- None to keep every attribute as released, a list of the
+            names to keep (`memberOf` is always kept, for the groups
+            of the user), or a callable taking the attributes (with
+            their names stripped of the prefix) and returning the
+            dictionary to keep.
+    compact -- True to encode the attributes compactly.
+
+    Example usage:
+    >>> codec = AttributeCodec(['mail'], compact=True)
+    >>> attributes = codec.project({
+    ...     'cas:mail': 'bob@pdx.edu',
+    ...     'cas:telephoneNumber': '503-725-3000',
+    ...     'cas:memberOf': ['cn=admins,dc=pdx,dc=edu', 'cn=users,dc=pdx,dc=edu']})
+    >>> sorted(attributes)
+    ['mail', 'memberOf']
+    >>> codec.encode(attributes)[1:]
+    ['bob@pdx.edu', [',dc=pdx,dc=edu', 'cn=admins\\ncn=users']]
+    >>> codec.decode(codec.encode(attributes)) == attributes
+    True
+    """
+
+    __slots__ = ('names', 'transform', 'compact', '_tag')
+
+    def __init__(self, keep=None, compact=False):
+        if keep is None or callable(keep):
+            self.names = None
+            self.transform = keep
+        else:
+            self.names = tuple(strip_prefix(name) for name in keep)
+            if 'memberOf' not in self.names:
+                # The groups of the user, see principal.attribute_groups
+                self.names += ('memberOf',)
+            self.transform = None
+        self.compact = compact
+        # Identifies the list of names, so that attributes encoded for
+        # another CAS_KEEP_ATTRIBUTES are not decoded with this one.
+        self._tag = zlib.crc32(
+            _SEPARATOR.join(self.names or ()).encode('utf-8')) & 0xffffffff
+
+    def project(self, attributes):
+        """ A new dictionary of the attributes to keep out of the
+        `attributes` released by the CAS. """
+        if self.names is None and self.transform is None:
+            return dict(attributes)
+        attributes = dict(
+            (strip_prefix(name), value) for name, value in attributes.items())
+        if 'memberOf' in attributes:
+            attributes['memberOf'] = parse_member_of(attributes['memberOf'])
+        if self.transform is not None:
+            return self.transform(attributes)
+        return dict((name, attributes[name]) for name in self.names
+                    if name in attributes)
+
+    def encode(self, attributes):
+        """ The value stored in the session for `attributes`. """
+        if not self.compact:
+            return attributes
+        if self.names is None:
+            return [self._tag, dict(
+                (name, _pack(value)) for name, value in attributes.items())]
+        return [self._tag] + [
+            _pack(attributes.get(name)) for name in self.names]
+
+    def decode(self, value):
+        """ The attributes stored in the session as `value`, None if
+        they were stored with other settings. """
+        if not self.compact:
+            return None if isinstance(value, list) else value
+        if not isinstance(value, list) or not value or value[0] != self._tag:
+            return None
+        if self.names is None:
+            return dict(
+                (name, _unpack(item)) for name, item in value[1].items())
+        return dict((name, _unpack(item))
+                    for name, item in zip(self.names, value[1:])
+                    if item is not None)
+
+
+def create_attribute_codec(settings):
+    """ Return the `AttributeCodec` of the settings, or None if the
+    attributes are kept as released. """
+    if settings.keep_attributes is None and not settings.compact_attributes:
+        return None
+    return AttributeCodec(
+        settings.keep_attributes, bool(settings.compact_attributes))
@@ -0,0 +1,135 @@
+"""
+flask_cas.breaker
+
+Circuit breaker guarding the calls made to the CAS.
+"""
+
+import threading
+import time
+
+
+class CASUnavailableError(Exception):
+    """ The CAS could not be reached or did not answer in time. """
+
+
+class CircuitOpenError(CASUnavailableError):
+    """ The call was not attempted because the circuit is open. """
+
+
+class CircuitBreaker(object):
+    """ Stop calling the CAS after repeated failures.
+
+    The breaker starts `closed`. After `failure_threshold` consecutive
+    failures it `open`s and every call is refused for `recovery_timeout`
+    seconds. It then becomes `half-open` and lets `half_open_max_calls`
+    probe calls through. A successful probe closes the breaker, a failed
+    one opens it again. A caller which ends its call with no outcome to
+    record gives its probe back with `release`; probes which never
+    report back expire after `recovery_timeout` seconds.
+
+    Keyword arguments:
+    failure_threshold -- Consecutive failures which open the breaker.
+    recovery_timeout -- Seconds the breaker stays open.
+    half_open_max_calls -- Concurrent probes allowed while half-open.
+
+    Example usage:
+    >>> breaker = CircuitBreaker(failure_threshold=1)
+    >>> breaker.record_failure()
+    >>> breaker.state
+    'open'
+    >>> breaker.allow()
+    False
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30,
+                 half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._probed_at = None
+
+    def _current_state(self, now):
+        if (self._state == self.OPEN and
+                now - self._opened_at >= self.recovery_timeout):
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        if (self._state == self.HALF_OPEN and self._probes and
+                now - self._probed_at >= self.recovery_timeout):
+            # The probes were lost (ex. cancelled), let new ones through
+            self._probes = 0
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.time())
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def opened_at(self):
+        return self._opened_at
+
+    @property
+    def available(self):
+        """ True if `allow` would let a call through now. """
+        with self._lock:
+            state = self._current_state(time.time())
+            return state == self.CLOSED or (
+                state == self.HALF_OPEN and
+                self._probes < self.half_open_max_calls)
+
+    def allow(self):
+        """ Return True if a call may be made now. """
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and \
+                    self._probes < self.half_open_max_calls:
+                self._probes += 1
+                self._probed_at = now
+                return True
+            return False
+
+    def release(self):
+        """ Give back the probe taken by `allow` for a call which ended
+        with neither a success nor a failure to record. """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if (self._state == self.HALF_OPEN or
+                    self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.time()
+
+    def stats(self):
+        """ Return a dict describing the breaker, for operators. """
+        with self._lock:
+            return {
+                'state': self._current_state(time.time()),
+                'failures': self._failures,
+                'opened_at': self._opened_at,
+            }
@@ -0,0 +1,98 @@
+"""
+flask_cas.cache
+
+Bounded in-process caches.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """ Thread-safe mapping with a time to live and LRU eviction.
+
+    Entries expire `ttl` seconds after they were set. When the cache
+    holds `maxsize` entries, setting a new key evicts the least recently
+    used one. Hits, misses and evictions are counted.
+
+    Keyword arguments:
+    maxsize -- The maximum number of entries.
+    ttl -- Seconds an entry stays valid.
+
+    Example usage:
+    >>> cache = TTLCache(maxsize=2, ttl=60)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.stats()['evictions']
+    1
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires <= time.time():
+                self.misses += 1
+                return default
+            # Re-insert to mark the key as most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._data[key] = (value, time.time() + self.ttl)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[1] <= time.time():
+            return default
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def stats(self):
+        """ Return the counters of the cache. """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
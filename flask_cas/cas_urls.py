@@ -13,6 +13,8 @@ except ImportError:
     from urllib.parse import urljoin
     from urllib.parse import urlencode
 
+from .protocols import get_protocol
+
 
 def create_url(base, path=None, *query):
     """ Create a url.
@@ -98,7 +100,7 @@ def create_cas_logout_url(cas_url, cas_route, service=None):
 
 
 def create_cas_validate_url(cas_url, cas_route, service, ticket,
-                            renew=None):
+                            renew=None, pgt_url=None):
     """ Create a CAS validate URL.
 
     Keyword arguments:
@@ -107,6 +109,7 @@ def create_cas_validate_url(cas_url, cas_route, service, ticket,
     service -- (ex.  http://localhost:5000/login)
     ticket -- (ex. 'ST-58274-x839euFek492ou832Eena7ee-cas')
     renew -- "true" or "false"
+    pgt_url -- The proxy callback url (ex. https://localhost:5000/proxyCallback)
 
     Example usage:
     >>> create_cas_validate_url(
@@ -123,4 +126,149 @@ def create_cas_validate_url(cas_url, cas_route, service, ticket,
         ('service', service),
         ('ticket', ticket),
         ('renew', renew),
+        ('pgtUrl', pgt_url),
     )
+
+
+def create_cas_proxy_url(cas_url, cas_route, pgt, target_service):
+    """ Create a CAS proxy URL, used to obtain a proxy ticket.
+
+    Keyword arguments:
+    cas_url -- The url to the CAS (ex. http://sso.pdx.edu)
+    cas_route -- The route where the CAS lives on server (ex. /cas/proxy)
+    pgt -- The proxy granting ticket (ex. PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA)
+    target_service -- The service to get a ticket for (ex. http://localhost:5001/api)
+
+    Example usage:
+    >>> create_cas_proxy_url(
+    ...     'http://sso.pdx.edu',
+    ...     '/cas/proxy',
+    ...     'PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA',
+    ...     'http://localhost:5001/api',
+    ... )
+    'http://sso.pdx.edu/cas/proxy?pgt=PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA&targetService=http%3A%2F%2Flocalhost%3A5001%2Fapi'
+    """
+    return create_url(
+        cas_url,
+        cas_route,
+        ('pgt', pgt),
+        ('targetService', target_service),
+    )
+
+
+class URLTemplate(object):
+    """ A url whose base, path and leading query pairs are fixed.
+
+    The fixed part is built once with `create_url`; calling the template
+    only encodes the remaining key/value pairs. Pairs with a value of
+    None are ignored, like in `create_url`.
+
+    Keyword arguments:
+    base -- The left most part of the url (ex. http://localhost:5000).
+    path -- The path after the base (ex. /foo/bar).
+    query -- Key value pairs included in every url.
+
+    Example usage:
+    >>> template = URLTemplate(
+    ...     'http://sso.pdx.edu',
+    ...     '/cas/serviceValidate',
+    ...     ('service', 'http://localhost:5000/login'),
+    ... )
+    >>> template(('ticket', 'ST-58274-x839euFek492ou832Eena7ee-cas'), ('renew', None))
+    'http://sso.pdx.edu/cas/serviceValidate?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&ticket=ST-58274-x839euFek492ou832Eena7ee-cas'
+    """
+
+    __slots__ = ('_prefix', '_separator')
+
+    def __init__(self, base, path=None, *query):
+        self._prefix = create_url(base, path, *query)
+        self._separator = '&' if '?' in self._prefix else '?'
+
+    def __call__(self, *query):
+        query = [pair for pair in query if pair[1] is not None]
+        if not query:
+            return self._prefix
+        return self._prefix + self._separator + urlencode(query)
+
+
+class CASURLs(object):
+    """ The CAS urls used by a service, built once per service url.
+
+    Keyword arguments:
+    cas_url -- The url to the CAS (ex. http://sso.pdx.edu)
+    login_route -- The login route of the CAS (ex. /cas)
+    logout_route -- The logout route of the CAS (ex. /cas/logout)
+    validate_route -- The validate route of the CAS (ex. /cas/serviceValidate)
+    service -- The url of the service (ex. http://localhost:5000/login)
+    after_logout -- Where the CAS sends the user after logout, or None.
+    proxy_route -- The proxy route of the CAS (ex. /cas/proxy), or None.
+    pgt_url -- The proxy callback url sent with validations, or None.
+    protocol -- The `protocols.Protocol` of the validations, CAS 2.0 if
+                None. `validate_route` is given for CAS 2.0.
+    validate_servers -- The CAS urls tickets may be validated on, when
+                        the CAS is a cluster; `cas_url` if None.
+
+    Example usage:
+    >>> urls = CASURLs(
+    ...     'http://sso.pdx.edu',
+    ...     '/cas',
+    ...     '/cas/logout',
+    ...     '/cas/serviceValidate',
+    ...     'http://localhost:5000/login',
+    ... )
+    >>> urls.login
+    'http://sso.pdx.edu/cas?service=http%3A%2F%2Flocalhost%3A5000%2Flogin'
+    >>> urls.validate('ST-58274-x839euFek492ou832Eena7ee-cas')
+    'http://sso.pdx.edu/cas/serviceValidate?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&ticket=ST-58274-x839euFek492ou832Eena7ee-cas'
+    """
+
+    __slots__ = ('service', 'login', 'logout', 'pgt_url', 'protocol',
+                 '_login', '_validate', '_validate_route', '_default_server',
+                 '_proxy')
+
+    def __init__(self, cas_url, login_route, logout_route, validate_route,
+                 service, after_logout=None, proxy_route=None, pgt_url=None,
+                 protocol=None, validate_servers=None):
+        if protocol is None:
+            protocol = get_protocol('2.0')
+        self.service = service
+        self.pgt_url = pgt_url
+        self.protocol = protocol
+        self._login = URLTemplate(cas_url, login_route, ('service', service))
+        self._validate_route = protocol.route(validate_route)
+        # Validate url templates by CAS url
+        self._validate = {}
+        for server in validate_servers or [cas_url]:
+            self._validate_template(server)
+        self._default_server = (validate_servers or [cas_url])[0]
+        self._proxy = URLTemplate(cas_url, proxy_route)
+        self.login = self._login()
+        self.logout = create_cas_logout_url(
+            cas_url, logout_route, after_logout)
+
+    def login_url(self, renew=None, gateway=None):
+        """ The login url with the optional `renew` and `gateway`. """
+        return self._login(('renew', renew), ('gateway', gateway))
+
+    def _validate_template(self, server):
+        template = self._validate.get(server)
+        if template is None:
+            template = self._validate[server] = URLTemplate(
+                server, self._validate_route,
+                (self.protocol.service_param, self.service),
+                *self.protocol.query)
+        return template
+
+    def validate(self, ticket, renew=None, server=None):
+        """ The validate url of `ticket` on the CAS at `server`, by
+        default the first of `validate_servers`. Protocols POSTing the
+        ticket leave it out, see `protocols.Protocol.body`. """
+        template = self._validate.get(server or self._default_server)
+        if template is None:
+            template = self._validate_template(server)
+        return template(
+            *self.protocol.validate_query(ticket, renew, self.pgt_url))
+
+    def proxy(self, pgt, target_service):
+        """ The url requesting a proxy ticket for `target_service`. """
+        return self._proxy(('pgt', pgt), ('targetService', target_service))
@@ -0,0 +1,95 @@
+"""
+flask_cas.flight
+
+Single flight: concurrent callers asking for the same key share one
+call instead of each making their own.
+
+Double clicks, browser prefetch and retrying proxies deliver the same
+ticket to the login route several times at once. Tickets are single
+use, so only the first validation could succeed; the other requests
+wait for it and share its result instead. Only the calls in progress
+are kept, so memory is bounded by the number of concurrent requests.
+"""
+
+import threading
+
+
+class SingleFlight(object):
+    """ The calls in flight, keyed by what they compute.
+
+    The caller which starts a call is its leader. Callers arriving while
+    it runs wait for the `concurrent.futures.Future` of the call, with
+    `Future.result` or `asyncio.wrap_future`.
+
+    Example usage:
+    >>> flights = SingleFlight()
+    >>> flights.do('ST-1', lambda: 'bob')
+    ('bob', False)
+    >>> future, leader = flights.begin('ST-1')
+    >>> flights.begin('ST-1') == (future, False)
+    True
+    >>> flights.end('ST-1', future, 'bob')
+    >>> future.result()
+    'bob'
+    >>> len(flights)
+    0
+    """
+
+    def __init__(self):
+        # Imported here, like the rest of the validation machinery it is
+        # only needed once the first ticket arrives
+        from concurrent.futures import Future
+        self._future = Future
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def begin(self, key):
+        """ Return the future of the call for `key`, and True if the
+        caller leads it: it must make the call and pass the outcome to
+        `end`. """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = self._future()
+            return future, True
+
+    def end(self, key, future, result=None, error=None):
+        """ Complete the call for `key` with its `result`, or the
+        exception `error` raised by the leader. """
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, function):
+        """ Call `function` unless a call for `key` is in flight, and
+        return its result and True if it was shared with a concurrent
+        caller. Exceptions are shared as well. """
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = function()
+        except BaseException as error:
+            self.end(key, future, error=error)
+            raise
+        self.end(key, future, result)
+        return result, False
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def create_single_flight(settings):
+    """ Return the `SingleFlight` of validations, or None if
+    `CAS_SINGLE_FLIGHT` is off or `concurrent.futures` is missing
+    (Python 2 without the futures backport). """
+    if not settings.single_flight:
+        return None
+    try:
+        return SingleFlight()
+    except ImportError:
+        return None
@@ -0,0 +1,70 @@
+"""
+flask_cas.groups
+
+Group membership released in the `cas:memberOf` attribute.
+
+Users of an organisation share a small number of groups, and often the
+very same set of groups. Group names are interned and equal group sets
+are shared process-wide, so caching the groups of many users costs
+little more than caching them once.
+"""
+
+import threading
+
+try:
+    from sys import intern as _intern
+except ImportError:
+    def _intern(name):
+        # Python 2 only interns byte strings
+        try:
+            return intern(name)
+        except TypeError:
+            return name
+
+from .cache import TTLCache
+
+# Distinct group sets shared by the whole process
+_group_sets = TTLCache(maxsize=4096, ttl=float('inf'))
+_group_sets_lock = threading.Lock()
+
+
+def parse_member_of(value):
+    """ Split the value of `cas:memberOf` into a list of interned group
+    names.
+
+    The CAS releases either one element per group, or a single element
+    listing the groups between brackets.
+
+    Example usage:
+    >>> parse_member_of('[cn=admins, cn=users]')
+    ['cn=admins', 'cn=users']
+    >>> parse_member_of(['cn=admins', 'cn=users'])
+    ['cn=admins', 'cn=users']
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        # Already split, by the parser or when read back from the session
+        return [_intern(group.strip()) for group in value if group]
+    value = value.strip().lstrip('[').rstrip(']').split(',')
+    return [_intern(group) for group in [group.strip() for group in value]
+            if group]
+
+
+def group_set(groups):
+    """ Return the frozenset of `groups`, shared with every other equal
+    group set of the process.
+
+    Example usage:
+    >>> group_set(['cn=admins', 'cn=users']) is group_set(['cn=users', 'cn=admins'])
+    True
+    """
+    groups = frozenset(groups)
+    shared = _group_sets.get(groups)
+    if shared is None:
+        with _group_sets_lock:
+            shared = _group_sets.get(groups)
+            if shared is None:
+                _group_sets.set(groups, groups)
+                shared = groups
+    return shared
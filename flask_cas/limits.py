@@ -0,0 +1,95 @@
+"""
+flask_cas.limits
+
+Per client rate limiting of the ticket validations.
+
+Scanners replaying made up tickets to `/login/?ticket=...` would
+otherwise pass every attempt on to the CAS. Each client gets a token
+bucket of `CAS_RATE_LIMIT_BURST` attempts, refilled at `CAS_RATE_LIMIT`
+attempts per second; a validation which finds the bucket empty is
+refused without contacting the CAS.
+"""
+
+import threading
+
+from . import timing
+from .cache import TTLCache
+
+
+class RateLimitedError(Exception):
+    """ The client made too many validation attempts.
+
+    Attributes:
+    retry_after -- Seconds until the client may try again.
+    """
+
+    def __init__(self, retry_after):
+        Exception.__init__(
+            self, 'Rate limited, retry in {0:.1f}s'.format(retry_after))
+        self.retry_after = retry_after
+
+
+class RateLimiter(object):
+    """ Token buckets keyed by client.
+
+    A bucket left alone for `burst / rate` seconds is full again, so the
+    buckets are kept in a `TTLCache` expiring them after that time: a
+    missing bucket is a full one. At most `maxsize` clients are tracked,
+    the least recently seen are forgotten first.
+
+    Keyword arguments:
+    rate -- Tokens added to a bucket per second.
+    burst -- Capacity of a bucket.
+    maxsize -- Maximum number of buckets.
+
+    Example usage:
+    >>> limiter = RateLimiter(rate=1, burst=2)
+    >>> limiter.acquire('192.0.2.1'), limiter.acquire('192.0.2.1')
+    (0, 0)
+    >>> limiter.acquire('192.0.2.1') > 0
+    True
+    >>> limiter.acquire('192.0.2.2')
+    0
+    """
+
+    def __init__(self, rate, burst=10, maxsize=10000):
+        self.rate = float(rate)
+        self.burst = burst
+        self._buckets = TTLCache(maxsize, burst / self.rate)
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        """ Take a token from the bucket of `client`. Returns 0 if there
+        was one, otherwise the seconds until the next token. """
+        now = timing.clock()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens, stamp = bucket
+                tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            self._buckets.set(client, (tokens - 1, now))
+            return 0
+
+    def check(self, client):
+        """ Like `acquire`, raising `RateLimitedError` if `client` has
+        no token left. """
+        retry_after = self.acquire(client)
+        if retry_after:
+            raise RateLimitedError(retry_after)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def create_rate_limiter(settings):
+    """ Return the `RateLimiter` of validations, or None if
+    `CAS_RATE_LIMIT` is not set. """
+    if not settings.rate_limit:
+        return None
+    return RateLimiter(
+        settings.rate_limit, settings.rate_limit_burst,
+        settings.rate_limit_clients)
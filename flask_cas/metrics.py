@@ -0,0 +1,131 @@
+"""
+flask_cas.metrics
+
+Counters and histograms describing the work of the extension.
+
+Instrumentation is off unless `CAS_METRICS` is set or a sink is
+installed with `cas.metrics = sink`. When it is off the blueprint only
+checks that no sink is installed.
+"""
+
+import threading
+
+# Upper bounds of the validation latency histogram, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class MetricsSink(object):
+    """ Interface of the objects receiving the metrics.
+
+    `labels` is a tuple of (name, value) pairs. A sink forwarding to
+    StatsD or another collector implements `increment` and `observe`.
+    """
+
+    def increment(self, name, labels=(), value=1):
+        """ Add `value` to the counter `name`. """
+        raise NotImplementedError()
+
+    def observe(self, name, value, labels=()):
+        """ Record `value` in the histogram `name`. """
+        raise NotImplementedError()
+
+
+class PrometheusSink(MetricsSink):
+    """ Sink keeping the metrics in process and rendering them in the
+    Prometheus text exposition format.
+
+    Keyword arguments:
+    buckets -- Upper bounds of the histogram buckets.
+
+    Example usage:
+    >>> sink = PrometheusSink(buckets=(0.1, 1.0))
+    >>> sink.increment('cas_validations_total', (('result', 'success'),))
+    >>> sink.observe('cas_validation_seconds', 0.05)
+    >>> print(sink.render())
+    # TYPE cas_validation_seconds histogram
+    cas_validation_seconds_bucket{le="0.1"} 1
+    cas_validation_seconds_bucket{le="1.0"} 1
+    cas_validation_seconds_bucket{le="+Inf"} 1
+    cas_validation_seconds_sum 0.05
+    cas_validation_seconds_count 1
+    # TYPE cas_validations_total counter
+    cas_validations_total{result="success"} 1
+    <BLANKLINE>
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # name -> {labels: value}
+        self._counters = {}
+        # name -> {labels: [bucket counts..., +Inf count, sum, count]}
+        self._histograms = {}
+
+    def increment(self, name, labels=(), value=1):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(self.buckets) + 3)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def value(self, name, labels=()):
+        """ The current value of the counter `name`, for tests. """
+        with self._lock:
+            return self._counters.get(name, {}).get(labels, 0)
+
+    def render(self, samples=()):
+        """ Return the metrics in the text exposition format.
+
+        `samples` are extra (name, type, labels, value) tuples, ex. the
+        gauges read from the caches when the metrics are scraped.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                lines.append('# TYPE {0} histogram'.format(name))
+                for labels, counts in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ('+Inf',),
+                                            counts[:-2]):
+                        cumulative += count
+                        lines.append('{0}_bucket{1} {2}'.format(
+                            name, _labels(labels + (('le', bound),)),
+                            cumulative))
+                    lines.append('{0}_sum{1} {2}'.format(
+                        name, _labels(labels), counts[-2]))
+                    lines.append('{0}_count{1} {2}'.format(
+                        name, _labels(labels), counts[-1]))
+            counters = [(name, 'counter', labels, value)
+                        for name in sorted(self._counters)
+                        for labels, value in sorted(
+                            self._counters[name].items())]
+        typed = set()
+        for name, kind, labels, value in counters + list(samples):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {0} {1}'.format(name, kind))
+            lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
@@ -0,0 +1,253 @@
+"""
+flask_cas.nodes
+
+The CAS server nodes tickets are validated against, when `CAS_SERVER`
+lists several of them.
+
+Each node has its own circuit breaker and an exponentially weighted
+moving average (EWMA) of its response times. Validations go to the
+fastest healthy node and fail over to the next one when a node cannot
+be reached. A node whose breaker opens is unhealthy; a background
+thread probes the unhealthy nodes every `probe_interval` seconds and
+closes their breaker as soon as they answer again, so no user request
+is needed to find out that a node recovered.
+
+A `TicketAffinity` sends each ticket to the node which issued it,
+recognized by the suffix the CAS appends to its tickets.
+"""
+
+import os
+import threading
+
+from . import timing
+from .breaker import CircuitBreaker
+from .cas_urls import create_url
+from .transport import Timeout
+
+
+class Node(object):
+    """ A CAS server node.
+
+    Attributes:
+    url -- The `CAS_SERVER` url of the node.
+    breaker -- The `CircuitBreaker` of the node.
+    latency -- EWMA of the response times in seconds, None until the
+               node answered once.
+
+    Example usage:
+    >>> node = Node('https://cas1.pdx.edu', CircuitBreaker())
+    >>> node.observe(0.2, alpha=0.5)
+    >>> node.observe(0.1, alpha=0.5)
+    >>> round(node.latency, 3)
+    0.15
+    """
+
+    __slots__ = ('url', 'breaker', 'latency')
+
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        self.latency = None
+
+    @property
+    def healthy(self):
+        # A half-open breaker whose probe is taken refuses calls as well
+        return self.breaker.available
+
+    def observe(self, seconds, alpha):
+        """ Fold a response time into the EWMA `latency`. """
+        latency = self.latency
+        if latency is None:
+            self.latency = seconds
+        else:
+            self.latency = alpha * seconds + (1 - alpha) * latency
+
+    def __repr__(self):
+        return '<Node {0} latency={1!r}>'.format(self.url, self.latency)
+
+
+class NodeSet(object):
+    """ The nodes of a CAS cluster.
+
+    Keyword arguments:
+    urls -- The urls of the nodes, in order of preference.
+    failure_threshold -- See `CircuitBreaker`, for each node.
+    recovery_timeout -- See `CircuitBreaker`, for each node.
+    alpha -- Weight of the latest response time in the EWMA.
+    probe -- Callable taking a `Node` and returning True if it answers,
+             None to disable the background probes.
+    probe_interval -- Seconds between two probes of an unhealthy node.
+
+    Example usage:
+    >>> nodes = NodeSet(['https://cas1.pdx.edu', 'https://cas2.pdx.edu'])
+    >>> nodes.record_success(nodes.nodes[0], 0.3)
+    >>> nodes.record_success(nodes.nodes[1], 0.1)
+    >>> [node.url for node in nodes.ranked()]
+    ['https://cas2.pdx.edu', 'https://cas1.pdx.edu']
+    """
+
+    def __init__(self, urls, failure_threshold=5, recovery_timeout=30,
+                 alpha=0.3, probe=None, probe_interval=5):
+        self.nodes = [
+            Node(url, CircuitBreaker(failure_threshold, recovery_timeout))
+            for url in urls]
+        self.alpha = alpha
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._prober = None
+        self._prober_pid = None
+        self._stopped = threading.Event()
+
+    def ranked(self, prefer=None):
+        """ The nodes in the order they should be tried: the healthy
+        ones by increasing latency, then the unhealthy ones. Nodes
+        which never answered count as the fastest, so each node gets
+        measured; ties keep the configured order. The node whose url is
+        `prefer` comes first while it is healthy. """
+        ranked = sorted(self.nodes, key=lambda node: (
+            not node.healthy, node.latency or 0))
+        if prefer is not None:
+            for index, node in enumerate(ranked):
+                if node.url == prefer:
+                    if index and node.healthy:
+                        ranked.insert(0, ranked.pop(index))
+                    break
+        return ranked
+
+    def record_success(self, node, seconds):
+        node.breaker.record_success()
+        node.observe(seconds, self.alpha)
+
+    def record_failure(self, node):
+        node.breaker.record_failure()
+        if not node.healthy:
+            self._start_prober()
+
+    def _start_prober(self):
+        if self.probe is None or self._stopped.is_set():
+            return
+        with self._lock:
+            # The thread does not survive a fork, start one in the child
+            if (self._prober is not None and self._prober.is_alive() and
+                    self._prober_pid == os.getpid()):
+                return
+            self._prober = threading.Thread(target=self._run_prober)
+            self._prober.daemon = True
+            self._prober_pid = os.getpid()
+            self._prober.start()
+
+    def _run_prober(self):
+        while not self._stopped.wait(self.probe_interval):
+            unhealthy = [node for node in self.nodes if not node.healthy]
+            if not unhealthy:
+                with self._lock:
+                    # A node may have failed since the check
+                    if all(node.healthy for node in self.nodes):
+                        self._prober = None
+                        return
+                continue
+            for node in unhealthy:
+                self.probe_node(node)
+
+    def probe_node(self, node):
+        """ Probe `node` now, and update its breaker and latency. """
+        started = timing.clock()
+        try:
+            answered = self.probe(node)
+        except Exception:
+            answered = False
+        if answered:
+            self.record_success(node, timing.clock() - started)
+        else:
+            node.breaker.record_failure()
+
+    def close(self):
+        """ Stop the background probes. """
+        self._stopped.set()
+
+
+class TicketAffinity(object):
+    """ Map the node suffix of service tickets to the CAS url of the node
+    which issued them.
+
+    A clustered CAS appends the name of the issuing node to its tickets
+    (ex. 'ST-58274-x839euFek492ou832Eena7ee-cas1'). Suffixes may contain
+    dashes; the longest matching suffix wins.
+
+    Keyword arguments:
+    mapping -- Dictionary of CAS urls keyed by ticket suffix.
+
+    Example usage:
+    >>> affinity = TicketAffinity({'cas1': 'https://cas1.pdx.edu',
+    ...                            'cas-b': 'https://cas2.pdx.edu'})
+    >>> affinity.lookup('ST-58274-x839euFek492ou832Eena7ee-cas1')
+    'https://cas1.pdx.edu'
+    >>> affinity.lookup('ST-58274-x839euFek492ou832Eena7ee-cas-b')
+    'https://cas2.pdx.edu'
+    >>> affinity.lookup('ST-58274-x839euFek492ou832Eena7ee-cas3') is None
+    True
+    """
+
+    __slots__ = ('_suffixes', '_dashed')
+
+    def __init__(self, mapping):
+        # Suffixes without a dash are found with a single dict lookup
+        self._suffixes = dict(
+            (suffix, url) for suffix, url in mapping.items()
+            if '-' not in suffix)
+        self._dashed = sorted(
+            (('-' + suffix, url) for suffix, url in mapping.items()
+             if '-' in suffix),
+            key=lambda pair: -len(pair[0]))
+
+    def lookup(self, ticket):
+        """ The CAS url of the node which issued `ticket`, None if its
+        suffix is unknown. """
+        for ending, url in self._dashed:
+            if ticket.endswith(ending):
+                return url
+        return self._suffixes.get(ticket.rpartition('-')[2])
+
+
+def server_urls(server):
+    """ The urls of `CAS_SERVER`, a url or a list of urls.
+
+    Example usage:
+    >>> server_urls('https://sso.pdx.edu')
+    ['https://sso.pdx.edu']
+    """
+    if isinstance(server, (list, tuple)):
+        return list(server)
+    return [server]
+
+
+def create_node_set(settings, urlopen):
+    """ Return the `NodeSet` of `CAS_SERVER`, or None if it is a single
+    server. Nodes are probed by opening their `CAS_NODE_PROBE_ROUTE`
+    (by default the login route) with `urlopen(url, timeout)`.
+    """
+    urls = server_urls(settings.server)
+    if len(urls) < 2:
+        return None
+    probe_route = settings.node_probe_route or settings.login_route
+
+    def probe(node):
+        response = urlopen(
+            create_url(node.url, probe_route),
+            Timeout(connect=settings.connect_timeout,
+                    read=settings.read_timeout,
+                    total=settings.validate_timeout))
+        try:
+            response.read()
+        finally:
+            response.close()
+        return True
+
+    return NodeSet(
+        urls,
+        settings.breaker_threshold,
+        settings.breaker_recovery_time,
+        settings.node_ewma_alpha,
+        probe if settings.node_probe_interval else None,
+        settings.node_probe_interval)
@@ -0,0 +1,523 @@
+"""
+flask_cas.parsing
+
+Parsers of the documents returned by the CAS validate and proxy routes.
+
+`ServiceResponseParser` parses the XML serviceResponse of CAS 2.0 and
+3.0, `JSONResponseParser` its CAS 3.0 JSON counterpart and
+`SAMLResponseParser` the SAML 1.1 response of samlValidate. They share
+the `feed` / `done` / `close` interface and return the same
+`ValidationResult`, with attributes in the layout of the XML parser.
+
+The XML serviceResponse is parsed incrementally.
+The body is fed to an expat parser chunk by chunk as it arrives from the
+socket. Parsing stops as soon as the outcome is known: after the end of
+`cas:authenticationFailure`, or after the end of
+`cas:authenticationSuccess` (or their `cas:proxy*` counterparts). Only
+the success element is turned into Python objects, using the same
+layout as `xmltodict`.
+"""
+
+import json
+
+from xml.parsers import expat
+
+from . import timing
+
+# Responses larger than this are rejected
+DEFAULT_MAX_RESPONSE_SIZE = 1024 * 1024
+
+CHUNK_SIZE = 16 * 1024
+
+
+class InvalidResponseError(ValueError):
+    """ The CAS response could not be parsed. """
+
+
+class ResponseTooLargeError(InvalidResponseError):
+    """ The CAS response exceeded the maximum size. """
+
+
+class ValidationResult(object):
+    """ The outcome of a ticket validation.
+
+    Attributes:
+    success -- True if the ticket was valid.
+    user -- The username of a valid ticket.
+    attributes -- Dictionary of the released attributes, keyed by tag
+                  name (ex. 'cas:memberOf').
+    failure_code -- The `code` of `cas:authenticationFailure`.
+    failure_message -- The text of `cas:authenticationFailure`.
+    error -- The exception which prevented the validation, if any.
+    proxy_granting_ticket -- The PGTIOU of `cas:proxyGrantingTicket`.
+    proxies -- List of the proxies a proxy ticket went through.
+    proxy_ticket -- The ticket of a `cas:proxySuccess`.
+    groups -- Frozenset of the groups in `cas:memberOf`.
+    """
+
+    def __init__(self, success, user=None, attributes=None,
+                 failure_code=None, failure_message=None, error=None,
+                 proxy_granting_ticket=None, proxies=None, proxy_ticket=None):
+        self.success = success
+        self.user = user
+        self.attributes = attributes if attributes is not None else {}
+        self.failure_code = failure_code
+        self.failure_message = failure_message
+        self.error = error
+        self.proxy_granting_ticket = proxy_granting_ticket
+        self.proxies = proxies if proxies is not None else []
+        self.proxy_ticket = proxy_ticket
+        self.groups = frozenset()
+
+    def __repr__(self):
+        if self.success:
+            return '<ValidationResult success user={0!r}>'.format(self.user)
+        if self.error is not None:
+            return '<ValidationResult error={0!r}>'.format(self.error)
+        return '<ValidationResult failure code={0!r}>'.format(
+            self.failure_code)
+
+
+class _Done(Exception):
+    pass
+
+
+_SUCCESS = ('authenticationSuccess', 'proxySuccess')
+_FAILURE = ('authenticationFailure', 'proxyFailure')
+
+
+def _local_name(tag):
+    return tag.rpartition(':')[2]
+
+
+class ServiceResponseParser(object):
+    """ Incremental parser of a CAS 2.0 serviceResponse.
+
+    Feed the body with `feed` until `done` is True or the body ends, then
+    call `close` to get the `ValidationResult`.
+
+    Keyword arguments:
+    max_size -- Maximum number of bytes accepted, None for no limit.
+
+    Example usage:
+    >>> parser = ServiceResponseParser()
+    >>> parser.feed(b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+    ...             b'<cas:authenticationFailure code="INVALID_TICKET">'
+    ...             b'Ticket not recognized</cas:authenticationFailure>')
+    >>> parser.done
+    True
+    >>> parser.close().failure_code
+    'INVALID_TICKET'
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_RESPONSE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.done = False
+        self._result = None
+        self._depth = 0
+        self._failure = None
+        # Stack of [tag, children dict, text parts] of the elements
+        # inside cas:authenticationSuccess.
+        self._stack = None
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+    def _start(self, tag, attrs):
+        self._depth += 1
+        if self._stack is not None:
+            # Hot path: one call per released attribute value
+            if attrs:
+                children = dict(
+                    ('@' + key, value) for key, value in attrs.items())
+            else:
+                children = {}
+            self._stack.append([tag, children, []])
+            return
+        name = _local_name(tag)
+        if self._depth == 1:
+            if name != 'serviceResponse':
+                raise InvalidResponseError(
+                    'Unexpected root element {0}'.format(tag))
+        elif self._depth == 2 and name in _SUCCESS:
+            self._stack = [[tag, {}, []]]
+        elif self._depth == 2 and name in _FAILURE:
+            self._failure = [attrs.get('code'), []]
+
+    def _data(self, data):
+        if self._stack is not None:
+            self._stack[-1][2].append(data)
+        elif self._failure is not None:
+            self._failure[1].append(data)
+
+    def _end(self, tag):
+        self._depth -= 1
+        if self._stack is not None:
+            tag, children, text = self._stack.pop()
+            if len(text) == 1:
+                text = text[0].strip() or None
+            else:
+                text = ''.join(text).strip() or None
+            if children:
+                if text is not None:
+                    children['#text'] = text
+                value = children
+            else:
+                value = text
+            if not self._stack:
+                self._finish_success(_local_name(tag), value)
+                raise _Done()
+            parent = self._stack[-1][1]
+            if tag in parent:
+                if not isinstance(parent[tag], list):
+                    parent[tag] = [parent[tag]]
+                parent[tag].append(value)
+            else:
+                parent[tag] = value
+        elif self._failure is not None:
+            code, message = self._failure
+            self._result = ValidationResult(
+                False,
+                failure_code=code,
+                failure_message=''.join(message).strip() or None)
+            raise _Done()
+
+    def _finish_success(self, element, success):
+        if not isinstance(success, dict):
+            raise InvalidResponseError('Empty {0}'.format(element))
+        values = dict((_local_name(tag), value)
+                      for tag, value in success.items())
+        if element == 'proxySuccess':
+            proxy_ticket = values.get('proxyTicket')
+            if not proxy_ticket or isinstance(proxy_ticket, (dict, list)):
+                raise InvalidResponseError('proxySuccess without proxyTicket')
+            self._result = ValidationResult(True, proxy_ticket=proxy_ticket)
+            return
+        user = values.get('user')
+        if not user or isinstance(user, (dict, list)):
+            raise InvalidResponseError('authenticationSuccess without user')
+        attributes = values.get('attributes')
+        if not isinstance(attributes, dict):
+            attributes = {}
+        proxies = []
+        if isinstance(values.get('proxies'), dict):
+            for tag, value in values['proxies'].items():
+                if _local_name(tag) == 'proxy':
+                    proxies = value if isinstance(value, list) else [value]
+        self._result = ValidationResult(
+            True, user, attributes,
+            proxy_granting_ticket=values.get('proxyGrantingTicket'),
+            proxies=proxies)
+
+    def feed(self, data):
+        """ Parse the next chunk of the body. """
+        if self.done:
+            return
+        if not self.size:
+            # Some servers send blank lines before the XML declaration
+            data = data.lstrip()
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ResponseTooLargeError(
+                'CAS response exceeds {0} bytes'.format(self.max_size))
+        try:
+            self._parser.Parse(data, False)
+        except _Done:
+            self.done = True
+        except expat.ExpatError as error:
+            raise InvalidResponseError(str(error))
+
+    def close(self):
+        """ Finish parsing and return the `ValidationResult`. """
+        if not self.done:
+            try:
+                self._parser.Parse(b'', True)
+            except _Done:
+                pass
+            except expat.ExpatError as error:
+                raise InvalidResponseError(str(error))
+            self.done = True
+        if self._result is None:
+            raise InvalidResponseError('No authentication result in response')
+        return self._result
+
+
+def _single(value):
+    # The JSON and SAML formats always release lists of values, the XML
+    # format a string when there is one value.
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+
+class JSONResponseParser(object):
+    """ Parser of a CAS 3.0 serviceResponse in the JSON format.
+
+    The body is buffered until `close`, the JSON decoder being much
+    faster on a whole document than expat is on the XML format.
+    Attribute names are given the 'cas:' prefix of the XML format.
+
+    Keyword arguments:
+    max_size -- Maximum number of bytes accepted, None for no limit.
+
+    Example usage:
+    >>> parser = JSONResponseParser()
+    >>> parser.feed(b'{"serviceResponse": {"authenticationSuccess": {'
+    ...             b'"user": "bob", "attributes": {"memberOf": ["cn=admins"]}}}}')
+    >>> result = parser.close()
+    >>> str(result.user), str(result.attributes['cas:memberOf'])
+    ('bob', 'cn=admins')
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_RESPONSE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.done = False
+        self._chunks = []
+
+    def feed(self, data):
+        """ Buffer the next chunk of the body. """
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ResponseTooLargeError(
+                'CAS response exceeds {0} bytes'.format(self.max_size))
+        self._chunks.append(data)
+
+    def close(self):
+        """ Parse the body and return the `ValidationResult`. """
+        self.done = True
+        try:
+            document = json.loads(b''.join(self._chunks).decode('utf-8'))
+        except ValueError as error:
+            raise InvalidResponseError(str(error))
+        response = None
+        if isinstance(document, dict):
+            response = document.get('serviceResponse')
+        if not isinstance(response, dict):
+            raise InvalidResponseError('No serviceResponse')
+        for element in _FAILURE:
+            failure = response.get(element)
+            if isinstance(failure, dict):
+                message = (failure.get('description') or '').strip()
+                return ValidationResult(
+                    False,
+                    failure_code=failure.get('code'),
+                    failure_message=message or None)
+        success = response.get('proxySuccess')
+        if isinstance(success, dict):
+            proxy_ticket = success.get('proxyTicket')
+            if not proxy_ticket or isinstance(proxy_ticket, (dict, list)):
+                raise InvalidResponseError('proxySuccess without proxyTicket')
+            return ValidationResult(True, proxy_ticket=proxy_ticket)
+        success = response.get('authenticationSuccess')
+        if not isinstance(success, dict):
+            raise InvalidResponseError('No authentication result in response')
+        user = success.get('user')
+        if not user or isinstance(user, (dict, list)):
+            raise InvalidResponseError('authenticationSuccess without user')
+        attributes = success.get('attributes')
+        if isinstance(attributes, dict):
+            attributes = dict(('cas:' + name, _single(value))
+                              for name, value in attributes.items())
+        else:
+            attributes = {}
+        proxies = success.get('proxies') or []
+        if not isinstance(proxies, list):
+            proxies = [proxies]
+        return ValidationResult(
+            True, user, attributes,
+            proxy_granting_ticket=success.get('proxyGrantingTicket'),
+            proxies=proxies)
+
+
+class SAMLResponseParser(ServiceResponseParser):
+    """ Incremental parser of the SAML 1.1 response of samlValidate.
+
+    The user is the first `NameIdentifier`, the attributes come from
+    the `Attribute` elements, named 'cas:' + their `AttributeName`. A
+    `StatusCode` other than Success is a failure, whose code is the
+    local name of the status (ex. 'Requester').
+
+    Keyword arguments:
+    max_size -- Maximum number of bytes accepted, None for no limit.
+    """
+
+    _TEXT = ('StatusMessage', 'NameIdentifier', 'AttributeValue')
+
+    def __init__(self, max_size=DEFAULT_MAX_RESPONSE_SIZE):
+        ServiceResponseParser.__init__(self, max_size)
+        self._path = []
+        self._text = None
+        self._status = None
+        self._message = None
+        self._user = None
+        self._attribute = None
+        self._attributes = {}
+
+    def _start(self, tag, attrs):
+        name = _local_name(tag)
+        self._path.append(name)
+        if name == 'StatusCode' and self._status is None:
+            self._status = _local_name(attrs.get('Value', ''))
+        elif name == 'Attribute':
+            self._attribute = attrs.get('AttributeName')
+        if name in self._TEXT:
+            self._text = []
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _end(self, tag):
+        name = self._path.pop()
+        if name in self._TEXT and self._text is not None:
+            text = ''.join(self._text).strip()
+            self._text = None
+            if name == 'StatusMessage':
+                self._message = text or None
+            elif name == 'NameIdentifier':
+                if self._user is None:
+                    self._user = text
+            elif self._attribute is not None:
+                self._attributes.setdefault(
+                    'cas:' + self._attribute, []).append(text)
+        elif name == 'Attribute':
+            self._attribute = None
+        elif name == 'Response':
+            self._finish_response()
+            raise _Done()
+
+    def _finish_response(self):
+        if self._status != 'Success':
+            self._result = ValidationResult(
+                False,
+                failure_code=self._status or None,
+                failure_message=self._message)
+            return
+        if not self._user:
+            raise InvalidResponseError('SAML Response without NameIdentifier')
+        self._result = ValidationResult(
+            True, self._user,
+            dict((name, _single(values))
+                 for name, values in self._attributes.items()))
+
+
+def parse_response(response, max_size=DEFAULT_MAX_RESPONSE_SIZE,
+                   parser_class=ServiceResponseParser):
+    """ Parse a serviceResponse while reading it from `response`.
+
+    `response` is a file-like object supporting `read(amt)`. Reading
+    stops once the outcome is known; the rest of the body is drained so
+    a keep-alive connection can be reused. Raises `InvalidResponseError`
+    if the body is not a valid serviceResponse or exceeds `max_size`.
+    `parser_class` parses other formats, see `JSONResponseParser`.
+    """
+    parser = parser_class(max_size)
+    timer = timing.current()
+    if timer is not None:
+        return _parse_timed(response, parser, timer)
+    try:
+        while not parser.done:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        if parser.done:
+            _drain(response, parser)
+    finally:
+        response.close()
+    return parser.close()
+
+
+def _parse_timed(response, parser, timer):
+    # parse_response, adding the time spent reading and parsing to timer
+    clock = timing.clock
+    try:
+        while not parser.done:
+            started = clock()
+            chunk = response.read(CHUNK_SIZE)
+            started = timer.record('read', started)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            timer.record('parse', started)
+        if parser.done:
+            started = clock()
+            _drain(response, parser)
+            timer.record('read', started)
+    finally:
+        response.close()
+    started = clock()
+    result = parser.close()
+    timer.record('parse', started)
+    return result
+
+
+def _drain(response, parser):
+    size = parser.size
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        size += len(chunk)
+        if parser.max_size is not None and size > parser.max_size:
+            return
+
+
+def parse_logout_request(data):
+    """ Return the service ticket named by a SAML `LogoutRequest`.
+
+    The CAS posts this document to the service url when the user logs
+    out of the CAS (single logout). Raises `InvalidResponseError` if
+    `data` is not a logout request.
+
+    Example usage:
+    >>> parse_logout_request(
+    ...     '<samlp:LogoutRequest'
+    ...     ' xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"'
+    ...     ' ID="LR-1" Version="2.0" IssueInstant="2024-01-01T00:00:00Z">'
+    ...     '<saml:NameID xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">'
+    ...     '@NOT_USED@</saml:NameID>'
+    ...     '<samlp:SessionIndex>ST-1-abc</samlp:SessionIndex>'
+    ...     '</samlp:LogoutRequest>')
+    'ST-1-abc'
+    """
+    state = {'depth': 0, 'root': None, 'text': None}
+
+    def start(tag, attrs):
+        state['depth'] += 1
+        if state['depth'] == 1:
+            state['root'] = _local_name(tag)
+        elif state['depth'] == 2 and _local_name(tag) == 'SessionIndex':
+            state['text'] = []
+
+    def data_(text):
+        if state['text'] is not None:
+            state['text'].append(text)
+
+    def end(tag):
+        state['depth'] -= 1
+        if state['depth'] == 1 and state['text'] is not None:
+            raise _Done()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data_
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    try:
+        parser.Parse(data.strip(), True)
+    except _Done:
+        pass
+    except expat.ExpatError as error:
+        raise InvalidResponseError(str(error))
+    if state['root'] != 'LogoutRequest' or not state['text']:
+        raise InvalidResponseError('Not a LogoutRequest')
+    ticket = ''.join(state['text']).strip()
+    if not ticket:
+        raise InvalidResponseError('LogoutRequest without SessionIndex')
+    return ticket
@@ -0,0 +1,90 @@
+"""
+flask_cas.principal
+
+The CAS identity of the user of a request.
+"""
+
+from .groups import group_set
+from .groups import parse_member_of
+
+
+class Principal(object):
+    """ The username, token, attributes and groups of the user of the
+    current request.
+
+    One principal is built per request from the session and kept on
+    `flask.g`; see `routing.get_principal`. The attributes are loaded
+    by `load_attributes` and the groups by `load_groups` on first
+    access; by default the groups are built from the attributes (see
+    `attribute_groups`).
+
+    Keyword arguments:
+    username -- The username, None if the user is not logged in.
+    token -- The service ticket of the login.
+    attributes -- The attributes dictionary, if already known.
+    load_attributes -- Function returning the attributes otherwise.
+    groups -- The frozenset of groups, if already known.
+    load_groups -- Function returning the groups otherwise.
+
+    Example usage:
+    >>> principal = Principal('bob', 'ST-1', {'cas:memberOf': ['cn=admins']})
+    >>> principal.is_authenticated
+    True
+    >>> 'cn=admins' in principal.groups
+    True
+    """
+
+    __slots__ = ('username', 'token', '_attributes', '_load_attributes',
+                 '_groups', '_load_groups')
+
+    def __init__(self, username=None, token=None, attributes=None,
+                 load_attributes=None, groups=None, load_groups=None):
+        self.username = username
+        self.token = token
+        self._attributes = attributes
+        self._load_attributes = load_attributes
+        self._groups = groups
+        self._load_groups = load_groups
+
+    @property
+    def is_authenticated(self):
+        return self.username is not None
+
+    @property
+    def attributes(self):
+        if self._load_attributes is not None:
+            self._attributes = self._load_attributes()
+            self._load_attributes = None
+        return self._attributes
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            if self._load_groups is not None:
+                self._groups = self._load_groups()
+            else:
+                self._groups = attribute_groups(self.attributes)
+        return self._groups
+
+    def __repr__(self):
+        return '<Principal {0!r}>'.format(self.username)
+
+
+def attribute_groups(attributes):
+    """ The shared frozenset of the groups in the `cas:memberOf`
+    attribute of `attributes`. The list saved in the session was parsed
+    at validation (see `groups.parse_member_of`), so it is used as is;
+    only a string is split.
+
+    Example usage:
+    >>> sorted(attribute_groups({'memberOf': ['cn=admins', 'cn=users']}))
+    ['cn=admins', 'cn=users']
+    """
+    attributes = attributes or {}
+    member_of = attributes.get('cas:memberOf')
+    if member_of is None:
+        # Kept without its prefix, see attributes.AttributeCodec
+        member_of = attributes.get('memberOf')
+    if not isinstance(member_of, list):
+        member_of = parse_member_of(member_of)
+    return group_set(member_of)
@@ -0,0 +1,154 @@
+"""
+flask_cas.protocols
+
+The protocols spoken with the CAS to validate tickets, selected with
+`CAS_PROTOCOL`:
+
+|CAS_PROTOCOL | Validation request                          | Response parser      |
+|-------------|---------------------------------------------|----------------------|
+|'2.0'        | GET `CAS_VALIDATE_ROUTE`                    | ServiceResponseParser|
+|'3.0'        | GET the /p3/ counterpart of the route       | ServiceResponseParser|
+|'3.0-json'   | The same with `format=JSON`                 | JSONResponseParser   |
+|'saml1.1'    | POST the ticket to samlValidate             | SAMLResponseParser   |
+
+Each parser returns the same `ValidationResult`, so the rest of the
+extension does not depend on the protocol. Other protocols are added
+with `register_protocol`.
+"""
+
+import binascii
+import os
+import time
+
+from .parsing import JSONResponseParser
+from .parsing import SAMLResponseParser
+from .parsing import ServiceResponseParser
+
+_PROTOCOLS = {}
+
+
+def _sibling(route, name):
+    # `route` with its last path segment replaced by `name`
+    return route.rstrip('/').rpartition('/')[0] + '/' + name
+
+
+class Protocol(object):
+    """ How tickets are validated with a version of the CAS protocol.
+
+    Keyword arguments:
+    name -- The value of `CAS_PROTOCOL` selecting the protocol.
+    parser_class -- Class of the response parser, see
+                    `parsing.ServiceResponseParser`.
+    query -- Key value pairs added to every validate url.
+
+    Example usage:
+    >>> protocol = Protocol('2.0')
+    >>> protocol.route('/cas/serviceValidate')
+    '/cas/serviceValidate'
+    >>> protocol.validate_query('ST-1', None, None)
+    (('ticket', 'ST-1'), ('renew', None), ('pgtUrl', None))
+    """
+
+    # The query parameter naming the service url
+    service_param = 'service'
+
+    def __init__(self, name, parser_class=ServiceResponseParser, query=()):
+        self.name = name
+        self.parser_class = parser_class
+        self.query = tuple(query)
+
+    def route(self, route):
+        """ The validate route of this protocol, given the configured
+        `CAS_VALIDATE_ROUTE` or `CAS_PROXY_VALIDATE_ROUTE`. """
+        return route
+
+    def validate_query(self, ticket, renew, pgt_url):
+        """ The key value pairs of the validate url of `ticket`. """
+        return (('ticket', ticket), ('renew', renew), ('pgtUrl', pgt_url))
+
+    def body(self, ticket):
+        """ The body POSTed to validate `ticket`, None to use a GET. """
+        return None
+
+    def __repr__(self):
+        return '<Protocol {0}>'.format(self.name)
+
+
+class P3Protocol(Protocol):
+    """ CAS 3.0, served under /p3/ next to the CAS 2.0 routes.
+
+    Example usage:
+    >>> P3Protocol('3.0').route('/cas/serviceValidate')
+    '/cas/p3/serviceValidate'
+    >>> P3Protocol('3.0').route('/cas/p3/proxyValidate')
+    '/cas/p3/proxyValidate'
+    """
+
+    def route(self, route):
+        parent, _, name = route.rstrip('/').rpartition('/')
+        if parent.endswith('/p3'):
+            return route
+        return '{0}/p3/{1}'.format(parent, name)
+
+
+class SAMLProtocol(Protocol):
+    """ SAML 1.1: the ticket is POSTed to the samlValidate route next to
+    the configured validate route, inside a SOAP `samlp:Request`.
+
+    Example usage:
+    >>> SAMLProtocol('saml1.1').route('/cas/serviceValidate')
+    '/cas/samlValidate'
+    """
+
+    service_param = 'TARGET'
+
+    def __init__(self, name, parser_class=SAMLResponseParser, query=()):
+        Protocol.__init__(self, name, parser_class, query)
+
+    def route(self, route):
+        return _sibling(route, 'samlValidate')
+
+    def validate_query(self, ticket, renew, pgt_url):
+        return ()
+
+    def body(self, ticket):
+        # Imported here: xml.sax.saxutils pulls in urllib.request
+        from xml.sax.saxutils import escape
+        return (
+            '<SOAP-ENV:Envelope'
+            ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<SOAP-ENV:Header/><SOAP-ENV:Body>'
+            '<samlp:Request xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol"'
+            ' MajorVersion="1" MinorVersion="1" RequestID="_{0}"'
+            ' IssueInstant="{1}">'
+            '<samlp:AssertionArtifact>{2}</samlp:AssertionArtifact>'
+            '</samlp:Request></SOAP-ENV:Body></SOAP-ENV:Envelope>'.format(
+                binascii.hexlify(os.urandom(16)).decode('ascii'),
+                time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                escape(ticket))).encode('utf-8')
+
+
+def register_protocol(protocol):
+    """ Make `protocol` selectable with `CAS_PROTOCOL = protocol.name`. """
+    _PROTOCOLS[protocol.name] = protocol
+
+
+def get_protocol(name):
+    """ Return the protocol registered as `name`. Raises `ValueError`
+    for unknown protocols.
+
+    Example usage:
+    >>> get_protocol('3.0-json').query
+    (('format', 'JSON'),)
+    """
+    try:
+        return _PROTOCOLS[name]
+    except KeyError:
+        raise ValueError('Unknown CAS_PROTOCOL {0!r}'.format(name))
+
+
+register_protocol(Protocol('2.0'))
+register_protocol(P3Protocol('3.0'))
+register_protocol(P3Protocol(
+    '3.0-json', JSONResponseParser, query=[('format', 'JSON')]))
+register_protocol(SAMLProtocol('saml1.1'))
@@ -1,26 +1,58 @@
+import base64
+import binascii
+import math
+import os
+import threading
+import time
+
 import flask
-from xmltodict import parse
 from flask import current_app
-from .cas_urls import create_cas_login_url
-from .cas_urls import create_cas_logout_url
-from .cas_urls import create_cas_validate_url
-
+from . import timing
+from .cas_urls import CASURLs
+from .groups import group_set
+from .groups import parse_member_of
+from .limits import RateLimitedError
+from .nodes import server_urls
+from .principal import Principal
+from .principal import attribute_groups
+from .settings import Settings
+from .settings import check_settings
+from .tenants import tenant_config
+from .protocols import get_protocol
+from .breaker import CASUnavailableError
+from .breaker import CircuitOpenError
+from .parsing import InvalidResponseError
+from .parsing import ServiceResponseParser
+from .parsing import ValidationResult
+from .parsing import parse_logout_request
+from .parsing import parse_response
+from .transport import Timeout
 
 try:
-    from urllib import urlopen
+    from httplib import HTTPException
 except ImportError:
-    from urllib.request import urlopen
+    from http.client import HTTPException
 
 blueprint = flask.Blueprint('cas', __name__)
 
+# Seconds the CAS has to send the user back from a gateway check
+_GATEWAY_TIMEOUT = 60
+
 
-@blueprint.route('/login/')
+@blueprint.route('/login/', methods=['GET', 'POST'])
 def login():
     """
     This route has two purposes. First, it is used by the user
     to login. Second, it is used by the CAS to respond with the
     `ticket` after the user logs in successfully.
 
+    When `CAS_SINGLE_LOGOUT` is set, the CAS also posts its logout
+    requests to this route, see `single_logout`.
+
+    When `CAS_SERVER_TIMING` or `CAS_PROFILE_HOOK` is set, the time
+    spent in each phase of the validation is reported, see
+    `_report_timing`.
+
     When the user accesses this url, they are redirected to the CAS
     to login. If the login was successful, the CAS will respond to this
     route with the ticket in the url. The ticket is then validated.
@@ -30,40 +62,172 @@ def login():
     'CAS_USERNAME_ATTRIBUTE_KEY'
     """
 
-    cas_token_session_key = current_app.config['CAS_TOKEN_SESSION_KEY']
+    if flask.request.method == 'POST':
+        return single_logout()
+
+    settings = _settings()
+    if not settings.server_timing and settings.profile_hook is None:
+        return _login()
+    timer = timing.start()
+    started = timing.clock()
+    try:
+        response = _login()
+    finally:
+        timing.stop()
+    timer.record('total', started)
+    return _report_timing(timer, response)
+
+
+def _login():
+    """
+    The GET login route.
+    """
 
-    redirect_url = create_cas_login_url(
-        current_app.config['CAS_SERVER'],
-        current_app.config['CAS_LOGIN_ROUTE'],
-        flask.url_for('.login', _external=True))
+    settings = _settings()
+    cas_token_session_key = settings.token_session_key
 
     if 'ticket' in flask.request.args:
         flask.session[cas_token_session_key] = flask.request.args['ticket']
+        flask.session.pop(settings.gateway_session_key, None)
+        _reset_principal()
+    else:
+        response = _gateway_return()
+        if response is not None:
+            return response
 
+    is_valid = False
     if cas_token_session_key in flask.session:
+        try:
+            is_valid = validate(flask.session[cas_token_session_key])
+        except CASUnavailableError as error:
+            current_app.logger.error("CAS is unavailable: {0}".format(error))
+            return unavailable()
+        except RateLimitedError as error:
+            return too_many_attempts(error)
+
+    return _login_redirect(is_valid)
+
+
+def _report_timing(timer, response):
+    """
+    Add the phases of `timer` to `response` as a `Server-Timing` header
+    if `CAS_SERVER_TIMING` is set, and pass them (an ordered dictionary
+    of seconds keyed by phase) to `CAS_PROFILE_HOOK` if set.
+    """
+
+    settings = _settings()
+    if settings.server_timing:
+        response.headers.add('Server-Timing', timer.server_timing())
+    if settings.profile_hook is not None:
+        try:
+            settings.profile_hook(timer.phases)
+        except Exception:
+            current_app.logger.exception("CAS profile hook failed")
+    return response
 
-        if validate(flask.session[cas_token_session_key]):
-            if 'CAS_AFTER_LOGIN_SESSION_URL' in flask.session:
-                redirect_url = flask.session.pop('CAS_AFTER_LOGIN_SESSION_URL')
-            else:
-                redirect_url = flask.url_for(
-                    current_app.config['CAS_AFTER_LOGIN'])
+
+def _login_redirect(is_valid):
+    """
+    The response of the login route once the ticket in the session,
+    if any, has been validated.
+    """
+
+    settings = _settings()
+    cas_token_session_key = settings.token_session_key
+
+    if is_valid:
+        if 'CAS_AFTER_LOGIN_SESSION_URL' in flask.session:
+            redirect_url = flask.session.pop('CAS_AFTER_LOGIN_SESSION_URL')
         else:
+            redirect_url = flask.url_for(settings.after_login)
+    else:
+        redirect_url = _cas_urls().login
+        if cas_token_session_key in flask.session:
             del flask.session[cas_token_session_key]
+            _reset_principal()
 
     current_app.logger.debug('Redirecting to: {0}'.format(redirect_url))
+    _count_redirect('after_login' if is_valid else 'cas_login')
+
+    return flask.redirect(redirect_url)
+
 
+@blueprint.route('/gateway/')
+def gateway():
+    """
+    Log the user in only if they already have a single sign-on session
+    with the CAS, without ever showing them the CAS login page.
+
+    The user is redirected to the CAS with `gateway=true`. The CAS sends
+    them back to the login route at once, with a ticket if they are
+    logged in there and without one otherwise. Either way they end up
+    on the page saved by `login_optional`, or `CAS_AFTER_LOGIN`.
+    """
+    if get_principal().is_authenticated:
+        return _login_redirect(True)
+    return _gateway_redirect()
+
+
+def _gateway_redirect():
+    """
+    Start a gateway check, see `gateway`.
+    """
+    # The start of the check until the CAS sends the user back, see
+    # _gateway_return
+    flask.session[_settings().gateway_session_key] = [int(time.time())]
+    redirect_url = _cas_urls().login_url(gateway='true')
+    current_app.logger.debug('Redirecting to: {0}'.format(redirect_url))
+    _count_redirect('cas_gateway')
     return flask.redirect(redirect_url)
 
 
+def _gateway_return():
+    """
+    The response of the login route when the CAS sends the user back
+    from a gateway check without a ticket, None for any other request.
+    The time of the check is remembered, see `gateway_checked`. A check
+    started more than `_GATEWAY_TIMEOUT` seconds ago was abandoned: the
+    request is an explicit login, and the check is forgotten.
+    """
+    settings = _settings()
+    started = flask.session.get(settings.gateway_session_key)
+    if not isinstance(started, list):
+        return None
+    del flask.session[settings.gateway_session_key]
+    if time.time() - started[0] > _GATEWAY_TIMEOUT:
+        return None
+    flask.session[settings.gateway_session_key] = int(time.time())
+    if 'CAS_AFTER_LOGIN_SESSION_URL' in flask.session:
+        redirect_url = flask.session.pop('CAS_AFTER_LOGIN_SESSION_URL')
+    else:
+        redirect_url = flask.url_for(settings.after_login)
+    current_app.logger.debug('Redirecting to: {0}'.format(redirect_url))
+    _count_redirect('after_gateway')
+    return flask.redirect(redirect_url)
+
+
+def gateway_checked():
+    """
+    True if a gateway check found the user logged out of the CAS less
+    than `CAS_GATEWAY_WINDOW` seconds ago (ever, if it is None).
+    """
+    settings = _settings()
+    checked = flask.session.get(settings.gateway_session_key)
+    if not checked or isinstance(checked, list):
+        return False
+    window = settings.gateway_window
+    return window is None or time.time() - checked < window
+
+
 @blueprint.route('/logout/')
 def logout():
     """
     When the user accesses this route they are logged out.
     """
 
-    cas_username_session_key = current_app.config['CAS_USERNAME_SESSION_KEY']
-    cas_attributes_session_key = current_app.config['CAS_ATTRIBUTES_SESSION_KEY']
+    settings = _settings()
+    cas_username_session_key = settings.username_session_key
+    cas_attributes_session_key = settings.attributes_session_key
 
     if cas_username_session_key in flask.session:
         del flask.session[cas_username_session_key]
@@ -71,20 +235,499 @@ def logout():
     if cas_attributes_session_key in flask.session:
         del flask.session[cas_attributes_session_key]
 
-    if(current_app.config['CAS_AFTER_LOGOUT'] != None):
-        redirect_url = create_cas_logout_url(
-            current_app.config['CAS_SERVER'],
-            current_app.config['CAS_LOGOUT_ROUTE'],
-            current_app.config['CAS_AFTER_LOGOUT'])
-    else:
-        redirect_url = create_cas_logout_url(
-            current_app.config['CAS_SERVER'],
-            current_app.config['CAS_LOGOUT_ROUTE'])
+    _drop_attributes()
+    _state().group_sets.pop(flask.session.get(settings.token_session_key))
+    flask.session.pop(settings.pgt_session_key, None)
+    flask.session.pop(settings.session_id_key, None)
+
+    redirect_url = _cas_urls().logout
 
     current_app.logger.debug('Redirecting to: {0}'.format(redirect_url))
+    _count_redirect('cas_logout')
     return flask.redirect(redirect_url)
 
 
+def single_logout():
+    """
+    Handle a back-channel `logoutRequest` posted by the CAS.
+
+    The service ticket named by the request is looked up in the session
+    index, and the session it logged in is revoked: the CAS keys are
+    removed from that session the next time it is used. Logout requests
+    arriving together are applied to the index in batches.
+    """
+
+    if not _settings().single_logout:
+        flask.abort(405)
+
+    try:
+        ticket = parse_logout_request(
+            flask.request.form.get('logoutRequest', ''))
+    except InvalidResponseError as error:
+        current_app.logger.warning(
+            "Invalid CAS logout request: {0}".format(error))
+        flask.abort(400)
+
+    current_app.logger.debug("single logout of token {0}".format(ticket))
+    state = _state()
+    state.ticket_cache.pop((ticket, _cas_urls().service))
+    _revoke(state, ticket)
+    return ''
+
+
+def _revoke(state, ticket):
+    """
+    Queue `ticket` for revocation. Whichever thread gets the flush lock
+    applies everything queued so far in one call to the session index;
+    the others return immediately.
+    """
+    state.group_sets.pop(ticket)
+    pending = state.pending_logouts
+    pending.append(ticket)
+    while pending and state.logout_lock.acquire(False):
+        try:
+            batch = []
+            while pending and len(batch) < state.settings.slo_batch_size:
+                batch.append(pending.popleft())
+            state.session_index.revoke(batch)
+        finally:
+            state.logout_lock.release()
+
+
+@blueprint.before_app_request
+def _check_revoked():
+    """
+    Log out the user if the CAS revoked the session through single
+    logout.
+    """
+    if 'cas' not in current_app.extensions:
+        return
+    state = _state()
+    if not state.settings.single_logout:
+        return
+    settings = state.settings
+    session_id = flask.session.get(settings.session_id_key)
+    if session_id is not None and state.session_index.is_revoked(session_id):
+        _drop_attributes()
+        # Revoked by another process
+        state.group_sets.pop(flask.session.get(settings.token_session_key))
+        for key in (settings.username_session_key,
+                    settings.attributes_session_key,
+                    settings.token_session_key,
+                    settings.pgt_session_key,
+                    settings.session_id_key):
+            flask.session.pop(key, None)
+
+
+@blueprint.url_value_preprocessor
+def _pop_tenant(endpoint, values):
+    """
+    Drop the tenant from the arguments of the routes, when the blueprint
+    is registered under the url prefix `/<cas_tenant>`. The tenant is
+    selected by `_state`; prefixes of no tenant are not found.
+    """
+    if values and values.pop('cas_tenant', None) is not None:
+        if _state().tenant is None:
+            flask.abort(404)
+
+
+@blueprint.url_defaults
+def _add_tenant(endpoint, values):
+    """
+    Fill in the tenant of the current request when building the urls of
+    the routes registered under the url prefix `/<cas_tenant>`.
+    """
+    if 'cas_tenant' in values or not flask.has_request_context():
+        return
+    tenant = _state().tenant
+    if (tenant is not None and
+            current_app.url_map.is_endpoint_expecting(endpoint, 'cas_tenant')):
+        values['cas_tenant'] = tenant
+
+
+@blueprint.route('/proxyCallback/')
+def proxy_callback():
+    """
+    The `pgtUrl` given to the CAS when `CAS_PROXY_CALLBACK` is set. The
+    CAS calls it with the proxy granting ticket and its PGTIOU before
+    answering the validation request; the pair is kept in the PGT store
+    until `CAS_PGT_STORE_TTL` expires.
+    """
+
+    if not _settings().proxy_callback:
+        flask.abort(404)
+
+    pgt_iou = flask.request.args.get('pgtIou')
+    pgt = flask.request.args.get('pgtId')
+    # The CAS may call the url without parameters to check it is up
+    if pgt_iou and pgt:
+        _state().pgt_store.set(pgt_iou, pgt)
+    return ''
+
+
+def get_proxy_ticket(target_service, pgt=None):
+    """
+    Ask the CAS for a proxy ticket for `target_service`.
+
+    The proxy granting ticket defaults to the one the CAS issued for the
+    user of the session, found through the PGTIOU saved at login. A
+    backend can send the proxy ticket to `target_service` instead of
+    sending the user through a new login.
+
+    Returns the proxy ticket, or None if there is no proxy granting
+    ticket or the CAS refused to issue one. Raises `CASUnavailableError`
+    if the CAS cannot be reached.
+    """
+
+    state = _state()
+    settings = state.settings
+
+    if pgt is None:
+        pgt_iou = flask.session.get(settings.pgt_session_key)
+        if pgt_iou is not None:
+            pgt = state.pgt_store.get(pgt_iou)
+    if pgt is None:
+        current_app.logger.debug("no proxy granting ticket")
+        return None
+
+    result = _fetch(_cas_urls().proxy(pgt, target_service), 'proxy')
+    if not result.success:
+        current_app.logger.debug("proxy ticket refused: {0}".format(
+            result.failure_code))
+        return None
+    return result.proxy_ticket
+
+
+def unavailable():
+    """
+    The response given when the CAS cannot be reached. If
+    `CAS_UNAVAILABLE_ENDPOINT` is set the user is redirected to that
+    endpoint, otherwise a 503 error is returned.
+    """
+    endpoint = _settings().unavailable_endpoint
+    if endpoint is not None:
+        _count_redirect('unavailable')
+        return flask.redirect(flask.url_for(endpoint))
+    flask.abort(503)
+
+
+def too_many_attempts(error):
+    """
+    The response given when the client made more validation attempts
+    than `CAS_RATE_LIMIT` allows: a 429 error with a `Retry-After`
+    header.
+    """
+    current_app.logger.warning("Rate limited {0}: {1}".format(
+        flask.request.remote_addr, error))
+    response = flask.make_response('Too Many Requests', 429)
+    response.headers['Retry-After'] = str(int(math.ceil(error.retry_after)))
+    return response
+
+
+@blueprint.route('/metrics')
+def metrics():
+    """
+    The metrics of the extension in the Prometheus text format, when
+    `CAS_METRICS_ENDPOINT` is set and the sink can render them.
+    """
+
+    state = _state()
+    sink = state.metrics
+    if not state.settings.metrics_endpoint or not hasattr(sink, 'render'):
+        flask.abort(404)
+    return flask.Response(
+        sink.render(_state_samples(state)),
+        mimetype='text/plain; version=0.0.4')
+
+
+def _state_samples(state):
+    """
+    The gauges and counters read from the caches, the circuit breaker
+    and the connection pool when the metrics are scraped.
+    """
+
+    samples = []
+    cache = state.ticket_cache.stats()
+    for name in ('hits', 'misses', 'evictions'):
+        samples.append(('cas_ticket_cache_{0}_total'.format(name),
+                        'counter', (), cache[name]))
+    samples.append(('cas_ticket_cache_size', 'gauge', (), cache['size']))
+    breaker = state.breaker.stats()
+    for name in ('closed', 'half-open', 'open'):
+        samples.append(('cas_breaker_state', 'gauge', (('state', name),),
+                        int(breaker['state'] == name)))
+    samples.append(('cas_breaker_failures', 'gauge', (),
+                    breaker['failures']))
+    if state.nodes is not None:
+        for node in state.nodes.nodes:
+            labels = (('node', node.url),)
+            samples.append(('cas_node_up', 'gauge', labels,
+                            int(node.healthy)))
+            if node.latency is not None:
+                samples.append(('cas_node_latency_seconds', 'gauge', labels,
+                                node.latency))
+    if hasattr(state.transport, 'stats'):
+        pool = state.transport.stats()
+        for name in ('idle', 'in_use'):
+            samples.append(('cas_pool_connections', 'gauge',
+                            (('state', name),), pool[name]))
+    return samples
+
+
+def _count_redirect(target):
+    metrics = _state().metrics
+    if metrics is not None:
+        metrics.increment('cas_redirects_total', (('target', target),))
+
+
+def get_principal():
+    """
+    The `Principal` of the current request, built from the session the
+    first time it is needed and kept on `flask.g`.
+
+    With an attribute store the session only holds a handle, and the
+    attributes are loaded from the store on first use in a request.
+    """
+
+    principal = getattr(flask.g, '_cas_principal', None)
+    if principal is not None:
+        return principal
+
+    state = _state()
+    settings = state.settings
+    session = flask.session
+    username = session.get(settings.username_session_key)
+    token = session.get(settings.token_session_key)
+    handle = session.get(settings.attributes_handle_key)
+    codec = state.attribute_codec
+    if handle is None and codec is None:
+        principal = Principal(
+            username, token, session.get(settings.attributes_session_key),
+            load_groups=lambda: _load_groups(state, principal))
+    elif handle is None:
+        encoded = session.get(settings.attributes_session_key)
+        principal = Principal(
+            username, token,
+            load_attributes=lambda: codec.decode(encoded),
+            load_groups=lambda: _load_groups(state, principal))
+    else:
+        store = state.attribute_store
+        principal = Principal(
+            username, token,
+            load_attributes=lambda: (
+                store.get(handle) if store is not None else None),
+            load_groups=lambda: _load_groups(state, principal))
+    flask.g._cas_principal = principal
+    return principal
+
+
+def _load_groups(state, principal):
+    """
+    The group set of `principal`, built when the user logged in and
+    kept by session token along with the username. Built from the
+    attributes the first time this process sees the session otherwise.
+    """
+    if principal.token is None:
+        return attribute_groups(principal.attributes)
+    kept = state.group_sets.get(principal.token)
+    if kept is not None and kept[0] == principal.username:
+        return kept[1]
+    groups = attribute_groups(principal.attributes)
+    state.group_sets.set(principal.token, (principal.username, groups))
+    return groups
+
+
+def get_attributes():
+    """
+    The attributes of the logged in user, or None.
+    """
+    return get_principal().attributes
+
+
+def get_groups():
+    """
+    The frozenset of the groups of the logged in user, built once per
+    request from the `cas:memberOf` attribute.
+    """
+    return get_principal().groups
+
+
+def _reset_principal():
+    """
+    Forget the `Principal` of the request after the session changed.
+    """
+    flask.g._cas_principal = None
+
+
+def _drop_attributes():
+    """
+    Remove the attributes handle from the session and the attributes
+    from the attribute store.
+    """
+    handle = flask.session.pop(_settings().attributes_handle_key, None)
+    store = _state().attribute_store
+    if handle is not None and store is not None:
+        store.delete(handle)
+    _reset_principal()
+
+
+def _state(app=None):
+    """
+    The `_CASState` of the current request: the state of its tenant if
+    `CAS_TENANTS` is set (see `flask_cas.tenants`), otherwise the state
+    of `app`, by default the current application. The tenant is
+    selected once per request.
+    """
+    if app is None:
+        app = current_app
+    state = app.extensions['cas']
+    if state.tenants is None:
+        return state
+    if flask.has_request_context():
+        environ = flask.request.environ
+        selected = environ.get('flask_cas.state')
+        if selected is None:
+            selected = environ['flask_cas.state'] = state.tenants.select(
+                flask.request)
+        return selected
+    if flask.has_app_context():
+        # Set by validate_many and _fetch_hedged for the tenant they
+        # validate tickets of
+        return getattr(flask.g, '_cas_state', None) or state
+    return state
+
+
+def _settings():
+    """
+    The frozen `Settings` of the current request, see `_state`.
+    """
+    return _state().settings
+
+
+def _cas_urls():
+    """
+    The `CASURLs` of the current request. The service url depends on
+    the scheme and host of the request, so the urls are built once per
+    url root and reused afterwards.
+    """
+    state = _state()
+    url_root = flask.request.url_root
+    urls = state.urls.get(url_root)
+    if urls is None:
+        pgt_url = None
+        if state.settings.proxy_callback:
+            pgt_url = flask.url_for('cas.proxy_callback', _external=True)
+        urls = _build_urls(flask.url_for('cas.login', _external=True), pgt_url)
+        state.urls.set(url_root, urls)
+    return urls
+
+
+def _build_urls(service, pgt_url=None):
+    """
+    Build the `CASURLs` of `service` from the settings.
+    """
+    settings = _settings()
+    if settings.accept_proxy_tickets:
+        validate_route = settings.proxy_validate_route
+    else:
+        validate_route = settings.validate_route
+    # Users are sent to the first CAS url, tickets may be validated on
+    # any of them.
+    servers = server_urls(settings.server)
+    return CASURLs(
+        servers[0],
+        settings.login_route,
+        settings.logout_route,
+        validate_route,
+        service,
+        settings.after_logout,
+        settings.proxy_route,
+        pgt_url,
+        get_protocol(settings.protocol),
+        servers)
+
+
+def warmup(app, url_root=None, connections=1, tenants=False):
+    """
+    Prepare `app` for its first login, see `CAS.warmup`.
+
+    The configuration is checked first, raising `ValueError` if it is
+    invalid. The validation machinery is then created, the CAS urls are
+    built for `url_root` (by default from `SERVER_NAME`, if it is set)
+    and `connections` connections are opened to each CAS server. A CAS
+    which cannot be reached is logged, not raised: the application
+    starts anyway and connects on the first login.
+
+    The configuration of every tenant is checked as well. With
+    `tenants`, their machinery is created and their CAS servers are
+    connected to too; otherwise that happens on their first request.
+    """
+
+    state = app.extensions['cas']
+    check_settings(state.settings)
+    if state.tenants is not None:
+        for key, overrides in state.tenants.tenants.items():
+            try:
+                check_settings(Settings(
+                    tenant_config(app.config, key, overrides)))
+            except ValueError as error:
+                raise ValueError('Tenant {0!r}: {1}'.format(key, error))
+
+    if url_root is not None or app.config.get('SERVER_NAME'):
+        with app.test_request_context(base_url=url_root):
+            _cas_urls()
+
+    _warm_state(state, connections)
+    if tenants and state.tenants is not None:
+        for key in state.tenants.tenants:
+            _warm_state(state.tenants.get(key), connections)
+
+
+def _warm_state(state, connections):
+    """
+    Create the validation machinery of `state`, and connect to its CAS
+    servers.
+    """
+
+    settings = state.settings
+    # Creating the lazy members imports the modules behind them
+    for name in ('transport', 'breaker', 'ticket_cache', 'rejected_tickets',
+                 'pgt_store', 'session_index', 'attribute_store', 'metrics',
+                 'nodes', 'affinity', 'attribute_codec', 'flights',
+                 'rate_limiter'):
+        getattr(state, name)
+    if settings.hedge_delay is not None:
+        # Used by _fetch_hedged
+        state.hedge_executor
+
+    warm = getattr(state.transport, 'warm', None)
+    if warm is None:
+        return
+    timeout = Timeout(
+        connect=settings.connect_timeout,
+        read=settings.read_timeout,
+        total=settings.validate_timeout)
+    for server in server_urls(settings.server):
+        try:
+            warm(server, connections, timeout)
+        except (IOError, HTTPException) as error:
+            state.app.logger.warning(
+                "Could not connect to the CAS at {0}: {1}".format(
+                    server, error))
+
+
+def urlopen(url, timeout=None, data=None):
+    """
+    Open `url` with the transport of the current application. The
+    transport keeps the connections to the CAS alive between requests.
+    `data`, if given, is POSTed.
+    """
+    transport = _state().transport
+    if data is None:
+        return transport.open(url, timeout)
+    return transport.open(url, timeout, data)
+
+
 def validate(ticket):
     """
     Will attempt to validate the ticket. If validation fails, then False
@@ -92,46 +735,511 @@ def validate(ticket):
     and the validated username is saved in the session under the
     key `CAS_USERNAME_SESSION_KEY` while tha validated attributes dictionary
     is saved under the key 'CAS_ATTRIBUTES_SESSION_KEY'.
+
+    Tickets validated within the last `CAS_TICKET_CACHE_TTL` seconds
+    are answered from the ticket cache without contacting the CAS, and
+    so are tickets it rejected within the last `CAS_NEGATIVE_CACHE_TTL`
+    seconds. With `CAS_RATE_LIMIT` set, `RateLimitedError` is raised
+    instead of contacting the CAS if the client made too many attempts.
+
+    The request is bounded by `CAS_CONNECT_TIMEOUT`, `CAS_READ_TIMEOUT`
+    and `CAS_VALIDATE_TIMEOUT`. `CASUnavailableError` is raised if the
+    CAS cannot be reached in time, and `CircuitOpenError` if the CAS
+    has failed too often recently to be tried at all.
+    """
+
+    client = flask.request.remote_addr
+    session = flask.session
+    timer = timing.current()
+    if timer is None:
+        return _save_validation(
+            _validate_ticket(_cas_urls(), ticket, client, session), ticket)
+    started = timing.clock()
+    urls = _cas_urls()
+    timer.record('urls', started)
+    return _timed_save(
+        timer, _validate_ticket(urls, ticket, client, session), ticket)
+
+
+def _timed_save(timer, result, ticket):
+    started = timing.clock()
+    try:
+        return _save_validation(result, ticket)
+    finally:
+        timer.record('session', started)
+
+
+def validate_many(tickets, service, app=None, tenant=None):
+    """
+    Validate several tickets issued for `service` concurrently.
+
+    Unlike `validate` this does not need a request context and does not
+    touch the session, so it can be used by queue consumers and
+    gateways. Identical tickets are validated once. The tickets are
+    validated on a thread pool of `CAS_VALIDATE_CONCURRENCY` threads.
+
+    Keyword arguments:
+    tickets -- Iterable of service tickets.
+    service -- The service url the tickets were issued for.
+    app -- The application, defaults to `current_app`.
+    tenant -- The key of the tenant the tickets were issued for, see
+              `flask_cas.tenants`. Defaults to the tenant of the current
+              request, if any. Raises `KeyError` if there is no such
+              tenant.
+
+    Returns a dictionary mapping each ticket to its `ValidationResult`.
+    If the CAS could not be reached for a ticket, its result is
+    unsuccessful and its `error` is the `CASUnavailableError`.
+    """
+
+    if app is None:
+        app = current_app._get_current_object()
+    if tenant is None:
+        state = _state(app)
+    elif app.extensions['cas'].tenants is None:
+        raise KeyError(tenant)
+    else:
+        state = app.extensions['cas'].tenants.get(tenant)
+
+    unique = []
+    seen = set()
+    for ticket in tickets:
+        if ticket not in seen:
+            seen.add(ticket)
+            unique.append(ticket)
+
+    def run(ticket):
+        with app.app_context():
+            flask.g._cas_state = state
+            try:
+                return _validate_ticket(_service_urls(service), ticket)
+            except CASUnavailableError as error:
+                return ValidationResult(False, error=error)
+
+    if len(unique) == 1:
+        return {unique[0]: run(unique[0])}
+    return dict(zip(unique, state.executor.map(run, unique)))
+
+
+def _service_urls(service):
+    """
+    The `CASURLs` of an explicit service url.
+    """
+    state = _state()
+    key = ('service', service)
+    urls = state.urls.get(key)
+    if urls is None:
+        urls = _build_urls(service)
+        state.urls.set(key, urls)
+    return urls
+
+
+def _validate_ticket(urls, ticket, client=None, session=None):
+    """
+    Validate `ticket` against the CAS, or answer it from the ticket
+    caches, and return the `ValidationResult`. Attempts reaching the
+    CAS count against the rate limit of `client`, if given. Requires an
+    application context only.
+
+    Valid tickets are only answered from the cache for the `session`
+    which validated them, and concurrent validations are only shared
+    between the requests of one client. Without a `session` the ticket
+    cache is not used.
+    """
+
+    state = _state()
+    metrics = state.metrics
+    key = (ticket, urls.service)
+
+    result = _cached_validation(state, key, client, session)
+    if result is not None:
+        return result
+
+    flights = state.flights
+    if flights is None:
+        return _validate_uncached(state, urls, ticket)
+    result, shared = flights.do(
+        _flight_key(key, client, session),
+        lambda: _validate_uncached(state, urls, ticket))
+    if shared:
+        _count_coalesced(ticket, metrics)
+    return result
+
+
+def _cached_validation(state, key, client, session=None):
+    """
+    The `ValidationResult` of the (ticket, service) `key` if it can be
+    given without contacting the CAS, None otherwise. Raises
+    `RateLimitedError` if `client` is out of attempts.
+
+    A valid ticket is only taken from the ticket cache if `session`
+    already holds it and its user: anyone can replay the ticket of a
+    login url, only the session which validated it has both.
+    """
+
+    metrics = state.metrics
+    result = None
+    if session is not None:
+        result = state.ticket_cache.get(key)
+        if result is not None and not _session_holds(
+                state.settings, session, key[0], result):
+            result = None
+    if result is not None:
+        outcome = 'cached'
+        current_app.logger.debug("validated token {0} from cache".format(
+            key[0]))
+    else:
+        result = state.rejected_tickets.get(key)
+        if result is not None:
+            outcome = 'cached_failure'
+            current_app.logger.debug(
+                "token {0} rejected recently".format(key[0]))
+    if result is not None:
+        if metrics is not None:
+            metrics.increment('cas_validations_total', (('result', outcome),))
+        return result
+
+    limiter = state.rate_limiter
+    if limiter is not None and client is not None:
+        try:
+            limiter.check(client)
+        except RateLimitedError:
+            if metrics is not None:
+                metrics.increment(
+                    'cas_validations_total', (('result', 'rate_limited'),))
+            raise
+    return None
+
+
+def _session_holds(settings, session, ticket, result):
+    """
+    True if `session` holds `ticket` and the user it was validated for.
+    """
+    return (result.success and
+            session.get(settings.token_session_key) == ticket and
+            session.get(settings.username_session_key) == result.user)
+
+
+def _flight_key(key, client, session):
+    """
+    The key of the validation of `key` in the single flight: requests
+    share a validation only if they come from the same `client` with the
+    same session cookie, so that one client never gets the user of the
+    ticket another client presented. Validations without a `session`
+    (see `validate_many`) are shared among themselves.
+    """
+    if session is None:
+        return key
+    cookie_name = current_app.config.get('SESSION_COOKIE_NAME', 'session')
+    return key + (client, flask.request.cookies.get(cookie_name))
+
+
+def _remember_validation(state, key, result):
+    """
+    Cache the `ValidationResult` of `key`: valid tickets in the ticket
+    cache, tickets the CAS rejected in the negative cache.
     """
+    if result.success:
+        state.ticket_cache.set(key, result)
+    elif result.failure_code is not None:
+        state.rejected_tickets.set(key, result)
+
 
-    cas_username_session_key = current_app.config['CAS_USERNAME_SESSION_KEY']
-    cas_attributes_session_key = current_app.config['CAS_ATTRIBUTES_SESSION_KEY']
+def _count_coalesced(ticket, metrics):
+    current_app.logger.debug(
+        "validated token {0} with a concurrent request".format(ticket))
+    if metrics is not None:
+        metrics.increment('cas_validations_total', (('result', 'coalesced'),))
 
+
+def _validate_uncached(state, urls, ticket):
+    """
+    Validate `ticket` against the CAS, see `_validate_ticket`.
+    """
+
+    metrics = state.metrics
     current_app.logger.debug("validating token {0}".format(ticket))
 
-    cas_validate_url = create_cas_validate_url(
-        current_app.config['CAS_SERVER'],
-        current_app.config['CAS_VALIDATE_ROUTE'],
-        flask.url_for('.login', _external=True),
-        ticket)
+    nodes = state.nodes
+    affinity = state.affinity
+    server = affinity.lookup(ticket) if affinity is not None else None
+    try:
+        if nodes is None:
+            timer = timing.current()
+            if timer is not None:
+                started = timing.clock()
+            url = urls.validate(ticket, server=server)
+            if timer is not None:
+                timer.record('urls', started)
+            protocol = urls.protocol
+            result = _fetch(url, 'validate', protocol.body(ticket),
+                            protocol.parser_class)
+        else:
+            result = _fetch_from_nodes(nodes, urls, ticket, server)
+    except CASUnavailableError as error:
+        if metrics is not None:
+            _count_validation(metrics, error=error)
+        raise
+
+    _finish_validation(result)
+    _remember_validation(state, (ticket, urls.service), result)
+    if metrics is not None:
+        _count_validation(metrics, result)
+    return result
+
+
+def _count_validation(metrics, result=None, error=None):
+    if error is None:
+        outcome = 'success' if result.success else 'failure'
+    elif isinstance(error, CircuitOpenError):
+        outcome = 'circuit_open'
+    else:
+        outcome = 'error'
+    metrics.increment('cas_validations_total', (('result', outcome),))
+
+
+def _fetch_from_nodes(nodes, urls, ticket, prefer=None):
+    """
+    Validate `ticket` on the nodes of a CAS cluster, fastest healthy
+    node first (or the node at `prefer`, which issued the ticket),
+    failing over to the next node when one cannot be reached. See
+    `_fetch_hedged` when `CAS_HEDGE_DELAY` is set.
+    """
+
+    candidates = nodes.ranked(prefer)
+    delay = _settings().hedge_delay
+    if delay is not None and len(candidates) > 1:
+        return _fetch_hedged(candidates, urls, ticket, delay)
+    error = None
+    for node in candidates:
+        try:
+            return _fetch_node(node, urls, ticket)
+        except CASUnavailableError as exc:
+            if error is None or isinstance(error, CircuitOpenError):
+                error = exc
+    raise error
+
+
+def _fetch_hedged(candidates, urls, ticket, delay):
+    """
+    Validate `ticket` on the first of `candidates`, on the request
+    thread, and send it to the second one as well if the first did not
+    answer within `delay` seconds of the request being sent. The hedge
+    runs on a worker of the `hedge_executor` of the application, and is
+    used when the first node fails; nodes which cannot be reached are
+    failed over at once. A late answer is still recorded by the breaker
+    and latency of its node. Errors other than `CASUnavailableError` are
+    raised to the caller.
+    """
+
+    app = current_app._get_current_object()
+    # The workers have no request to select the tenant from
+    state = _state()
+    pending = list(candidates[1:])
+    # The hedge is 'waiting' out the delay, then 'sent' or 'cancelled'
+    status = ['waiting']
+    lock = threading.Lock()
+    wake = threading.Event()
+
+    def hedge(node):
+        # The delay counts from the first request, not from when a
+        # worker became free for the hedge
+        wake.wait(max(started + delay - timing.clock(), 0))
+        with lock:
+            if status[0] == 'cancelled':
+                return None
+            status[0] = 'sent'
+        with app.app_context():
+            flask.g._cas_state = state
+            return _fetch_node(node, urls, ticket)
+
+    def cancel():
+        # Whether the hedge was sent before it could be cancelled
+        with lock:
+            if status[0] == 'waiting':
+                status[0] = 'cancelled'
+            wake.set()
+            return status[0] == 'sent'
+
+    failure = error = None
+    started = timing.clock()
+    future = state.hedge_executor.submit(hedge, pending.pop(0))
+    try:
+        result = _fetch_node(candidates[0], urls, ticket)
+    except CASUnavailableError as exc:
+        error = exc
+        # Fail over to the hedge at once
+        wake.set()
+    except BaseException:
+        cancel()
+        raise
+    else:
+        sent = cancel()
+        if result.success or not sent:
+            return result
+        failure = result
+    try:
+        result = future.result()
+    except CASUnavailableError as exc:
+        if isinstance(error, CircuitOpenError):
+            error = exc
+    else:
+        if result.success:
+            return result
+        failure = result
+    if failure is not None:
+        return failure
+    for node in pending:
+        try:
+            return _fetch_node(node, urls, ticket)
+        except CASUnavailableError as exc:
+            if isinstance(error, CircuitOpenError):
+                error = exc
+    raise error
+
 
-    current_app.logger.debug("Making GET request to {0}".format(
-        cas_validate_url))
+def _fetch_node(node, urls, ticket):
+    protocol = urls.protocol
+    return _fetch(urls.validate(ticket, server=node.url), 'validate',
+                  protocol.body(ticket), protocol.parser_class, node)
+
+
+def _fetch(url, kind, data=None, parser_class=ServiceResponseParser,
+           node=None):
+    """
+    GET the serviceResponse at `url` (or POST `data` to it) and return
+    the `ValidationResult` parsed by `parser_class`. Failures to reach
+    the CAS are recorded by the circuit breaker (of `node`, the
+    `nodes.Node` of `url` when the CAS is a cluster) and raised as
+    `CASUnavailableError`. `kind` names the request in the metrics
+    ('validate' or 'proxy').
+    """
 
-    xml_from_dict = {}
-    isValid = False
+    state = _state()
+    if node is None:
+        breaker = state.breaker
+    else:
+        breaker = node.breaker
+    timeout = _prepare_request(url, breaker)
+    metrics = state.metrics
+    started = timing.clock()
 
     try:
-        xmldump = urlopen(cas_validate_url).read().strip().decode('utf8', 'ignore')
-        xml_from_dict = parse(xmldump)
-        isValid = True if "cas:authenticationSuccess" in xml_from_dict["cas:serviceResponse"] else False
-    except ValueError:
-        current_app.logger.error("CAS returned unexpected result")
+        if data is None:
+            response = urlopen(url, timeout)
+        else:
+            response = urlopen(url, timeout, data)
+        result = parse_response(
+            response, state.settings.max_response_size, parser_class)
+    except (IOError, HTTPException) as error:
+        if node is None:
+            breaker.record_failure()
+        else:
+            state.nodes.record_failure(node)
+        if metrics is not None:
+            metrics.increment('cas_request_errors_total', (('kind', kind),))
+        raise CASUnavailableError(error)
+    except InvalidResponseError as error:
+        current_app.logger.error(
+            "CAS returned unexpected result: {0}".format(error))
+        result = ValidationResult(False)
+    except BaseException:
+        # Nothing to record, give the probe of a half-open breaker back
+        breaker.release()
+        raise
+    elapsed = timing.clock() - started
+    if node is None:
+        breaker.record_success()
+    else:
+        state.nodes.record_success(node, elapsed)
+    if metrics is not None:
+        metrics.observe('cas_request_seconds', elapsed, (('kind', kind),))
+    return result
 
-    if isValid:
-        current_app.logger.debug("valid")
-        xml_from_dict = xml_from_dict["cas:serviceResponse"]["cas:authenticationSuccess"]
-        username = xml_from_dict["cas:user"]
-        attributes = xml_from_dict.get("cas:attributes", {})
 
-        if "cas:memberOf" in attributes:
-            attributes["cas:memberOf"] = attributes["cas:memberOf"].lstrip('[').rstrip(']').split(',')
-            for group_number in range(0, len(attributes['cas:memberOf'])):
-                attributes['cas:memberOf'][group_number] = attributes['cas:memberOf'][group_number].lstrip(' ').rstrip(' ')
+def _prepare_request(url, breaker=None):
+    """
+    Return the `Timeout` of a request to `url`. Raises
+    `CircuitOpenError` if the CAS should not be called, according to
+    `breaker` (by default the breaker of the application).
+    """
+
+    state = _state()
+    settings = state.settings
+
+    current_app.logger.debug("Making GET request to {0}".format(url))
 
-        flask.session[cas_username_session_key] = username
-        flask.session[cas_attributes_session_key] = attributes
+    if breaker is None:
+        breaker = state.breaker
+    if not breaker.allow():
+        raise CircuitOpenError("Circuit breaker is open")
+
+    return Timeout(
+        connect=settings.connect_timeout,
+        read=settings.read_timeout,
+        total=settings.validate_timeout)
+
+
+def _finish_validation(result):
+    """
+    Post-process the attributes of a successful `ValidationResult`.
+    """
+
+    if not result.success:
+        return
+
+    attributes = result.attributes
+
+    if "cas:memberOf" in attributes:
+        attributes["cas:memberOf"] = parse_member_of(attributes["cas:memberOf"])
+        result.groups = group_set(attributes["cas:memberOf"])
+
+
+def _save_validation(result, ticket):
+    """
+    Save the username and attributes of a successful `ValidationResult`
+    of `ticket` in the session. Returns True if the ticket was valid.
+    """
+
+    settings = _settings()
+    cas_username_session_key = settings.username_session_key
+    cas_attributes_session_key = settings.attributes_session_key
+
+    if result.success:
+        current_app.logger.debug("valid")
+        flask.session[cas_username_session_key] = result.user
+        state = _state()
+        store = state.attribute_store
+        codec = state.attribute_codec
+        _drop_attributes()
+        # A copy, the result may be shared through the ticket cache
+        if codec is None:
+            attributes = dict(result.attributes)
+            groups = result.groups
+        else:
+            attributes = codec.project(result.attributes)
+            groups = attribute_groups(attributes)
+        state.group_sets.set(ticket, (result.user, groups))
+        if store is None:
+            flask.session[cas_attributes_session_key] = (
+                attributes if codec is None else codec.encode(attributes))
+        else:
+            handle = base64.urlsafe_b64encode(os.urandom(12)).decode('ascii')
+            store.set(handle, attributes)
+            flask.session[settings.attributes_handle_key] = handle
+            flask.session.pop(cas_attributes_session_key, None)
+        # Only the PGTIOU goes to the session, the proxy granting ticket
+        # itself stays in the PGT store.
+        if result.proxy_granting_ticket is not None:
+            flask.session[settings.pgt_session_key] = (
+                result.proxy_granting_ticket)
+        if settings.single_logout:
+            session_id = binascii.hexlify(os.urandom(16)).decode('ascii')
+            flask.session[settings.session_id_key] = session_id
+            state.session_index.add(ticket, session_id)
+        flask.g._cas_principal = Principal(
+            result.user, ticket, attributes, groups=groups)
     else:
         current_app.logger.debug("invalid")
 
-    return isValid
+    return result.success
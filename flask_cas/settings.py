@@ -0,0 +1,159 @@
+"""
+flask_cas.settings
+
+The CAS configuration of an application, frozen into an object.
+"""
+
+
+class Settings(object):
+    """ Snapshot of the `CAS_*` keys of an application's config.
+
+    Each slot holds the config key of the same name in upper case with
+    the `CAS_` prefix (ex. `login_route` holds `CAS_LOGIN_ROUTE`). The
+    request handlers read these attributes instead of looking keys up in
+    `app.config` on every request.
+
+    Example usage:
+    >>> settings = Settings({'CAS_SERVER': 'http://sso.pdx.edu'})
+    >>> settings.server
+    'http://sso.pdx.edu'
+    >>> settings.login_route is None
+    True
+    """
+
+    __slots__ = (
+        'server',
+        'after_login',
+        'after_logout',
+        'token_session_key',
+        'username_session_key',
+        'attributes_session_key',
+        'login_route',
+        'logout_route',
+        'validate_route',
+        'connect_timeout',
+        'read_timeout',
+        'validate_timeout',
+        'unavailable_endpoint',
+        'max_response_size',
+        'breaker_threshold',
+        'breaker_recovery_time',
+        'ticket_cache_size',
+        'ticket_cache_ttl',
+        'validate_concurrency',
+        'proxy_route',
+        'proxy_validate_route',
+        'proxy_callback',
+        'accept_proxy_tickets',
+        'pgt_session_key',
+        'pgt_store_size',
+        'pgt_store_ttl',
+        'single_logout',
+        'session_id_key',
+        'session_index_size',
+        'session_index_ttl',
+        'slo_batch_size',
+        'attribute_store',
+        'attribute_store_path',
+        'attribute_store_size',
+        'attribute_store_ttl',
+        'attributes_handle_key',
+        'metrics',
+        'metrics_endpoint',
+        'server_timing',
+        'profile_hook',
+        'protocol',
+        'hedge_delay',
+        'node_ewma_alpha',
+        'node_probe_interval',
+        'node_probe_route',
+        'ticket_affinity',
+        'gateway_session_key',
+        'gateway_window',
+        'keep_attributes',
+        'compact_attributes',
+        'group_cache_size',
+        'group_cache_ttl',
+        'single_flight',
+        'negative_cache_size',
+        'negative_cache_ttl',
+        'rate_limit',
+        'rate_limit_burst',
+        'rate_limit_clients',
+        'warmup',
+        'tenants',
+        'tenant_selector',
+    )
+
+    def __init__(self, config):
+        for name in self.__slots__:
+            setattr(self, name, config.get('CAS_' + name.upper()))
+
+
+def check_settings(settings):
+    """ Raise `ValueError` listing what is wrong with `settings`, if
+    anything. Used by `CAS.warmup`, so that a broken configuration stops
+    the application at startup instead of failing the first login.
+
+    Example usage:
+    >>> check_settings(Settings({'CAS_SERVER': 'sso.pdx.edu'}))
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid CAS configuration: CAS_SERVER 'sso.pdx.edu' is not an http(s) url; CAS_AFTER_LOGIN is not set
+    """
+    from .nodes import server_urls
+    from .protocols import get_protocol
+
+    problems = []
+    if not settings.server:
+        problems.append('CAS_SERVER is not set')
+    else:
+        for url in server_urls(settings.server):
+            if not str(url).lower().startswith(('http://', 'https://')):
+                problems.append(
+                    'CAS_SERVER {0!r} is not an http(s) url'.format(url))
+    if settings.after_login is None:
+        problems.append('CAS_AFTER_LOGIN is not set')
+    if settings.protocol is not None:
+        try:
+            get_protocol(settings.protocol)
+        except ValueError as error:
+            problems.append(str(error))
+    if settings.ticket_affinity:
+        servers = server_urls(settings.server)
+        for suffix, url in sorted(settings.ticket_affinity.items()):
+            if url not in servers:
+                problems.append(
+                    'CAS_TICKET_AFFINITY maps {0!r} to {1!r}, which is not '
+                    'a CAS_SERVER url'.format(suffix, url))
+    if settings.attribute_store not in (None, 'memory', 'sqlite'):
+        problems.append('Unknown CAS_ATTRIBUTE_STORE {0!r}'.format(
+            settings.attribute_store))
+    for name, minimum in (('connect_timeout', 0), ('read_timeout', 0),
+                          ('validate_timeout', 0),
+                          ('gateway_window', 0), ('node_ewma_alpha', 0),
+                          ('group_cache_ttl', 0)):
+        value = getattr(settings, name)
+        if value is not None and not value > minimum:
+            problems.append('CAS_{0} must be greater than {1}'.format(
+                name.upper(), minimum))
+    for name in ('ticket_cache_size', 'negative_cache_size',
+                 'pgt_store_size', 'group_cache_size', 'hedge_delay',
+                 'node_probe_interval', 'rate_limit'):
+        value = getattr(settings, name)
+        if value is not None and value < 0:
+            problems.append('CAS_{0} must not be negative'.format(
+                name.upper()))
+    if settings.node_ewma_alpha is not None and settings.node_ewma_alpha > 1:
+        problems.append('CAS_NODE_EWMA_ALPHA must be at most 1')
+    if settings.tenants is not None and not isinstance(settings.tenants, dict):
+        problems.append('CAS_TENANTS must be a dictionary')
+    if (settings.tenant_selector not in (None, 'host', 'prefix') and
+            not callable(settings.tenant_selector)):
+        problems.append('Unknown CAS_TENANT_SELECTOR {0!r}'.format(
+            settings.tenant_selector))
+    if settings.rate_limit and not (settings.rate_limit_burst or 0) >= 1:
+        problems.append('CAS_RATE_LIMIT_BURST must be at least 1')
+    if problems:
+        raise ValueError(
+            'Invalid CAS configuration: {0}'.format('; '.join(problems)))
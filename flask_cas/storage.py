@@ -0,0 +1,203 @@
+"""
+flask_cas.storage
+
+Pluggable server side storage used by the extension.
+"""
+
+import json
+import os
+import threading
+import time
+
+from .cache import TTLCache
+
+
+class SessionIndex(object):
+    """ Interface of the index used by single logout.
+
+    The index maps the service ticket of each login to the id of the
+    session it created, and remembers which sessions have been revoked
+    by the CAS. Every operation must take constant time, and `revoke`
+    receives a batch of tickets so stores reached over the network can
+    apply a burst of logouts in a single round trip.
+    """
+
+    def add(self, ticket, session_id):
+        """ Remember that `ticket` logged in the session `session_id`. """
+        raise NotImplementedError()
+
+    def revoke(self, tickets):
+        """ Revoke the sessions of the `tickets` and forget the tickets.
+        Returns the number of sessions revoked. """
+        raise NotImplementedError()
+
+    def is_revoked(self, session_id):
+        """ Return True if the session `session_id` has been revoked. """
+        raise NotImplementedError()
+
+
+class MemorySessionIndex(SessionIndex):
+    """ `SessionIndex` kept in process.
+
+    Only suitable when the CAS always reaches the process serving the
+    sessions, ex. a single process application. Entries expire after
+    `ttl` seconds, which should be at least the lifetime of a session.
+
+    Keyword arguments:
+    maxsize -- The maximum number of tickets, and of revoked sessions.
+    ttl -- Seconds a ticket or a revocation is remembered.
+
+    Example usage:
+    >>> index = MemorySessionIndex()
+    >>> index.add('ST-1', 'a3f1')
+    >>> index.revoke(['ST-1', 'ST-unknown'])
+    1
+    >>> index.is_revoked('a3f1')
+    True
+    """
+
+    def __init__(self, maxsize=100000, ttl=86400):
+        self._sessions = TTLCache(maxsize, ttl)
+        self._revoked = TTLCache(maxsize, ttl)
+
+    def add(self, ticket, session_id):
+        self._sessions.set(ticket, session_id)
+
+    def revoke(self, tickets):
+        revoked = 0
+        for ticket in tickets:
+            session_id = self._sessions.pop(ticket)
+            if session_id is not None:
+                self._revoked.set(session_id, True)
+                revoked += 1
+        return revoked
+
+    def is_revoked(self, session_id):
+        return session_id in self._revoked
+
+
+class AttributeStore(object):
+    """ Interface of the server side store of user attributes.
+
+    When a store is configured the attributes released by the CAS are
+    kept in it under a random handle, and only the handle is saved in
+    the session.
+    """
+
+    def get(self, handle):
+        """ Return the attributes saved under `handle`, or None. """
+        raise NotImplementedError()
+
+    def set(self, handle, attributes):
+        """ Save the `attributes` dictionary under `handle`. """
+        raise NotImplementedError()
+
+    def delete(self, handle):
+        """ Forget the attributes saved under `handle`. """
+        raise NotImplementedError()
+
+
+class MemoryAttributeStore(AttributeStore):
+    """ `AttributeStore` kept in process.
+
+    Keyword arguments:
+    maxsize -- The maximum number of sessions whose attributes are kept.
+    ttl -- Seconds the attributes are kept.
+
+    Example usage:
+    >>> store = MemoryAttributeStore()
+    >>> store.set('3q2-7w', {'cas:email': 'bob@example.com'})
+    >>> store.get('3q2-7w')
+    {'cas:email': 'bob@example.com'}
+    """
+
+    def __init__(self, maxsize=10000, ttl=86400):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, handle):
+        return self._cache.get(handle)
+
+    def set(self, handle, attributes):
+        self._cache.set(handle, attributes)
+
+    def delete(self, handle):
+        self._cache.pop(handle)
+
+
+class SQLiteAttributeStore(AttributeStore):
+    """ `AttributeStore` in a SQLite database file, which can be shared
+    by the worker processes of a host.
+
+    Attributes are serialized as JSON. Expired rows are deleted every
+    `PURGE_INTERVAL` writes.
+
+    Keyword arguments:
+    path -- The database file, created if needed.
+    ttl -- Seconds the attributes are kept.
+    """
+
+    PURGE_INTERVAL = 100
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cas_attributes ('
+                ' handle TEXT PRIMARY KEY,'
+                ' attributes TEXT NOT NULL,'
+                ' expires REAL NOT NULL)')
+
+    def _connection(self):
+        # sqlite3 connections may not be shared by threads or processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # Imported here, most applications never use this store
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=10)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, handle):
+        row = self._connection().execute(
+            'SELECT attributes FROM cas_attributes'
+            ' WHERE handle = ? AND expires > ?',
+            (handle, time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, handle, attributes):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cas_attributes VALUES (?, ?, ?)',
+                (handle, json.dumps(attributes), now + self.ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                connection.execute(
+                    'DELETE FROM cas_attributes WHERE expires <= ?', (now,))
+
+    def delete(self, handle):
+        with self._connection() as connection:
+            connection.execute(
+                'DELETE FROM cas_attributes WHERE handle = ?', (handle,))
+
+
+def create_attribute_store(settings):
+    """ Create the `AttributeStore` selected by `CAS_ATTRIBUTE_STORE`:
+    None to keep the attributes in the session, 'memory' or 'sqlite'.
+    """
+    kind = settings.attribute_store
+    if kind is None:
+        return None
+    if kind == 'memory':
+        return MemoryAttributeStore(
+            settings.attribute_store_size, settings.attribute_store_ttl)
+    if kind == 'sqlite':
+        return SQLiteAttributeStore(
+            settings.attribute_store_path, settings.attribute_store_ttl)
+    raise ValueError('Unknown CAS_ATTRIBUTE_STORE {0!r}'.format(kind))
@@ -0,0 +1,156 @@
+"""
+flask_cas.tenants
+
+Several CAS servers in one application, one per tenant.
+
+`CAS_TENANTS` maps the key of each tenant to the `CAS_*` configuration
+it overrides, and `CAS_TENANT_SELECTOR` tells how the tenant of a
+request is found: by host name (`'host'`), by the first segment of the
+path (`'prefix'`), or by a callable taking the request and returning
+the key. Requests which match no tenant use the configuration of the
+application itself.
+
+Each tenant gets its own state (connection pool, caches, breaker,
+metrics), created the first time a request for it arrives, while the
+routes are registered once for all tenants. Unless a tenant sets them,
+its session keys are those of the application suffixed with its key,
+so that the tenants sharing a session cookie do not see each other's
+users.
+"""
+
+import threading
+
+# The keys of the session, made distinct for each tenant
+TENANT_SESSION_KEYS = (
+    'CAS_TOKEN_SESSION_KEY',
+    'CAS_USERNAME_SESSION_KEY',
+    'CAS_ATTRIBUTES_SESSION_KEY',
+    'CAS_ATTRIBUTES_HANDLE_KEY',
+    'CAS_PGT_SESSION_KEY',
+    'CAS_SESSION_ID_KEY',
+    'CAS_GATEWAY_SESSION_KEY',
+)
+
+
+def tenant_config(config, key, overrides):
+    """ The `CAS_*` configuration of the tenant `key`: `config` updated
+    with its `overrides`, and session keys of its own.
+
+    Example usage:
+    >>> config = tenant_config(
+    ...     {'CAS_SERVER': 'https://sso.pdx.edu',
+    ...      'CAS_USERNAME_SESSION_KEY': 'CAS_USERNAME'},
+    ...     'law', {'CAS_SERVER': 'https://sso.law.pdx.edu'})
+    >>> config['CAS_SERVER'], config['CAS_USERNAME_SESSION_KEY']
+    ('https://sso.law.pdx.edu', 'CAS_USERNAME:law')
+    """
+    merged = dict((name, value) for name, value in config.items()
+                  if name.startswith('CAS_'))
+    for name in TENANT_SESSION_KEYS:
+        if merged.get(name) is not None:
+            merged[name] = '{0}:{1}'.format(merged[name], key)
+    merged['CAS_TENANTS'] = None
+    merged.update(overrides)
+    return merged
+
+
+def select_host(request):
+    """ The host name of `request`, without the port.
+
+    Example usage:
+    >>> from werkzeug.test import EnvironBuilder
+    >>> select_host(EnvironBuilder(base_url='http://Law.pdx.edu:8080/')
+    ...             .get_request())
+    'law.pdx.edu'
+    """
+    host = request.host.lower()
+    if host.endswith(']') or ':' not in host:
+        return host
+    return host.rpartition(':')[0]
+
+
+def select_prefix(request):
+    """ The first segment of the path of `request`, which is the
+    `<cas_tenant>` of the routes registered with the url prefix
+    `/<cas_tenant>`.
+
+    Example usage:
+    >>> from werkzeug.test import EnvironBuilder
+    >>> select_prefix(EnvironBuilder(path='/law/login/').get_request())
+    'law'
+    """
+    return request.path.lstrip('/').partition('/')[0]
+
+
+SELECTORS = {
+    'host': select_host,
+    'prefix': select_prefix,
+}
+
+
+class TenantSet(object):
+    """ The tenants of an application and their state.
+
+    Keyword arguments:
+    root -- The state of the application, used by requests of no tenant.
+    tenants -- Dictionary of the `CAS_*` overrides keyed by tenant.
+    selector -- 'host', 'prefix', or a callable returning the tenant key
+                of a request.
+    state_class -- Called with the application, the configuration and
+                   the key of a tenant to create its state.
+    """
+
+    def __init__(self, root, tenants, selector, state_class):
+        self.root = root
+        if not callable(selector):
+            if selector not in SELECTORS:
+                raise ValueError(
+                    'Unknown CAS_TENANT_SELECTOR {0!r}'.format(selector))
+            selector = SELECTORS[selector]
+        self.selector = selector
+        self.tenants = tenants
+        self._state_class = state_class
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ The state of the tenant `key`, created on first use. Raises
+        `KeyError` for unknown tenants. """
+        state = self._states.get(key)
+        if state is None:
+            overrides = self.tenants[key]
+            with self._lock:
+                state = self._states.get(key)
+                if state is None:
+                    state = self._state_class(
+                        self.root.app,
+                        tenant_config(self.root.app.config, key, overrides),
+                        key)
+                    self._states[key] = state
+        return state
+
+    def select(self, request):
+        """ The state of the tenant of `request`, or the state of the
+        application if it has none. """
+        key = self.selector(request)
+        if key is None or key not in self.tenants:
+            return self.root
+        return self.get(key)
+
+    def states(self):
+        """ The states of the tenants created so far. """
+        return list(self._states.values())
+
+    def __len__(self):
+        return len(self.tenants)
+
+
+def create_tenant_set(state):
+    """ Return the `TenantSet` of the application of `state`, or None if
+    `CAS_TENANTS` is not set. """
+    settings = state.settings
+    if not settings.tenants:
+        return None
+    return TenantSet(
+        state, settings.tenants, settings.tenant_selector or 'host',
+        type(state))
@@ -0,0 +1,297 @@
+"""
+flask_cas.testing
+
+A stub CAS server for tests and load tests, running in process on a
+local port. It needs no network access.
+
+The stub logs in every user sent to its login route without asking for
+credentials and redirects back to the service with a new ticket. Its
+latency, failure rate and the number of released attributes can be
+set to mimic a real CAS.
+
+Example usage:
+
+    with StubCAS(latency=0.02) as cas_server:
+        app.config['CAS_SERVER'] = cas_server.url
+        ...
+"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import parse_qs
+    from urlparse import urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+    from urllib.parse import urlencode
+    from urllib.parse import urlsplit
+
+from xml.sax.saxutils import escape
+
+from .cache import TTLCache
+
+
+_ASSERTION_ARTIFACT = re.compile(
+    r'<(?:\w+:)?AssertionArtifact>\s*([^<\s]+)\s*</')
+
+
+def _xml_response(issued, groups):
+    if issued is None:
+        return (
+            '<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+            '<cas:authenticationFailure code="INVALID_TICKET">'
+            'Ticket not recognized</cas:authenticationFailure>'
+            '</cas:serviceResponse>'), 'application/xml'
+    return (
+        '<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+        '<cas:authenticationSuccess><cas:user>{0}</cas:user>'
+        '<cas:attributes>{1}</cas:attributes>'
+        '</cas:authenticationSuccess></cas:serviceResponse>'.format(
+            escape(issued[1]),
+            ''.join('<cas:group>{0}</cas:group>'.format(group)
+                    for group in groups))), 'application/xml'
+
+
+def _json_response(issued, groups):
+    if issued is None:
+        response = {'authenticationFailure': {
+            'code': 'INVALID_TICKET', 'description': 'Ticket not recognized'}}
+    else:
+        attributes = {'group': groups} if groups else {}
+        response = {'authenticationSuccess': {
+            'user': issued[1], 'attributes': attributes}}
+    return json.dumps({'serviceResponse': response}), 'application/json'
+
+
+def _saml_response(issued, groups):
+    if issued is None:
+        status = ('<samlp:StatusCode Value="samlp:Requester"/>'
+                  '<samlp:StatusMessage>Ticket not recognized'
+                  '</samlp:StatusMessage>')
+        assertion = ''
+    else:
+        status = '<samlp:StatusCode Value="samlp:Success"/>'
+        subject = ('<saml:Subject><saml:NameIdentifier>{0}'
+                   '</saml:NameIdentifier></saml:Subject>').format(
+                       escape(issued[1]))
+        attributes = ''
+        if groups:
+            attributes = (
+                '<saml:AttributeStatement>{0}<saml:Attribute'
+                ' AttributeName="group" AttributeNamespace="'
+                'http://www.ja-sig.org/products/cas/">{1}</saml:Attribute>'
+                '</saml:AttributeStatement>').format(
+                    subject, ''.join(
+                        '<saml:AttributeValue>{0}</saml:AttributeValue>'
+                        .format(group) for group in groups))
+        assertion = (
+            '<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:1.0:assertion"'
+            ' MajorVersion="1" MinorVersion="1">'
+            '<saml:AuthenticationStatement AuthenticationMethod='
+            '"urn:oasis:names:tc:SAML:1.0:am:password">{0}'
+            '</saml:AuthenticationStatement>{1}</saml:Assertion>').format(
+                subject, attributes)
+    return (
+        '<SOAP-ENV:Envelope'
+        ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<SOAP-ENV:Body>'
+        '<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol"'
+        ' MajorVersion="1" MinorVersion="1">'
+        '<samlp:Status>{0}</samlp:Status>{1}</samlp:Response>'
+        '</SOAP-ENV:Body></SOAP-ENV:Envelope>').format(
+            status, assertion), 'text/xml'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    # Load tests open many connections at once
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.stub.handle(self)
+
+    def do_POST(self):
+        self.server.stub.handle(self)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubCAS(object):
+    """ A CAS server answering on `url`.
+
+    Routes (with the default `prefix` '/cas'):
+
+    |Route                  | Behavior                                  |
+    |-----------------------|-------------------------------------------|
+    |/cas                   | Redirects to `service` with a new ticket  |
+    |/cas/serviceValidate   | Validates a ticket, each ticket only once |
+    |/cas/proxyValidate     | Same as /cas/serviceValidate              |
+    |/cas/p3/serviceValidate| Same, answers in JSON with `format=JSON`  |
+    |/cas/p3/proxyValidate  | Same as /cas/p3/serviceValidate           |
+    |/cas/samlValidate      | SAML 1.1 validation of a POSTed ticket    |
+    |/cas/logout            | Redirects to `service`, or answers 200    |
+
+    Keyword arguments:
+    latency -- Seconds added to each validation.
+    jitter -- Up to this many seconds are added to `latency` at random.
+    failure_rate -- Fraction of validations answered with a 500 error.
+    attributes -- Number of `cas:group` attribute values released.
+    username -- The username of the logins, '{n}' is replaced by a
+                counter (ex. 'user{n}').
+    host -- The interface to listen on.
+    port -- The port to listen on, 0 picks a free port.
+    prefix -- The path of the CAS routes.
+    seed -- Seed of the random failures and jitter.
+
+    Attributes:
+    url -- The `CAS_SERVER` url of the stub.
+    stats -- Dictionary of counters: logins, validations, failures.
+    """
+
+    def __init__(self, latency=0, jitter=0, failure_rate=0, attributes=0,
+                 username='user{n}', host='127.0.0.1', port=0,
+                 prefix='/cas', seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.attributes = attributes
+        self.username = username
+        self.prefix = prefix.rstrip('/')
+        self.stats = {'logins': 0, 'validations': 0, 'failures': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        # Issued tickets: ticket -> (service, username)
+        self._tickets = TTLCache(maxsize=100000, ttl=300)
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self._thread = None
+        self.url = 'http://{0}:{1}'.format(host, self._server.server_port)
+
+    def start(self):
+        """ Serve requests on a background thread. """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and close the listening socket. """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def issue_ticket(self, service):
+        """ Return a new service ticket for `service`. """
+        number = next(self._counter)
+        ticket = 'ST-{0}-stub'.format(number)
+        username = self.username.replace('{n}', str(number))
+        self._tickets.set(ticket, (service, username))
+        with self._lock:
+            self.stats['logins'] += 1
+        return ticket
+
+    def handle(self, request):
+        parts = urlsplit(request.path)
+        query = dict((key, values[0])
+                     for key, values in parse_qs(parts.query).items())
+        path = parts.path.rstrip('/')
+        if path == self.prefix:
+            self._login(request, query)
+        elif path in (self.prefix + '/serviceValidate',
+                      self.prefix + '/proxyValidate',
+                      self.prefix + '/p3/serviceValidate',
+                      self.prefix + '/p3/proxyValidate'):
+            self._validate(request, query.get('service'), query.get('ticket'),
+                           query.get('format', 'XML').upper())
+        elif path == self.prefix + '/samlValidate':
+            length = int(request.headers.get('Content-Length') or 0)
+            ticket = _ASSERTION_ARTIFACT.search(
+                request.rfile.read(length).decode('utf-8'))
+            self._validate(request, query.get('TARGET'),
+                           ticket.group(1) if ticket else None, 'SAML')
+        elif path == self.prefix + '/logout':
+            self._logout(request, query)
+        else:
+            self._send(request, 404, b'')
+
+    def _login(self, request, query):
+        service = query.get('service')
+        if not service:
+            self._send(request, 200, b'Logged in')
+            return
+        ticket = self.issue_ticket(service)
+        separator = '&' if '?' in service else '?'
+        self._redirect(
+            request, service + separator + urlencode([('ticket', ticket)]))
+
+    def _logout(self, request, query):
+        if query.get('service'):
+            self._redirect(request, query['service'])
+        else:
+            self._send(request, 200, b'Logged out')
+
+    def _validate(self, request, service, ticket, response_format):
+        with self._lock:
+            self.stats['validations'] += 1
+            delay = self.latency + self._random.random() * self.jitter
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.stats['failures'] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._send(request, 500, b'Internal Server Error')
+            return
+        issued = self._tickets.pop(ticket)
+        if issued is None or issued[0] != service:
+            issued = None
+        groups = ['cn=group{0}'.format(number)
+                  for number in range(self.attributes)]
+        if response_format == 'JSON':
+            body, content_type = _json_response(issued, groups)
+        elif response_format == 'SAML':
+            body, content_type = _saml_response(issued, groups)
+        else:
+            body, content_type = _xml_response(issued, groups)
+        self._send(request, 200, body.encode('utf-8'), content_type)
+
+    def _redirect(self, request, location):
+        request.send_response(302)
+        request.send_header('Location', location)
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+
+    def _send(self, request, status, body, content_type='text/plain'):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
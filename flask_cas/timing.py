@@ -0,0 +1,87 @@
+"""
+flask_cas.timing
+
+Per-phase timing of the login flow.
+
+While a `PhaseTimer` is active on the current thread, the blueprint,
+the pooled transport and the parser add the time spent in each phase
+of a validation to it:
+
+|Phase   | Time spent                                            |
+|--------|-------------------------------------------------------|
+|urls    | building the CAS urls                                 |
+|dns     | resolving the CAS host name                           |
+|connect | establishing the TCP connection                       |
+|tls     | the TLS handshake                                     |
+|ttfb    | sending the request until the response headers arrive |
+|read    | reading the response body                             |
+|parse   | parsing the response body                             |
+|session | saving the user in the session                        |
+
+Phases of connections reused from the pool (dns, connect, tls) are
+absent. When no timer is active, instrumented code only checks for one.
+"""
+
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = dict
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+_local = threading.local()
+
+
+class PhaseTimer(object):
+    """ Accumulates the seconds spent per phase.
+
+    Example usage:
+    >>> timer = PhaseTimer()
+    >>> timer.add('parse', 0.0012)
+    >>> timer.add('parse', 0.0003)
+    >>> timer.server_timing()
+    'parse;dur=1.50'
+    """
+
+    __slots__ = ('phases',)
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def record(self, phase, started):
+        """ Add the time since `started` to `phase` and return the
+        current clock, to chain phases. """
+        now = clock()
+        self.add(phase, now - started)
+        return now
+
+    def server_timing(self):
+        """ The phases as the value of a `Server-Timing` header, in
+        milliseconds. """
+        return ', '.join('{0};dur={1:.2f}'.format(phase, seconds * 1000)
+                         for phase, seconds in self.phases.items())
+
+
+def current():
+    """ The `PhaseTimer` active on this thread, or None. """
+    return getattr(_local, 'timer', None)
+
+
+def start():
+    """ Activate a new `PhaseTimer` on this thread and return it. """
+    timer = _local.timer = PhaseTimer()
+    return timer
+
+
+def stop():
+    """ Deactivate the `PhaseTimer` of this thread. """
+    _local.timer = None
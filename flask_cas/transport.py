@@ -0,0 +1,595 @@
+"""
+flask_cas.transport
+
+HTTP transports used to talk to the CAS server.
+
+A transport has a single job: given a url, return a file-like response
+object whose body can be read with `read()` and released with `close()`.
+`routing.urlopen` dispatches to the transport of the current
+application, so tests (and applications) can either patch
+`routing.urlopen` or install their own `Transport`.
+"""
+
+import errno
+import os
+import socket
+import threading
+import time
+
+from . import timing
+
+try:
+    from httplib import BadStatusLine
+    from httplib import HTTPConnection
+    from httplib import HTTPException
+    from httplib import HTTPSConnection
+    from urllib2 import HTTPError
+    from urlparse import urlsplit
+except ImportError:
+    from http.client import BadStatusLine
+    from http.client import HTTPConnection
+    from http.client import HTTPException
+    from http.client import HTTPSConnection
+    from urllib.error import HTTPError
+    from urllib.parse import urlsplit
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+class DeadlineExceeded(socket.timeout):
+    """ The total time budget of a request was used up. """
+
+
+class Timeout(object):
+    """ Time budget of a single request.
+
+    Every blocking step is bounded by its own limit and by what is left
+    of the total budget, whichever is smaller. The budget starts when
+    the object is created.
+
+    Keyword arguments:
+    connect -- Seconds allowed to establish a connection.
+    read -- Seconds allowed for each read from the socket.
+    total -- Seconds allowed for the whole request, body included.
+
+    Example usage:
+    >>> timeout = Timeout(connect=5, read=10, total=1)
+    >>> timeout.connect_timeout() <= 1
+    True
+    """
+
+    def __init__(self, connect=None, read=None, total=None):
+        self.connect = connect
+        self.read = read
+        self.total = total
+        self.started = time.time()
+
+    def remaining(self):
+        """ Seconds left of the total budget, None if unlimited. """
+        if self.total is None:
+            return None
+        return self.total - (time.time() - self.started)
+
+    def check(self):
+        """ Raise `DeadlineExceeded` if the budget is used up. """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded('CAS request exceeded its deadline')
+        return remaining
+
+    def _bounded(self, limit):
+        remaining = self.check()
+        if remaining is None:
+            return limit
+        if limit is None:
+            return remaining
+        return min(limit, remaining)
+
+    def connect_timeout(self):
+        return self._bounded(self.connect)
+
+    def read_timeout(self):
+        return self._bounded(self.read)
+
+
+# Errors of sending a request on a connection the server closed
+_STALE_ERRNOS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)
+
+
+def stale_connection(error):
+    """ True if `error` tells that the server had closed the keep-alive
+    connection of the request before answering any byte of it, so the
+    request can be sent again on a new connection. Timeouts are not:
+    the server may have received the request (and its single use
+    ticket).
+
+    Example usage:
+    >>> stale_connection(BadStatusLine("''"))
+    True
+    >>> stale_connection(DeadlineExceeded('CAS request exceeded its deadline'))
+    False
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, BadStatusLine):
+        # Including RemoteDisconnected, no status line at all
+        return True
+    return (isinstance(error, socket.error) and
+            error.errno in _STALE_ERRNOS)
+
+
+# Headers of the requests POSTing an XML document
+_POST_HEADERS = {'Content-Type': 'text/xml; charset=utf-8'}
+
+
+class Transport(object):
+    """ Interface for the object that performs CAS HTTP requests.
+
+    Subclasses must implement `open`. `close` is called when the
+    transport is no longer needed and should release any resources
+    held by it.
+    """
+
+    def open(self, url, timeout=None, data=None):
+        """ Perform a GET request for url and return a file-like
+        response. Non 2xx responses must raise `HTTPError`. `timeout`
+        is an optional `Timeout` bounding the request. If `data` is
+        given, it is POSTed as an XML document instead; it is only
+        passed when a protocol requires it (see `protocols`).
+        """
+        raise NotImplementedError()
+
+    def warm(self, url, connections=1, timeout=None):
+        """ Prepare the transport for requests to the host of `url`,
+        see `CAS.warmup`. The default resolves the host name, which
+        primes the caches of the system resolver. """
+        parts = urlsplit(url)
+        socket.getaddrinfo(
+            parts.hostname,
+            parts.port or (443 if parts.scheme.lower() == 'https' else 80),
+            0, socket.SOCK_STREAM)
+
+    def close(self):
+        pass
+
+
+class UrllibTransport(Transport):
+    """ Transport backed by `urlopen`. Every request opens a new
+    connection.
+    """
+
+    def open(self, url, timeout=None, data=None):
+        # Imported here, the pooled transport does not need it
+        try:
+            import urllib2 as request
+        except ImportError:
+            from urllib import request
+        if data is not None:
+            url = request.Request(url, data, _POST_HEADERS)
+        if timeout is None:
+            return request.urlopen(url)
+        # urlopen has a single timeout for the connection and the reads;
+        # the connections of these handlers switch to the read timeout
+        # once connected.
+        sockets = []
+        handlers = [_timed_handler(handler_class, timeout, sockets)
+                    for handler_class in (
+                        request.HTTPHandler,
+                        getattr(request, 'HTTPSHandler', None))
+                    if handler_class is not None]
+        response = request.build_opener(*handlers).open(
+            url, timeout=timeout.connect_timeout())
+        return _TimedResponse(response, timeout, sockets)
+
+
+def _timed_handler(handler_class, timeout, sockets):
+    # An instance of `handler_class` whose connections connect within
+    # the connect timeout of `timeout` and then read within its read
+    # timeout. The sockets are appended to `sockets`.
+
+    class TimedHandler(handler_class):
+
+        def do_open(self, http_class, req, **kwargs):
+
+            class TimedConnection(http_class):
+
+                def connect(self):
+                    http_class.connect(self)
+                    self.sock.settimeout(timeout.read_timeout())
+                    sockets.append(self.sock)
+
+            return handler_class.do_open(
+                self, TimedConnection, req, **kwargs)
+
+    return TimedHandler()
+
+
+class _TimedResponse(object):
+    """ File-like wrapper around a response of `urlopen` which bounds
+    each read by what is left of the total budget of `timeout`.
+    """
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, response, timeout, sockets):
+        self._response = response
+        self._timeout = timeout
+        self._sockets = sockets
+
+    def _read(self, amt):
+        read_timeout = self._timeout.read_timeout()
+        for sock in self._sockets:
+            try:
+                sock.settimeout(read_timeout)
+            except socket.error:
+                # Closed once the whole body was read
+                pass
+        return self._response.read(amt)
+
+    def read(self, amt=None):
+        if amt is not None:
+            return self._read(amt)
+        # Read in chunks so the total budget is checked between reads.
+        chunks = []
+        while True:
+            chunk = self._read(self.chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self._response.close()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                       source_address=None):
+    # socket.create_connection, timing the name resolution and the
+    # connection as separate phases when a PhaseTimer is active.
+    timer = timing.current()
+    if timer is None:
+        return socket.create_connection(address, timeout, source_address)
+    host, port = address
+    started = timing.clock()
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    started = timer.record('dns', started)
+    error = None
+    for family, type_, proto, _, sockaddr in addresses:
+        sock = None
+        try:
+            sock = socket.socket(family, type_, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            timer.record('connect', started)
+            return sock
+        except socket.error as exc:
+            error = exc
+            if sock is not None:
+                sock.close()
+    timer.record('connect', started)
+    if error is not None:
+        raise error
+    raise socket.error('getaddrinfo returned an empty list')
+
+
+class _HTTPConnection(HTTPConnection):
+    """ HTTPConnection whose connection phases can be timed. """
+
+    def __init__(self, host, port=None, **kwargs):
+        HTTPConnection.__init__(self, host, port, **kwargs)
+        # Python 3 connects through this attribute, Python 2 through
+        # socket.create_connection (dns and connect are then untimed)
+        self._create_connection = _create_connection
+
+
+class _HTTPSConnection(HTTPSConnection):
+    """ HTTPSConnection which resumes a previously negotiated TLS
+    session, so a reconnect to the same host skips the full handshake.
+    """
+
+    def __init__(self, host, port=None, context=None, tls_sessions=None,
+                 **kwargs):
+        HTTPSConnection.__init__(self, host, port, context=context, **kwargs)
+        self._tls_sessions = tls_sessions if tls_sessions is not None else {}
+
+    def connect(self):
+        sock = _create_connection(
+            (self.host, self.port), self.timeout, self.source_address)
+        timer = timing.current()
+        started = timing.clock()
+        kwargs = {'server_hostname': self.host}
+        session = self._tls_sessions.get((self.host, self.port))
+        if session is not None:
+            kwargs['session'] = session
+        try:
+            self.sock = self._context.wrap_socket(sock, **kwargs)
+        except TypeError:
+            # `session` is only supported by Python 3.6+
+            kwargs.pop('session', None)
+            self.sock = self._context.wrap_socket(sock, **kwargs)
+        if timer is not None:
+            timer.record('tls', started)
+        self.remember_session()
+
+    def remember_session(self):
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            self._tls_sessions[(self.host, self.port)] = session
+
+
+class _PooledResponse(object):
+    """ File-like wrapper around an `HTTPResponse` which hands the
+    connection back to the pool once the body has been consumed.
+    """
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, pool, key, connection, response, timeout=None):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._timeout = timeout
+        self.status = response.status
+        self.headers = response.msg
+
+    def _read(self, amt):
+        if self._timeout is not None:
+            read_timeout = self._timeout.read_timeout()
+            # getresponse() drops the socket of a connection the server
+            # closes after the response (HTTP/1.0, `Connection: close`);
+            # the response then reads with the timeout of the request.
+            sock = (self._connection.sock
+                    if self._connection is not None else None)
+            if sock is not None:
+                sock.settimeout(read_timeout)
+        return self._response.read(amt)
+
+    def read(self, amt=None):
+        if amt is not None:
+            data = self._read(amt)
+            if not data:
+                self.close()
+            return data
+        # Read in chunks so the total budget is checked between reads.
+        chunks = []
+        while True:
+            chunk = self._read(self.chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.close()
+        return b''.join(chunks)
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._pool._release(self._key, connection, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _pool_key(url):
+    # The (scheme, host, port) pool of `url`, and the path to request
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path = '{0}?{1}'.format(path, parts.query)
+    return (scheme, parts.hostname, port), path
+
+
+class PooledTransport(Transport):
+    """ Transport keeping persistent (keep-alive) connections per host.
+
+    HTTPS connections share one `SSLContext` and resume the TLS session
+    of earlier connections to the same host. The pool detects a fork and
+    starts over in the child, so connections are never shared between
+    worker processes.
+
+    Keyword arguments:
+    pool_size -- Idle connections kept per host.
+    max_idle -- Seconds an idle connection may be kept before it is
+                discarded.
+    max_per_host -- Connections per host which may be in use at the same
+                    time. Further requests wait for a free connection.
+                    None means unlimited.
+    ssl_context -- The `SSLContext` used for https urls.
+    """
+
+    def __init__(self, pool_size=10, max_idle=60, max_per_host=None,
+                 ssl_context=None):
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        if ssl_context is None and ssl is not None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+        self._lock = threading.Condition(threading.Lock())
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {}
+        self._in_use = {}
+        self._tls_sessions = {}
+
+    def _check_pid(self):
+        # After a fork the child must not touch the parent's sockets.
+        # They are dropped without being closed, closing a TLS socket
+        # would send a close_notify on the parent's behalf.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return _HTTPSConnection(
+                host, port,
+                context=self.ssl_context,
+                tls_sessions=self._tls_sessions)
+        return _HTTPConnection(host, port)
+
+    def _acquire(self, key, timeout=None):
+        with self._lock:
+            self._check_pid()
+            if self.max_per_host is not None:
+                while self._in_use.get(key, 0) >= self.max_per_host:
+                    self._lock.wait(
+                        timeout.check() if timeout is not None else None)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            idle = self._idle.get(key)
+            now = time.time()
+            while idle:
+                connection, released_at = idle.pop()
+                if now - released_at <= self.max_idle:
+                    return connection, True
+                connection.close()
+        return self._new_connection(key), False
+
+    def _release(self, key, connection, reusable):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._in_use[key] -= 1
+            idle = self._idle.setdefault(key, [])
+            if reusable and len(idle) < self.pool_size:
+                if hasattr(connection, 'remember_session'):
+                    connection.remember_session()
+                idle.append((connection, time.time()))
+            else:
+                connection.close()
+            self._lock.notify()
+
+    def warm(self, url, connections=1, timeout=None):
+        """ Open up to `connections` connections to the host of `url`
+        and keep them idle in the pool, so the first requests skip the
+        name resolution, the TCP connection and the TLS handshake. The
+        TLS session is kept for resumption even if the server closes the
+        connections before they are used. """
+        key, _ = _pool_key(url)
+        opened = []
+        try:
+            for _ in range(min(connections, self.pool_size)):
+                connection = self._new_connection(key)
+                if timeout is not None:
+                    connection.timeout = timeout.connect_timeout()
+                connection.connect()
+                opened.append(connection)
+        finally:
+            with self._lock:
+                self._check_pid()
+                idle = self._idle.setdefault(key, [])
+                now = time.time()
+                for connection in opened:
+                    if hasattr(connection, 'remember_session'):
+                        connection.remember_session()
+                    if len(idle) < self.pool_size:
+                        idle.append((connection, now))
+                    else:
+                        connection.close()
+
+    def open(self, url, timeout=None, data=None):
+        key, path = _pool_key(url)
+        connection, reused = self._acquire(key, timeout)
+        try:
+            try:
+                response = self._request(connection, path, timeout, data)
+            except (socket.error, IOError, HTTPException) as error:
+                if not reused or not stale_connection(error):
+                    raise
+                # The server closed an idle keep-alive connection, retry
+                # once on a fresh one.
+                connection.close()
+                connection = self._new_connection(key)
+                response = self._request(connection, path, timeout, data)
+        except Exception:
+            connection.close()
+            self._release(key, connection, False)
+            raise
+
+        pooled = _PooledResponse(self, key, connection, response, timeout)
+        if not 200 <= response.status < 300:
+            pooled.read()
+            raise HTTPError(url, response.status, response.reason,
+                            response.msg, None)
+        return pooled
+
+    def _request(self, connection, path, timeout=None, data=None):
+        timer = timing.current()
+        if timeout is not None:
+            connection.timeout = timeout.connect_timeout()
+        if connection.sock is None and (timeout is not None
+                                        or timer is not None):
+            connection.connect()
+        if timeout is not None:
+            connection.sock.settimeout(timeout.read_timeout())
+        started = timing.clock()
+        if data is None:
+            connection.request(
+                'GET', path, headers={'Connection': 'keep-alive'})
+        else:
+            headers = dict(_POST_HEADERS, Connection='keep-alive')
+            connection.request('POST', path, data, headers)
+        response = connection.getresponse()
+        if timer is not None:
+            timer.record('ttfb', started)
+        return response
+
+    def stats(self):
+        """ Return the number of idle and in use connections. """
+        with self._lock:
+            self._check_pid()
+            return {
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'in_use': sum(self._in_use.values()),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                for idle in self._idle.values():
+                    for connection, _ in idle:
+                        connection.close()
+            self._idle = {}
+
+
+def create_transport(config):
+    """ Create the transport described by an application's config. """
+    if not config['CAS_CONNECTION_POOL']:
+        return UrllibTransport()
+    return PooledTransport(
+        pool_size=config['CAS_POOL_SIZE'],
+        max_idle=config['CAS_POOL_MAX_IDLE'],
+        max_per_host=config['CAS_POOL_MAX_PER_HOST'],
+    )
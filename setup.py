@@ -73,8 +73,10 @@ if __name__ == "__main__":
         ],
         install_requires = [
             "Flask",
-            "xmltodict",
         ],
+        extras_require = {
+            "async": ["Flask[async]"],
+        },
         test_requires = [
             "Nose",
             "Mock",
@@ -0,0 +1,381 @@
+import asyncio
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import flask
+
+from flask_cas import group_required
+from flask_cas import login_optional
+from flask_cas import login_required
+from flask_cas.aio import AsyncCAS
+from flask_cas.aio import AsyncioTransport
+from flask_cas.aio import BadResponseError
+from flask_cas.aio import HTTPStatusError
+from flask_cas.transport import DeadlineExceeded
+from flask_cas.transport import Timeout
+
+SUCCESS = (
+    b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+    b'<cas:authenticationSuccess><cas:user>bob</cas:user>'
+    b'</cas:authenticationSuccess></cas:serviceResponse>')
+
+FAILURE = (
+    b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+    b'<cas:authenticationFailure code="INVALID_TICKET">'
+    b'</cas:authenticationFailure></cas:serviceResponse>')
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.ports.add(self.client_address[1])
+        self.server.paths.append(self.path)
+        if self.path.startswith('/slow'):
+            threading.Event().wait(0.5)
+        if self.path.startswith('/badlength'):
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n')
+            return
+        if self.path.startswith('/garbage'):
+            self.wfile.write(b'HTTP/1.1 OK\r\n\r\n')
+            self.close_connection = True
+            return
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = SUCCESS if 'ticket=good' in self.path else FAILURE
+        self.send_response(200)
+        if self.path.startswith('/chunked'):
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(body), 50):
+                chunk = body[start:start + 50]
+                self.wfile.write('{0:x}\r\n'.format(len(chunk)).encode())
+                self.wfile.write(chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SlowHandler(_Handler):
+
+    def do_GET(self):
+        threading.Event().wait(0.5)
+        _Handler.do_GET(self)
+
+
+class _SlowServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # The client cancelled the request it hedged
+        pass
+
+
+class _ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.ports = set()
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class test_asyncio_transport(_ServerTestCase):
+
+    def fetch(self, *paths, timeout=None):
+        transport = AsyncioTransport()
+
+        async def fetch_all():
+            bodies = []
+            try:
+                for path in paths:
+                    response = await transport.open(self.url + path, timeout)
+                    bodies.append(await response.read())
+            finally:
+                transport.close()
+            return bodies
+
+        return asyncio.run(fetch_all())
+
+    def test_content_length(self):
+        self.assertEqual(self.fetch('/cas?ticket=good'), [SUCCESS])
+
+    def test_chunked(self):
+        self.assertEqual(self.fetch('/chunked?ticket=good'), [SUCCESS])
+
+    def test_connection_is_reused(self):
+        self.fetch('/cas', '/chunked', '/cas')
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_http_error(self):
+        with self.assertRaises(HTTPStatusError):
+            self.fetch('/missing')
+
+    def test_timeout_on_reused_connection_is_not_retried(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.fetch('/cas', '/slow?ticket=ST-1',
+                       timeout=Timeout(connect=1, read=0.1, total=5))
+        # A retry would reach the server at once
+        threading.Event().wait(0.3)
+        self.assertEqual(self.server.paths.count('/slow?ticket=ST-1'), 1)
+
+    def test_invalid_response_closes_connection(self):
+        transport = AsyncioTransport()
+        writers = []
+        connect = transport._connect
+
+        async def capture(key, timeout):
+            reader, writer, reused = await connect(key, timeout)
+            writers.append(writer)
+            return reader, writer, reused
+
+        transport._connect = capture
+
+        async def fetch():
+            try:
+                await transport.open(self.url + '/badlength')
+            finally:
+                transport.close()
+
+        with self.assertRaises(BadResponseError):
+            asyncio.run(fetch())
+        self.assertTrue(writers[0].is_closing())
+
+
+class test_async_views(_ServerTestCase):
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/')
+        def root():
+            return ''
+
+        @self.app.route('/private')
+        @login_required
+        async def private():
+            return 'private'
+
+        @self.app.route('/admin')
+        @group_required('cn=admins')
+        async def admin():
+            return 'admin'
+
+        @self.app.route('/home')
+        @login_optional
+        async def home():
+            return self.cas.username or 'anonymous'
+
+        self.app.secret_key = "SECRET_KEY"
+        self.cas = AsyncCAS(self.app)
+        self.app.testing = True
+        self.app.config['CAS_SERVER'] = self.url
+        self.app.config['CAS_AFTER_LOGIN'] = 'root'
+
+    def test_login_valid(self):
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.cas.username, 'bob')
+            self.assertEqual(self.cas.token, 'good')
+
+    def test_server_timing(self):
+        self.app.config['CAS_SERVER_TIMING'] = True
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+        phases = [entry.split(';')[0] for entry in
+                  response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['urls', 'connect', 'ttfb', 'read', 'parse',
+                                  'session', 'total'])
+
+    def test_cluster_failover(self):
+        # Nothing listens on port 1
+        self.app.config['CAS_SERVER'] = ['http://127.0.0.1:1', self.url]
+        self.app.config['CAS_NODE_PROBE_INTERVAL'] = 0
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.cas.username, 'bob')
+        dead, alive = self.cas.nodes.nodes
+        self.assertEqual(dead.breaker.failures, 1)
+        self.assertTrue(alive.latency is not None)
+
+    def test_cluster_hedging(self):
+        slow = _SlowServer(('127.0.0.1', 0), _SlowHandler)
+        slow.ports = set()
+        slow.paths = []
+        thread = threading.Thread(target=slow.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.app.config['CAS_SERVER'] = [
+            'http://127.0.0.1:{0}'.format(slow.server_port), self.url]
+        self.app.config['CAS_HEDGE_DELAY'] = 0.01
+        try:
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=good')
+                self.assertEqual(self.cas.username, 'bob')
+            self.assertEqual(len(self.server.ports), 1)
+        finally:
+            slow.shutdown()
+            slow.server_close()
+
+    def test_concurrent_logins_coalesced(self):
+        slow = _SlowServer(('127.0.0.1', 0), _SlowHandler)
+        slow.ports = set()
+        slow.paths = []
+        thread = threading.Thread(target=slow.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.app.config['CAS_SERVER'] = 'http://127.0.0.1:{0}'.format(
+            slow.server_port)
+        self.app.config['CAS_METRICS'] = True
+        usernames = []
+
+        def login():
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=good')
+                usernames.append(self.cas.username)
+
+        try:
+            threads = [threading.Thread(target=login) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(usernames, ['bob'] * 3)
+            self.assertEqual(len(slow.ports), 1)
+            self.assertEqual(self.cas.metrics.value(
+                'cas_validations_total', (('result', 'coalesced'),)), 2)
+        finally:
+            slow.shutdown()
+            slow.server_close()
+
+    def test_rate_limit(self):
+        self.app.config['CAS_RATE_LIMIT'] = 1
+        self.app.config['CAS_RATE_LIMIT_BURST'] = 1
+        with self.app.test_client() as client:
+            self.assertEqual(
+                client.get('/login/?ticket=bad-1').status_code, 302)
+            # Rejected tickets are answered from the negative cache
+            self.assertEqual(
+                client.get('/login/?ticket=bad-1').status_code, 302)
+            self.assertEqual(
+                client.get('/login/?ticket=bad-2').status_code, 429)
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_login_invalid(self):
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=bad')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(
+                response.headers['Location'].startswith(self.url + '/cas?'))
+            self.assertEqual(self.cas.token, None)
+
+    def test_login_cas_unavailable(self):
+        self.app.config['CAS_VALIDATE_ROUTE'] = '/missing'
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(self.cas.breaker.failures, 1)
+
+    def test_login_malformed_response(self):
+        self.app.config['CAS_VALIDATE_ROUTE'] = '/garbage'
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(self.cas.breaker.failures, 1)
+
+    def test_connections_closed_with_the_loop(self):
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=good')
+            client.get('/login/?ticket=good-2')
+        # Each view ran on an event loop of its own
+        self.assertEqual(len(self.server.ports), 2)
+        self.assertEqual(self.app.extensions['cas'].async_transport._idle, {})
+
+    def test_logout(self):
+        with self.app.test_client() as client:
+            response = client.get('/logout/')
+            self.assertEqual(response.status_code, 302)
+
+    def test_login_required(self):
+        with self.app.test_client() as client:
+            response = client.get('/private')
+            self.assertEqual(response.status_code, 302)
+            client.get('/login/?ticket=good')
+            response = client.get('/private')
+            self.assertEqual(response.data, b'private')
+
+    def test_login_optional(self):
+        with self.app.test_client() as client:
+            response = client.get('/home')
+            self.assertTrue('gateway=true' in response.headers['Location'])
+            response = client.get('/login/')
+            self.assertTrue(response.headers['Location'].endswith('/home'))
+            self.assertEqual(client.get('/home').data, b'anonymous')
+            client.get('/gateway/')
+            client.get('/login/?ticket=good')
+            self.assertEqual(client.get('/home').data, b'bob')
+
+    def test_group_required(self):
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/admin').status_code, 302)
+            client.get('/login/?ticket=good')
+            self.assertEqual(client.get('/admin').status_code, 403)
+
+
+class test_async_prefix_tenants(_ServerTestCase):
+
+    def setUp(self):
+        _ServerTestCase.setUp(self)
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/')
+        def root():
+            return ''
+
+        self.app.secret_key = "SECRET_KEY"
+        self.app.testing = True
+        self.app.config['CAS_SERVER'] = 'http://cas.server.com'
+        self.app.config['CAS_AFTER_LOGIN'] = 'root'
+        self.app.config['CAS_TENANTS'] = {'law': {'CAS_SERVER': self.url}}
+        self.app.config['CAS_TENANT_SELECTOR'] = 'prefix'
+        self.cas = AsyncCAS(self.app, url_prefix='/<cas_tenant>')
+
+    def test_login(self):
+        with self.app.test_client() as client:
+            response = client.get('/law/login/')
+            self.assertTrue(response.headers['Location'].startswith(
+                self.url + '/cas?service=http%3A%2F%2Flocalhost%2Flaw%2F'))
+            client.get('/law/login/?ticket=good')
+            self.assertEqual(self.cas.username, 'bob')
+
+    def test_logout(self):
+        with self.app.test_client() as client:
+            response = client.get('/law/logout/')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.headers['Location'].startswith(
+                self.url + '/cas/logout'))
+
+    def test_unknown_prefix(self):
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/other/login/').status_code, 404)
@@ -0,0 +1,86 @@
+import unittest
+
+from flask_cas.attributes import AttributeCodec
+from flask_cas.attributes import pack_list
+from flask_cas.attributes import unpack_list
+
+ATTRIBUTES = {
+    'cas:mail': 'bob@example.com',
+    'cas:displayName': 'Bob',
+    'cas:memberOf': ['cn=admins,ou=groups,dc=example,dc=com',
+                     'cn=users,ou=groups,dc=example,dc=com'],
+}
+
+
+class test_pack_list(unittest.TestCase):
+
+    def test_common_suffix(self):
+        packed = pack_list(ATTRIBUTES['cas:memberOf'])
+        self.assertEqual(packed[0], ',ou=groups,dc=example,dc=com')
+        self.assertEqual(unpack_list(packed), ATTRIBUTES['cas:memberOf'])
+
+    def test_no_common_suffix(self):
+        values = ['a', 'b', '']
+        self.assertEqual(pack_list(values), ['', 'a\nb\n'])
+        self.assertEqual(unpack_list(pack_list(values)), values)
+
+    def test_not_packable(self):
+        for values in ([], ['a\nb', 'c'], [1, 2]):
+            self.assertEqual(pack_list(values), [None] + values)
+            self.assertEqual(unpack_list(pack_list(values)), values)
+
+
+class test_attribute_codec(unittest.TestCase):
+
+    def test_keep_all(self):
+        codec = AttributeCodec()
+        attributes = codec.project(ATTRIBUTES)
+        self.assertEqual(attributes, ATTRIBUTES)
+        self.assertFalse(attributes is ATTRIBUTES)
+        self.assertTrue(codec.encode(attributes) is attributes)
+
+    def test_keep_names(self):
+        codec = AttributeCodec(['cas:mail', 'memberOf', 'phone'])
+        self.assertEqual(codec.project(ATTRIBUTES), {
+            'mail': 'bob@example.com',
+            'memberOf': ATTRIBUTES['cas:memberOf']})
+
+    def test_member_of_always_kept(self):
+        codec = AttributeCodec(['mail'], compact=True)
+        attributes = codec.project(ATTRIBUTES)
+        self.assertEqual(attributes, {
+            'mail': 'bob@example.com',
+            'memberOf': ATTRIBUTES['cas:memberOf']})
+        self.assertEqual(codec.decode(codec.encode(attributes)), attributes)
+
+    def test_member_of_split(self):
+        codec = AttributeCodec(['memberOf'])
+        self.assertEqual(
+            codec.project({'cas:memberOf': '[cn=admins, cn=users]'}),
+            {'memberOf': ['cn=admins', 'cn=users']})
+
+    def test_transform(self):
+        codec = AttributeCodec(
+            lambda attributes: {'name': attributes['displayName']})
+        self.assertEqual(codec.project(ATTRIBUTES), {'name': 'Bob'})
+
+    def test_compact_names(self):
+        codec = AttributeCodec(['mail', 'phone', 'memberOf'], compact=True)
+        attributes = codec.project(ATTRIBUTES)
+        encoded = codec.encode(attributes)
+        self.assertEqual(encoded[1:3], ['bob@example.com', None])
+        self.assertEqual(codec.decode(encoded), attributes)
+
+    def test_compact_all(self):
+        codec = AttributeCodec(compact=True)
+        encoded = codec.encode(codec.project(ATTRIBUTES))
+        self.assertEqual(codec.decode(encoded), ATTRIBUTES)
+
+    def test_decode_other_settings(self):
+        codec = AttributeCodec(['mail'], compact=True)
+        encoded = AttributeCodec(['displayName'], compact=True).encode(
+            {'displayName': 'Bob'})
+        self.assertEqual(codec.decode(encoded), None)
+        self.assertEqual(codec.decode({'cas:mail': 'bob@example.com'}), None)
+        self.assertEqual(codec.decode(None), None)
+        self.assertEqual(AttributeCodec(['mail']).decode(encoded), None)
@@ -0,0 +1,81 @@
+import time
+import unittest
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from flask_cas.breaker import CircuitBreaker
+
+
+class test_circuit_breaker(unittest.TestCase):
+
+    def test_closed(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_open(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()['failures'], 2)
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        later = time.time() + 31
+        with mock.patch.object(time, 'time', return_value=later):
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(breaker.allow())
+            # Only one probe at a time
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_fails(self):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+        for failure in range(3):
+            breaker.record_failure()
+        later = time.time() + 31
+        with mock.patch.object(time, 'time', return_value=later):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+
+    def test_half_open_probe_released(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        later = time.time() + 31
+        with mock.patch.object(time, 'time', return_value=later):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.available)
+            breaker.release()
+            self.assertTrue(breaker.available)
+            self.assertTrue(breaker.allow())
+
+    def test_lost_half_open_probe_expires(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        later = time.time() + 31
+        with mock.patch.object(time, 'time', return_value=later):
+            self.assertTrue(breaker.allow())
+        # The probe never reported back
+        with mock.patch.object(time, 'time', return_value=later + 29):
+            self.assertFalse(breaker.allow())
+        with mock.patch.object(time, 'time', return_value=later + 30):
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(breaker.allow())
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from flask_cas.cache import TTLCache
+
+
+class test_ttl_cache(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = TTLCache()
+        self.assertEqual(cache.get('key'), None)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertTrue('key' in cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        cache = TTLCache(ttl=10)
+        cache.set('key', 'value')
+        later = time.time() + 11
+        with mock.patch.object(time, 'time', return_value=later):
+            self.assertEqual(cache.get('key'), None)
+            self.assertFalse('key' in cache)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_disabled(self):
+        cache = TTLCache(maxsize=0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+    def test_pop(self):
+        cache = TTLCache()
+        cache.set('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a'), None)
+
+    def test_stats(self):
+        cache = TTLCache(maxsize=1)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.set('b', 2)
+        self.assertEqual(cache.stats(), {
+            'hits': 1,
+            'misses': 1,
+            'evictions': 1,
+            'size': 1,
+            'maxsize': 1,
+        })
@@ -3,6 +3,10 @@ from flask_cas.cas_urls import create_url
 from flask_cas.cas_urls import create_cas_login_url
 from flask_cas.cas_urls import create_cas_logout_url
 from flask_cas.cas_urls import create_cas_validate_url
+from flask_cas.cas_urls import create_cas_proxy_url
+from flask_cas.cas_urls import CASURLs
+from flask_cas.cas_urls import URLTemplate
+from flask_cas.protocols import get_protocol
 
 
 class test_create_url(unittest.TestCase):
@@ -202,3 +206,167 @@ class test_create_cas_validate_url(unittest.TestCase):
             ),
             'http://sso.pdx.edu/cas/serviceValidate?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&ticket=ST-58274-x839euFek492ou832Eena7ee-cas&renew=true'
         )
+
+    def test_with_pgt_url(self):
+        self.assertEqual(
+            create_cas_validate_url(
+                'http://sso.pdx.edu',
+                '/cas/serviceValidate',
+                'http://localhost:5000/login',
+                'ST-58274-x839euFek492ou832Eena7ee-cas',
+                pgt_url='https://localhost:5000/proxyCallback',
+            ),
+            'http://sso.pdx.edu/cas/serviceValidate?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&ticket=ST-58274-x839euFek492ou832Eena7ee-cas&pgtUrl=https%3A%2F%2Flocalhost%3A5000%2FproxyCallback'
+        )
+
+
+class test_create_cas_proxy_url(unittest.TestCase):
+
+    def test_minimal(self):
+        self.assertEqual(
+            create_cas_proxy_url(
+                'http://sso.pdx.edu',
+                '/cas/proxy',
+                'PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA',
+                'http://localhost:5001/api',
+            ),
+            'http://sso.pdx.edu/cas/proxy?pgt=PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA&targetService=http%3A%2F%2Flocalhost%3A5001%2Fapi'
+        )
+
+
+class test_url_template(unittest.TestCase):
+
+    def test_matches_create_url(self):
+        template = URLTemplate(
+            'http://example.com',
+            'path',
+            ('url', 'http://localhost:5000'),
+        )
+        self.assertEqual(
+            template(('key1', 'value'), ('key2', None)),
+            create_url(
+                'http://example.com',
+                'path',
+                ('url', 'http://localhost:5000'),
+                ('key1', 'value'),
+                ('key2', None),
+            ),
+        )
+
+    def test_without_fixed_query(self):
+        template = URLTemplate('http://example.com/', '/path')
+        self.assertEqual(template(), 'http://example.com/path')
+        self.assertEqual(
+            template(('key', 'value')),
+            'http://example.com/path?key=value',
+        )
+
+
+class test_cas_urls(unittest.TestCase):
+
+    def setUp(self):
+        self.urls = CASURLs(
+            'http://sso.pdx.edu',
+            '/cas',
+            '/cas/logout',
+            '/cas/serviceValidate',
+            'http://localhost:5000/login',
+            'http://localhost:5000',
+        )
+
+    def test_login(self):
+        self.assertEqual(
+            self.urls.login,
+            create_cas_login_url(
+                'http://sso.pdx.edu',
+                '/cas',
+                'http://localhost:5000/login',
+            ),
+        )
+        self.assertEqual(
+            self.urls.login_url(renew='true', gateway='true'),
+            create_cas_login_url(
+                'http://sso.pdx.edu',
+                '/cas',
+                'http://localhost:5000/login',
+                renew='true',
+                gateway='true',
+            ),
+        )
+
+    def test_logout(self):
+        self.assertEqual(
+            self.urls.logout,
+            create_cas_logout_url(
+                'http://sso.pdx.edu',
+                '/cas/logout',
+                'http://localhost:5000',
+            ),
+        )
+
+    def test_validate(self):
+        self.assertEqual(
+            self.urls.validate('ST-58274-x839euFek492ou832Eena7ee-cas', 'true'),
+            create_cas_validate_url(
+                'http://sso.pdx.edu',
+                '/cas/serviceValidate',
+                'http://localhost:5000/login',
+                'ST-58274-x839euFek492ou832Eena7ee-cas',
+                renew='true',
+            ),
+        )
+
+    def test_protocols(self):
+        def urls(protocol):
+            return CASURLs(
+                'http://sso.pdx.edu',
+                '/cas',
+                '/cas/logout',
+                '/cas/serviceValidate',
+                'http://localhost:5000/login',
+                protocol=get_protocol(protocol),
+            )
+        self.assertEqual(
+            urls('3.0').validate('ST-1'),
+            'http://sso.pdx.edu/cas/p3/serviceValidate'
+            '?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&ticket=ST-1')
+        self.assertEqual(
+            urls('3.0-json').validate('ST-1'),
+            'http://sso.pdx.edu/cas/p3/serviceValidate'
+            '?service=http%3A%2F%2Flocalhost%3A5000%2Flogin&format=JSON'
+            '&ticket=ST-1')
+        self.assertEqual(
+            urls('saml1.1').validate('ST-1'),
+            'http://sso.pdx.edu/cas/samlValidate'
+            '?TARGET=http%3A%2F%2Flocalhost%3A5000%2Flogin')
+
+    def test_proxy(self):
+        urls = CASURLs(
+            'http://sso.pdx.edu',
+            '/cas',
+            '/cas/logout',
+            '/cas/serviceValidate',
+            'http://localhost:5000/login',
+            proxy_route='/cas/proxy',
+            pgt_url='https://localhost:5000/proxyCallback',
+        )
+        self.assertEqual(
+            urls.proxy('PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA',
+                       'http://localhost:5001/api'),
+            create_cas_proxy_url(
+                'http://sso.pdx.edu',
+                '/cas/proxy',
+                'PGT-330-CSdUc5dUDq4aV0xNHTfWQYbA',
+                'http://localhost:5001/api',
+            ),
+        )
+        self.assertEqual(
+            urls.validate('ST-58274-x839euFek492ou832Eena7ee-cas'),
+            create_cas_validate_url(
+                'http://sso.pdx.edu',
+                '/cas/serviceValidate',
+                'http://localhost:5000/login',
+                'ST-58274-x839euFek492ou832Eena7ee-cas',
+                pgt_url='https://localhost:5000/proxyCallback',
+            ),
+        )
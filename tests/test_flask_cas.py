@@ -104,3 +104,10 @@ class test_flask_cas(unittest.TestCase):
             self.assertEqual(
                 cas.token,
                 None)
+
+    def test_cas_init_app_warmup(self):
+        self.app = flask.Flask(__name__)
+        self.app.config['CAS_SERVER'] = 'http://cas.server.com'
+        self.app.config['CAS_WARMUP'] = True
+        with self.assertRaises(ValueError):
+            CAS(self.app)
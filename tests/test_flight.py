@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from flask_cas.flight import SingleFlight
+
+
+class _CountingFlight(SingleFlight):
+
+    def __init__(self):
+        SingleFlight.__init__(self)
+        self.begun = 0
+        self._count_lock = threading.Lock()
+
+    def begin(self, key):
+        with self._count_lock:
+            self.begun += 1
+        return SingleFlight.begin(self, key)
+
+    def wait_for(self, callers):
+        # Until every caller joined the call in flight
+        deadline = time.time() + 5
+        while self.begun < callers and time.time() < deadline:
+            time.sleep(0.001)
+
+
+class test_single_flight(unittest.TestCase):
+
+    def run_concurrently(self, flights, function, callers):
+        outcomes = []
+
+        def attempt():
+            try:
+                outcomes.append(flights.do('ST-1', function))
+            except ValueError as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=attempt) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_shared_result(self):
+        flights = _CountingFlight()
+        calls = []
+
+        def validate():
+            calls.append(1)
+            flights.wait_for(5)
+            return 'bob'
+
+        outcomes = self.run_concurrently(flights, validate, 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcomes),
+                         [('bob', False)] + [('bob', True)] * 4)
+        self.assertEqual(len(flights), 0)
+
+    def test_shared_error(self):
+        flights = _CountingFlight()
+        error = ValueError('unavailable')
+
+        def validate():
+            flights.wait_for(3)
+            raise error
+
+        self.assertEqual(
+            self.run_concurrently(flights, validate, 3), [error] * 3)
+        self.assertEqual(len(flights), 0)
+
+    def test_sequential_calls_not_shared(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('ST-1', lambda: 1), (1, False))
+        self.assertEqual(flights.do('ST-1', lambda: 2), (2, False))
@@ -0,0 +1,34 @@
+import unittest
+
+from flask_cas.groups import group_set
+from flask_cas.groups import parse_member_of
+
+
+class test_parse_member_of(unittest.TestCase):
+
+    def test_bracketed(self):
+        self.assertEqual(
+            parse_member_of('[cn=admins, cn=users ]'),
+            ['cn=admins', 'cn=users'])
+
+    def test_list(self):
+        self.assertEqual(
+            parse_member_of([' cn=admins', 'cn=users']),
+            ['cn=admins', 'cn=users'])
+
+    def test_empty(self):
+        self.assertEqual(parse_member_of('[]'), [])
+        self.assertEqual(parse_member_of(None), [])
+
+    def test_interned(self):
+        first = parse_member_of('[cn=' + 'admins]')
+        second = parse_member_of('[' + 'cn=admins]')
+        self.assertTrue(first[0] is second[0])
+
+
+class test_group_set(unittest.TestCase):
+
+    def test_shared(self):
+        groups = group_set(['cn=a', 'cn=b'])
+        self.assertEqual(groups, frozenset(['cn=a', 'cn=b']))
+        self.assertTrue(group_set(('cn=b', 'cn=a')) is groups)
@@ -0,0 +1,56 @@
+import unittest
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from flask_cas import limits
+from flask_cas.limits import RateLimitedError
+from flask_cas.limits import RateLimiter
+
+
+class test_rate_limiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            limits.timing, 'clock', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        for _ in range(3):
+            self.assertEqual(limiter.acquire('a'), 0)
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        self.now += 0.5
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+
+    def test_refill_capped_at_burst(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        limiter.acquire('a')
+        self.now += 60
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertTrue(limiter.acquire('a') > 0)
+
+    def test_clients_independent(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertTrue(limiter.acquire('a') > 0)
+        self.assertEqual(limiter.acquire('b'), 0)
+
+    def test_bounded(self):
+        limiter = RateLimiter(rate=1, burst=1, maxsize=10)
+        for number in range(100):
+            limiter.acquire(number)
+        self.assertEqual(len(limiter), 10)
+
+    def test_check(self):
+        limiter = RateLimiter(rate=0.5, burst=1)
+        limiter.check('a')
+        with self.assertRaises(RateLimitedError) as context:
+            limiter.check('a')
+        self.assertAlmostEqual(context.exception.retry_after, 2)
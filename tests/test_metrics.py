@@ -0,0 +1,40 @@
+import unittest
+
+from flask_cas.metrics import PrometheusSink
+
+
+class test_prometheus_sink(unittest.TestCase):
+
+    def test_counters(self):
+        sink = PrometheusSink()
+        sink.increment('cas_redirects_total', (('target', 'cas_login'),))
+        sink.increment('cas_redirects_total', (('target', 'cas_login'),), 2)
+        self.assertEqual(
+            sink.value('cas_redirects_total', (('target', 'cas_login'),)), 3)
+        self.assertTrue(
+            'cas_redirects_total{target="cas_login"} 3' in sink.render())
+
+    def test_histogram(self):
+        sink = PrometheusSink(buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            sink.observe('cas_request_seconds', value, (('kind', 'validate'),))
+        lines = sink.render().splitlines()
+        self.assertTrue(
+            'cas_request_seconds_bucket{kind="validate",le="0.1"} 1' in lines)
+        self.assertTrue(
+            'cas_request_seconds_bucket{kind="validate",le="1.0"} 2' in lines)
+        self.assertTrue(
+            'cas_request_seconds_bucket{kind="validate",le="+Inf"} 3' in lines)
+        self.assertTrue('cas_request_seconds_count{kind="validate"} 3' in lines)
+
+    def test_samples(self):
+        output = PrometheusSink().render(
+            [('cas_ticket_cache_size', 'gauge', (), 4)])
+        self.assertEqual(
+            output,
+            '# TYPE cas_ticket_cache_size gauge\ncas_ticket_cache_size 4\n')
+
+    def test_label_escaping(self):
+        sink = PrometheusSink()
+        sink.increment('x', (('a', 'say "hi"\n'),))
+        self.assertTrue('x{a="say \\"hi\\"\\n"} 1' in sink.render())
@@ -0,0 +1,92 @@
+import time
+import unittest
+
+from flask_cas.nodes import NodeSet
+from flask_cas.nodes import TicketAffinity
+from flask_cas.nodes import server_urls
+
+URLS = ['https://cas1.example.com', 'https://cas2.example.com',
+        'https://cas3.example.com']
+
+
+class test_node_set(unittest.TestCase):
+
+    def test_ranked_by_latency(self):
+        nodes = NodeSet(URLS)
+        # Unmeasured nodes come first, in the configured order
+        self.assertEqual([node.url for node in nodes.ranked()], URLS)
+        for node, latency in zip(nodes.nodes, (0.3, 0.1, 0.2)):
+            nodes.record_success(node, latency)
+        self.assertEqual([node.url for node in nodes.ranked()],
+                         [URLS[1], URLS[2], URLS[0]])
+
+    def test_ewma(self):
+        nodes = NodeSet(URLS, alpha=0.5)
+        node = nodes.nodes[0]
+        for latency in (1.0, 0.0, 0.0):
+            nodes.record_success(node, latency)
+        self.assertAlmostEqual(node.latency, 0.25)
+
+    def test_unhealthy_nodes_come_last(self):
+        nodes = NodeSet(URLS, failure_threshold=1)
+        nodes.record_success(nodes.nodes[1], 0.5)
+        nodes.record_failure(nodes.nodes[0])
+        self.assertFalse(nodes.nodes[0].healthy)
+        self.assertEqual([node.url for node in nodes.ranked()],
+                         [URLS[2], URLS[1], URLS[0]])
+
+    def test_half_open_node_with_probe_taken_is_unhealthy(self):
+        nodes = NodeSet(URLS, failure_threshold=1, recovery_timeout=0.01)
+        nodes.record_failure(nodes.nodes[0])
+        time.sleep(0.02)
+        self.assertTrue(nodes.nodes[0].healthy)
+        self.assertTrue(nodes.nodes[0].breaker.allow())
+        self.assertFalse(nodes.nodes[0].healthy)
+        self.assertEqual(nodes.ranked()[-1].url, URLS[0])
+
+    def test_probe_restores_node(self):
+        answers = [False, True]
+        probed = []
+
+        def probe(node):
+            probed.append(node.url)
+            return answers.pop(0)
+
+        nodes = NodeSet(URLS, failure_threshold=1, recovery_timeout=60,
+                        probe=probe, probe_interval=0.01)
+        try:
+            nodes.record_failure(nodes.nodes[2])
+            deadline = time.time() + 2
+            while not nodes.nodes[2].healthy and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(nodes.nodes[2].healthy)
+            self.assertEqual(probed, [URLS[2], URLS[2]])
+            self.assertTrue(nodes.nodes[2].latency is not None)
+        finally:
+            nodes.close()
+
+    def test_ranked_prefers_issuing_node(self):
+        nodes = NodeSet(URLS, failure_threshold=1)
+        for node, latency in zip(nodes.nodes, (0.1, 0.2, 0.3)):
+            nodes.record_success(node, latency)
+        self.assertEqual([node.url for node in nodes.ranked(URLS[2])],
+                         [URLS[2], URLS[0], URLS[1]])
+        nodes.record_failure(nodes.nodes[2])
+        self.assertEqual(nodes.ranked(URLS[2])[0].url, URLS[0])
+        self.assertEqual(nodes.ranked('https://other')[0].url, URLS[0])
+
+    def test_server_urls(self):
+        self.assertEqual(server_urls(URLS[0]), [URLS[0]])
+        self.assertEqual(server_urls(tuple(URLS)), URLS)
+
+
+class test_ticket_affinity(unittest.TestCase):
+
+    def test_lookup(self):
+        affinity = TicketAffinity({
+            'cas1': URLS[0], 'node-2': URLS[1], 'b-node-2': URLS[2]})
+        self.assertEqual(affinity.lookup('ST-1-abc-cas1'), URLS[0])
+        self.assertEqual(affinity.lookup('ST-1-abc-node-2'), URLS[1])
+        self.assertEqual(affinity.lookup('ST-1-abc-b-node-2'), URLS[2])
+        self.assertEqual(affinity.lookup('ST-1-abc-cas3'), None)
+        self.assertEqual(affinity.lookup('no suffix'), None)
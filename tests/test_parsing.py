@@ -0,0 +1,284 @@
+import io
+import unittest
+
+from flask_cas.parsing import InvalidResponseError
+from flask_cas.parsing import JSONResponseParser
+from flask_cas.parsing import ResponseTooLargeError
+from flask_cas.parsing import SAMLResponseParser
+from flask_cas.parsing import ServiceResponseParser
+from flask_cas.parsing import parse_logout_request
+from flask_cas.parsing import parse_response
+
+SUCCESS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+        <cas:attributes>
+            <cas:displayName>Bob Smith</cas:displayName>
+            <cas:email>bob@example.com</cas:email>
+            <cas:affiliation>staff</cas:affiliation>
+            <cas:affiliation>student</cas:affiliation>
+            <cas:memberOf>[cn=admins, cn=users]</cas:memberOf>
+            <cas:empty/>
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+FAILURE = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationFailure code="INVALID_TICKET">
+        Ticket ST-1856339-aA5Yuvrxzpv8Tau1cYQ7 not recognized
+    </cas:authenticationFailure>
+</cas:serviceResponse>
+"""
+
+
+class _CountingReader(io.BytesIO):
+
+    def __init__(self, data):
+        io.BytesIO.__init__(self, data)
+        self.reads = 0
+
+    def read(self, amt=None):
+        self.reads += 1
+        return io.BytesIO.read(self, amt)
+
+
+class test_service_response_parser(unittest.TestCase):
+
+    def test_success(self):
+        result = parse_response(io.BytesIO(SUCCESS))
+        self.assertTrue(result.success)
+        self.assertEqual(result.user, 'bob')
+        self.assertEqual(result.attributes, {
+            'cas:displayName': 'Bob Smith',
+            'cas:email': 'bob@example.com',
+            'cas:affiliation': ['staff', 'student'],
+            'cas:memberOf': '[cn=admins, cn=users]',
+            'cas:empty': None,
+        })
+
+    def test_success_without_attributes(self):
+        result = parse_response(io.BytesIO(
+            b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+            b'<cas:authenticationSuccess><cas:user>bob</cas:user>'
+            b'</cas:authenticationSuccess></cas:serviceResponse>'))
+        self.assertTrue(result.success)
+        self.assertEqual(result.attributes, {})
+
+    def test_failure(self):
+        result = parse_response(io.BytesIO(FAILURE))
+        self.assertFalse(result.success)
+        self.assertEqual(result.failure_code, 'INVALID_TICKET')
+        self.assertEqual(
+            result.failure_message,
+            'Ticket ST-1856339-aA5Yuvrxzpv8Tau1cYQ7 not recognized')
+
+    def test_stops_after_failure(self):
+        parser = ServiceResponseParser()
+        # The rest of the document is never looked at
+        parser.feed(FAILURE.split(b'</cas:authenticationFailure>')[0] +
+                    b'</cas:authenticationFailure><not-xml')
+        self.assertTrue(parser.done)
+        self.assertFalse(parser.close().success)
+
+    def test_streams_in_chunks(self):
+        body = SUCCESS.replace(
+            b'<cas:displayName>',
+            b''.join(b'<cas:group>cn=group' + str(number).encode('ascii') +
+                     b'</cas:group>' for number in range(5000)) +
+            b'<cas:displayName>')
+        reader = _CountingReader(body)
+        result = parse_response(reader)
+        self.assertTrue(reader.reads > 2)
+        self.assertEqual(len(result.attributes['cas:group']), 5000)
+
+    def test_max_size(self):
+        with self.assertRaises(ResponseTooLargeError):
+            parse_response(io.BytesIO(SUCCESS), max_size=100)
+
+    def test_invalid_xml(self):
+        with self.assertRaises(InvalidResponseError):
+            parse_response(io.BytesIO(b'\n\n'))
+        with self.assertRaises(InvalidResponseError):
+            parse_response(io.BytesIO(b'<html><body></body></html>'))
+
+    def test_missing_user(self):
+        with self.assertRaises(InvalidResponseError):
+            parse_response(io.BytesIO(
+                b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+                b'<cas:authenticationSuccess></cas:authenticationSuccess>'
+                b'</cas:serviceResponse>'))
+
+    def test_proxy_validation(self):
+        result = parse_response(io.BytesIO(
+            b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+            b'<cas:authenticationSuccess><cas:user>bob</cas:user>'
+            b'<cas:proxyGrantingTicket>PGTIOU-84678-8a9d</cas:proxyGrantingTicket>'
+            b'<cas:proxies><cas:proxy>https://proxy2/pgtUrl</cas:proxy>'
+            b'<cas:proxy>https://proxy1/pgtUrl</cas:proxy></cas:proxies>'
+            b'</cas:authenticationSuccess></cas:serviceResponse>'))
+        self.assertEqual(result.user, 'bob')
+        self.assertEqual(result.proxy_granting_ticket, 'PGTIOU-84678-8a9d')
+        self.assertEqual(
+            result.proxies, ['https://proxy2/pgtUrl', 'https://proxy1/pgtUrl'])
+
+    def test_proxy_success(self):
+        result = parse_response(io.BytesIO(
+            b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+            b'<cas:proxySuccess><cas:proxyTicket>PT-1856392-b98xZrQN4p90ASrw96c8'
+            b'</cas:proxyTicket></cas:proxySuccess></cas:serviceResponse>'))
+        self.assertTrue(result.success)
+        self.assertEqual(result.proxy_ticket, 'PT-1856392-b98xZrQN4p90ASrw96c8')
+
+    def test_proxy_failure(self):
+        result = parse_response(io.BytesIO(
+            b'<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+            b'<cas:proxyFailure code="INVALID_REQUEST">'
+            b"'pgt' and 'targetService' parameters are both required"
+            b'</cas:proxyFailure></cas:serviceResponse>'))
+        self.assertFalse(result.success)
+        self.assertEqual(result.failure_code, 'INVALID_REQUEST')
+
+
+JSON_SUCCESS = b"""{"serviceResponse": {"authenticationSuccess": {
+    "user": "bob",
+    "proxyGrantingTicket": "PGTIOU-84678-8a9d",
+    "proxies": ["https://proxy1/pgtUrl"],
+    "attributes": {
+        "displayName": ["Bob Smith"],
+        "affiliation": ["staff", "student"],
+        "memberOf": ["cn=admins", "cn=users"]
+    }
+}}}"""
+
+SAML_SUCCESS = b"""
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">
+  <SOAP-ENV:Header/>
+  <SOAP-ENV:Body>
+    <Response xmlns="urn:oasis:names:tc:SAML:1.0:protocol"
+              xmlns:saml="urn:oasis:names:tc:SAML:1.0:assertion"
+              xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol"
+              MajorVersion="1" MinorVersion="1">
+      <Status><StatusCode Value="samlp:Success"></StatusCode></Status>
+      <Assertion xmlns="urn:oasis:names:tc:SAML:1.0:assertion"
+                 MajorVersion="1" MinorVersion="1">
+        <AttributeStatement>
+          <Subject><NameIdentifier>bob</NameIdentifier></Subject>
+          <Attribute AttributeName="displayName">
+            <AttributeValue>Bob Smith</AttributeValue>
+          </Attribute>
+          <Attribute AttributeName="affiliation">
+            <AttributeValue>staff</AttributeValue>
+            <AttributeValue>student</AttributeValue>
+          </Attribute>
+        </AttributeStatement>
+        <AuthenticationStatement>
+          <Subject><NameIdentifier>bob</NameIdentifier></Subject>
+        </AuthenticationStatement>
+      </Assertion>
+    </Response>
+  </SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+
+class test_json_response_parser(unittest.TestCase):
+
+    def parse(self, body):
+        return parse_response(io.BytesIO(body), parser_class=JSONResponseParser)
+
+    def test_success(self):
+        result = self.parse(JSON_SUCCESS)
+        self.assertTrue(result.success)
+        self.assertEqual(result.user, 'bob')
+        self.assertEqual(result.attributes, {
+            'cas:displayName': 'Bob Smith',
+            'cas:affiliation': ['staff', 'student'],
+            'cas:memberOf': ['cn=admins', 'cn=users'],
+        })
+        self.assertEqual(result.proxy_granting_ticket, 'PGTIOU-84678-8a9d')
+        self.assertEqual(result.proxies, ['https://proxy1/pgtUrl'])
+
+    def test_failure(self):
+        result = self.parse(
+            b'{"serviceResponse": {"authenticationFailure": {'
+            b'"code": "INVALID_TICKET", "description": " Ticket not recognized"}}}')
+        self.assertFalse(result.success)
+        self.assertEqual(result.failure_code, 'INVALID_TICKET')
+        self.assertEqual(result.failure_message, 'Ticket not recognized')
+
+    def test_proxy_success(self):
+        result = self.parse(
+            b'{"serviceResponse": {"proxySuccess": {"proxyTicket": "PT-1"}}}')
+        self.assertEqual(result.proxy_ticket, 'PT-1')
+
+    def test_invalid(self):
+        for body in (b'', b'not json', b'[]', b'{"serviceResponse": {}}',
+                     b'{"serviceResponse": {"authenticationSuccess": {}}}'):
+            with self.assertRaises(InvalidResponseError):
+                self.parse(body)
+
+    def test_max_size(self):
+        with self.assertRaises(ResponseTooLargeError):
+            parse_response(io.BytesIO(JSON_SUCCESS), 64, JSONResponseParser)
+
+
+class test_saml_response_parser(unittest.TestCase):
+
+    def parse(self, body):
+        return parse_response(io.BytesIO(body), parser_class=SAMLResponseParser)
+
+    def test_success(self):
+        result = self.parse(SAML_SUCCESS)
+        self.assertTrue(result.success)
+        self.assertEqual(result.user, 'bob')
+        self.assertEqual(result.attributes, {
+            'cas:displayName': 'Bob Smith',
+            'cas:affiliation': ['staff', 'student'],
+        })
+
+    def test_failure(self):
+        result = self.parse(
+            b'<SOAP-ENV:Envelope'
+            b' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+            b'<SOAP-ENV:Body>'
+            b'<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol">'
+            b'<samlp:Status><samlp:StatusCode Value="samlp:Requester"/>'
+            b'<samlp:StatusMessage>Ticket not recognized</samlp:StatusMessage>'
+            b'</samlp:Status></samlp:Response>'
+            b'</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+        self.assertFalse(result.success)
+        self.assertEqual(result.failure_code, 'Requester')
+        self.assertEqual(result.failure_message, 'Ticket not recognized')
+
+    def test_success_without_user(self):
+        with self.assertRaises(InvalidResponseError):
+            self.parse(
+                b'<samlp:Response'
+                b' xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol">'
+                b'<samlp:Status><samlp:StatusCode Value="samlp:Success"/>'
+                b'</samlp:Status></samlp:Response>')
+
+    def test_not_a_response(self):
+        with self.assertRaises(InvalidResponseError):
+            self.parse(b'<html/>')
+
+
+class test_parse_logout_request(unittest.TestCase):
+
+    def test_session_index(self):
+        self.assertEqual(
+            parse_logout_request(
+                b'<samlp:LogoutRequest'
+                b' xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol">'
+                b'<samlp:SessionIndex> ST-1 </samlp:SessionIndex>'
+                b'</samlp:LogoutRequest>'),
+            'ST-1')
+
+    def test_invalid(self):
+        for data in ('', '<a/>', 'not xml',
+                     '<samlp:LogoutRequest xmlns:samlp="urn:x"/>'):
+            with self.assertRaises(InvalidResponseError):
+                parse_logout_request(data)
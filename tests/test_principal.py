@@ -0,0 +1,43 @@
+import unittest
+
+from flask_cas.principal import Principal
+
+
+class test_principal(unittest.TestCase):
+
+    def test_anonymous(self):
+        principal = Principal()
+        self.assertFalse(principal.is_authenticated)
+        self.assertEqual(principal.attributes, None)
+        self.assertEqual(principal.groups, frozenset())
+
+    def test_attributes_loaded_once(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            return {'cas:memberOf': ['cn=admins', 'cn=users']}
+
+        principal = Principal('bob', 'ST-1', load_attributes=load)
+        self.assertEqual(calls, [])
+        self.assertEqual(
+            principal.groups, frozenset(['cn=admins', 'cn=users']))
+        principal.attributes
+        self.assertEqual(calls, [1])
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            Principal().email = 'bob@example.com'
+
+    def test_groups_loaded_once(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            return frozenset(['cn=admins'])
+
+        principal = Principal('bob', 'ST-1', {'cas:memberOf': ['cn=users']},
+                              load_groups=load)
+        self.assertEqual(principal.groups, frozenset(['cn=admins']))
+        principal.groups
+        self.assertEqual(calls, [1])
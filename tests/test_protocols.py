@@ -0,0 +1,32 @@
+import unittest
+
+from flask_cas.parsing import JSONResponseParser
+from flask_cas.protocols import Protocol
+from flask_cas.protocols import get_protocol
+from flask_cas.protocols import register_protocol
+
+
+class test_protocols(unittest.TestCase):
+
+    def test_builtin(self):
+        self.assertEqual(get_protocol('2.0').body('ST-1'), None)
+        self.assertEqual(
+            get_protocol('3.0').route('/cas/proxyValidate'),
+            '/cas/p3/proxyValidate')
+        self.assertTrue(
+            get_protocol('3.0-json').parser_class is JSONResponseParser)
+
+    def test_saml_body(self):
+        body = get_protocol('saml1.1').body('ST-1&<')
+        self.assertTrue(
+            b'<samlp:AssertionArtifact>ST-1&amp;&lt;</samlp:AssertionArtifact>'
+            in body)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_protocol('4.0')
+
+    def test_register(self):
+        protocol = Protocol('test', query=[('format', 'XML')])
+        register_protocol(protocol)
+        self.assertTrue(get_protocol('test') is protocol)
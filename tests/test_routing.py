@@ -1,6 +1,8 @@
 import unittest
 import flask
 import io
+import threading
+import time
 
 try:
     import mock
@@ -9,6 +11,73 @@ except ImportError:
 
 from flask.ext.cas import routing
 from flask.ext.cas import CAS
+from flask_cas import timing
+from flask_cas.breaker import CircuitBreaker
+
+SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+        <cas:attributes>
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+FAILURE = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationFailure code="INVALID_TICKET">
+        Ticket 12345-abcdefg-cas not recognized
+    </cas:authenticationFailure>
+</cas:serviceResponse>
+"""
+
+PROXY_GRANTING_SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+        <cas:proxyGrantingTicket>PGTIOU-1</cas:proxyGrantingTicket>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+PROXY_SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:proxySuccess>
+        <cas:proxyTicket>PT-1</cas:proxyTicket>
+    </cas:proxySuccess>
+</cas:serviceResponse>
+"""
+
+ATTRIBUTES_SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+        <cas:attributes>
+            <cas:email>bob@example.com</cas:email>
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+GROUPS_SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+        <cas:attributes>
+            <cas:memberOf>[cn=admins, cn=users]</cas:memberOf>
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+LOGOUT_REQUEST = (
+    '<samlp:LogoutRequest xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"'
+    ' xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="LR-1"'
+    ' Version="2.0" IssueInstant="2024-01-01T00:00:00Z">'
+    '<saml:NameID>@NOT_USED@</saml:NameID>'
+    '<samlp:SessionIndex>{0}</samlp:SessionIndex>'
+    '</samlp:LogoutRequest>')
 
 
 class test_routing(unittest.TestCase):
@@ -47,18 +116,8 @@ class test_routing(unittest.TestCase):
                 'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost%2Flogin%2F')
 
     @mock.patch.object(routing, 'urlopen',
-                       return_value=io.BytesIO(b'\n\n'))
-    @mock.patch.object(routing, 'parse',
-                       return_value={
-                           "cas:serviceResponse": {
-                               "cas:authenticationSuccess": {
-                                   "cas:user": "bob",
-                                   "cas:attributes": {
-                                   }
-                               }
-                           }
-                       })
-    def test_login_by_logged_in_user_valid(self, m, n):
+                       return_value=io.BytesIO(SUCCESS))
+    def test_login_by_logged_in_user_valid(self, m):
         ticket = '12345-abcdefg-cas'
         with self.app.test_client() as client:
             with client.session_transaction() as s:
@@ -72,15 +131,8 @@ class test_routing(unittest.TestCase):
                 ticket)
 
     @mock.patch.object(routing, 'urlopen',
-                       return_value=io.BytesIO(b'\n\n'))
-    @mock.patch.object(routing, 'parse',
-                       return_value={
-                           "cas:serviceResponse": {
-                               'cas:authenticationFailure': {
-                               }
-                           }
-                       })
-    def test_login_by_logged_in_user_invalid(self, m, n):
+                       return_value=io.BytesIO(FAILURE))
+    def test_login_by_logged_in_user_invalid(self, m):
         ticket = '12345-abcdefg-cas'
         with self.app.test_client() as client:
             with client.session_transaction() as s:
@@ -125,18 +177,8 @@ class test_routing(unittest.TestCase):
                 'http://cas.server.com/cas/logout?service=http%3A%2F%2Flocalhost%3A5000')
 
     @mock.patch.object(routing, 'urlopen',
-                       return_value=io.BytesIO(b'\n\n'))
-    @mock.patch.object(routing, 'parse',
-                       return_value={
-                           "cas:serviceResponse": {
-                               "cas:authenticationSuccess": {
-                                   "cas:user": "bob",
-                                   "cas:attributes": {
-                                   }
-                               }
-                           }
-                       })
-    def test_validate_valid(self, m, n):
+                       return_value=io.BytesIO(SUCCESS))
+    def test_validate_valid(self, m):
         with self.app.test_request_context('/login/'):
             ticket = '12345-abcdefg-cas'
             self.assertEqual(routing.validate(ticket), True)
@@ -145,15 +187,8 @@ class test_routing(unittest.TestCase):
                 'bob')
 
     @mock.patch.object(routing, 'urlopen',
-                       return_value=io.BytesIO(b'\n\n'))
-    @mock.patch.object(routing, 'parse',
-                       return_value={
-                           "cas:serviceResponse": {
-                               'cas:authenticationFailure': {
-                               }
-                           }
-                       })
-    def test_validate_invalid(self, m, n):
+                       return_value=io.BytesIO(FAILURE))
+    def test_validate_invalid(self, m):
         with self.app.test_request_context('/login/'):
             ticket = '12345-abcdefg-cas'
             self.assertEqual(routing.validate(ticket), False)
@@ -163,3 +198,891 @@ class test_routing(unittest.TestCase):
                 self.app.config['CAS_ATTRIBUTES_SESSION_KEY'] not in flask.session)
             self.assertTrue(
                 self.app.config['CAS_TOKEN_SESSION_KEY'] not in flask.session)
+
+    def test_concurrent_validations_coalesced(self):
+        self.app.config['CAS_METRICS'] = True
+        self.app.config['CAS_TICKET_CACHE_SIZE'] = 0
+        flights = self.app.extensions['cas'].flights
+        begin = mock.patch.object(flights, 'begin', wraps=flights.begin)
+        calls = []
+
+        def urlopen(url, timeout=None):
+            calls.append(url)
+            # Until the three requests joined the validation
+            deadline = time.time() + 5
+            while flights.begin.call_count < 3:
+                if time.time() > deadline:
+                    break
+                time.sleep(0.001)
+            return io.BytesIO(SUCCESS)
+
+        usernames = []
+
+        def login():
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=ST-1')
+                usernames.append(self.cas.username)
+
+        with begin, mock.patch.object(routing, 'urlopen', urlopen):
+            threads = [threading.Thread(target=login) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(usernames, ['bob'] * 3)
+        self.assertEqual(self.cas.metrics.value(
+            'cas_validations_total', (('result', 'coalesced'),)), 2)
+
+    def test_single_flight_disabled(self):
+        self.app.config['CAS_SINGLE_FLIGHT'] = False
+        self.assertEqual(self.app.extensions['cas'].flights, None)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           FAILURE))
+    def test_rejected_tickets_cached(self, m):
+        self.app.config['CAS_METRICS'] = True
+        with self.app.test_client() as client:
+            for _ in range(3):
+                response = client.get('/login/?ticket=ST-bogus')
+                self.assertEqual(response.status_code, 302)
+                self.assertFalse('_CAS_TOKEN' in flask.session)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(self.cas.metrics.value(
+            'cas_validations_total', (('result', 'cached_failure'),)), 2)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           b'<html>Maintenance</html>'))
+    def test_invalid_response_not_cached(self, m):
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            client.get('/login/?ticket=ST-1')
+        self.assertEqual(m.call_count, 2)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           FAILURE))
+    def test_rate_limit(self, m):
+        self.app.config['CAS_RATE_LIMIT'] = 0.1
+        self.app.config['CAS_RATE_LIMIT_BURST'] = 2
+        with self.app.test_client() as client:
+            for number in range(2):
+                response = client.get('/login/?ticket=ST-{0}'.format(number))
+                self.assertEqual(response.status_code, 302)
+            response = client.get('/login/?ticket=ST-2')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '10')
+            # Already rejected, answered without using the budget
+            response = client.get('/login/?ticket=ST-1')
+            self.assertEqual(response.status_code, 302)
+            response = client.get(
+                '/login/?ticket=ST-3',
+                environ_base={'REMOTE_ADDR': '192.0.2.1'})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(m.call_count, 3)
+
+    def test_validate_with_transport(self):
+        transport = mock.Mock()
+        transport.open.return_value = io.BytesIO(SUCCESS)
+        with self.app.test_request_context('/login/'):
+            self.cas.transport = transport
+            ticket = '12345-abcdefg-cas'
+            self.assertEqual(routing.validate(ticket), True)
+            self.assertEqual(transport.open.call_count, 1)
+            self.assertTrue(
+                transport.open.call_args[0][0].endswith('ticket=' + ticket))
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=IOError('timed out'))
+    def test_login_cas_unavailable(self, m):
+        ticket = '12345-abcdefg-cas'
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket={0}'.format(ticket))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(self.cas.token, ticket)
+            self.assertEqual(self.cas.breaker.failures, 1)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=IOError('timed out'))
+    def test_login_circuit_open(self, m):
+        self.app.config['CAS_BREAKER_THRESHOLD'] = 2
+        self.app.config['CAS_UNAVAILABLE_ENDPOINT'] = 'root'
+        ticket = '12345-abcdefg-cas'
+        with self.app.test_client() as client:
+            for attempt in range(3):
+                response = client.get('/login/?ticket={0}'.format(ticket))
+                self.assertEqual(response.status_code, 302)
+                self.assertTrue(response.headers['Location'].endswith('/'))
+            self.assertEqual(m.call_count, 2)
+            self.assertEqual(self.cas.breaker.state, CircuitBreaker.OPEN)
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(b'<html>Not CAS</html>'))
+    def test_validate_unexpected_response(self, m):
+        with self.app.test_request_context('/login/'):
+            ticket = '12345-abcdefg-cas'
+            self.assertEqual(routing.validate(ticket), False)
+            self.assertTrue(
+                self.app.config['CAS_USERNAME_SESSION_KEY'] not in flask.session)
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(SUCCESS))
+    def test_validate_response_too_large(self, m):
+        self.app.config['CAS_MAX_RESPONSE_SIZE'] = 64
+        with self.app.test_request_context('/login/'):
+            ticket = '12345-abcdefg-cas'
+            self.assertEqual(routing.validate(ticket), False)
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(SUCCESS))
+    def test_login_by_logged_in_user_cached(self, m):
+        self.app.config['CAS_TICKET_CACHE_SIZE'] = 1024
+        ticket = '12345-abcdefg-cas'
+        with self.app.test_client() as client:
+            with client.session_transaction() as s:
+                s[self.app.config['CAS_TOKEN_SESSION_KEY']] = ticket
+            client.get('/login/')
+            client.get('/login/')
+            self.assertEqual(self.cas.username, 'bob')
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(self.cas.ticket_cache.stats()['hits'], 1)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=[io.BytesIO(SUCCESS), io.BytesIO(FAILURE)])
+    def test_cached_ticket_not_replayable(self, m):
+        self.app.config['CAS_TICKET_CACHE_SIZE'] = 1024
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            self.assertEqual(self.cas.username, 'bob')
+        # Another browser replaying the login url
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            self.assertEqual(self.cas.username, None)
+        self.assertEqual(m.call_count, 2)
+
+    def test_concurrent_validations_shared_per_client(self):
+        key = ('ST-1', 'http://localhost/login/')
+        with self.app.test_request_context('/login/'):
+            self.assertNotEqual(
+                routing._flight_key(key, '192.0.2.1', flask.session),
+                routing._flight_key(key, '192.0.2.2', flask.session))
+        with self.app.test_request_context(
+                '/login/', headers={'Cookie': 'session=other'}):
+            other = routing._flight_key(key, '192.0.2.1', flask.session)
+        with self.app.test_request_context('/login/'):
+            self.assertNotEqual(
+                routing._flight_key(key, '192.0.2.1', flask.session), other)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(SUCCESS))
+    def test_validate_many_skips_ticket_cache(self, m):
+        self.app.config['CAS_TICKET_CACHE_SIZE'] = 1024
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+        self.cas.validate_many(['ST-1'], 'http://localhost/login/')
+        self.assertEqual(m.call_count, 2)
+
+    def test_ticket_cache_off_by_default(self):
+        self.assertEqual(self.app.config['CAS_TICKET_CACHE_SIZE'], 0)
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(FAILURE))
+    def test_validate_invalid_not_cached(self, m):
+        with self.app.test_request_context('/login/'):
+            routing.validate('12345-abcdefg-cas')
+            self.assertEqual(len(self.cas.ticket_cache), 0)
+
+    def test_login_urls_per_host(self):
+        with self.app.test_client() as client:
+            response = client.get('/login/', base_url='https://example.com')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=https%3A%2F%2Fexample.com%2Flogin%2F')
+            response = client.get('/login/')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost%2Flogin%2F')
+        self.assertEqual(
+            len(self.app.extensions['cas'].urls), 2)
+
+    def test_validate_many(self):
+        calls = []
+
+        def urlopen(url, timeout=None):
+            calls.append(url)
+            return io.BytesIO(SUCCESS if 'ticket=good' in url else FAILURE)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            results = self.cas.validate_many(
+                ['good-1', 'bad-1', 'good-1'],
+                'http://gateway.example.com/login/')
+        self.assertEqual(sorted(results), ['bad-1', 'good-1'])
+        self.assertTrue(results['good-1'].success)
+        self.assertEqual(results['good-1'].user, 'bob')
+        self.assertFalse(results['bad-1'].success)
+        self.assertEqual(results['bad-1'].failure_code, 'INVALID_TICKET')
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(
+            'service=http%3A%2F%2Fgateway.example.com%2Flogin%2F' in calls[0])
+
+    def test_validate_many_concurrently(self):
+        self.app.config['CAS_VALIDATE_CONCURRENCY'] = 8
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def urlopen(url, timeout=None):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(url)
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            results = routing.validate_many(
+                ['good-{0}'.format(number) for number in range(16)],
+                'http://gateway.example.com/login/',
+                self.app)
+        self.assertEqual(len(results), 16)
+        self.assertEqual(max(peak), 8)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=IOError('timed out'))
+    def test_validate_many_cas_unavailable(self, m):
+        results = self.cas.validate_many(
+            ['good-1'], 'http://gateway.example.com/login/')
+        self.assertFalse(results['good-1'].success)
+        self.assertTrue(results['good-1'].error is not None)
+
+    def test_proxy_callback_disabled(self):
+        with self.app.test_client() as client:
+            response = client.get('/proxyCallback/?pgtIou=PGTIOU-1&pgtId=PGT-1')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.cas.pgt_store), 0)
+
+    def test_proxy_tickets(self):
+        self.app.config['CAS_PROXY_CALLBACK'] = True
+        calls = []
+
+        def urlopen(url, timeout=None):
+            calls.append(url)
+            if '/cas/proxy?' in url:
+                return io.BytesIO(PROXY_SUCCESS)
+            # The CAS calls the callback before answering
+            with self.app.test_client() as cas:
+                self.assertEqual(cas.get('/proxyCallback/').status_code, 200)
+                cas.get('/proxyCallback/?pgtIou=PGTIOU-1&pgtId=PGT-1')
+            return io.BytesIO(PROXY_GRANTING_SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=12345-abcdefg-cas')
+                self.assertEqual(
+                    flask.session['_CAS_PGT_IOU'], 'PGTIOU-1')
+                self.assertEqual(
+                    self.cas.get_proxy_ticket('http://api.example.com/'),
+                    'PT-1')
+        self.assertTrue(
+            'pgtUrl=http%3A%2F%2Flocalhost%2FproxyCallback%2F' in calls[0])
+        self.assertEqual(
+            calls[1],
+            'http://cas.server.com/cas/proxy?pgt=PGT-1'
+            '&targetService=http%3A%2F%2Fapi.example.com%2F')
+
+    def test_proxy_ticket_without_pgt(self):
+        with self.app.test_request_context('/'):
+            self.assertEqual(
+                self.cas.get_proxy_ticket('http://api.example.com/'), None)
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(SUCCESS))
+    def test_accept_proxy_tickets(self, m):
+        self.app.config['CAS_ACCEPT_PROXY_TICKETS'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=PT-1')
+        self.assertTrue(
+            m.call_args[0][0].startswith(
+                'http://cas.server.com/cas/proxyValidate?'))
+
+    def _logout_request(self, ticket):
+        return {'logoutRequest': LOGOUT_REQUEST.format(ticket)}
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(SUCCESS))
+    def test_single_logout(self, m):
+        self.app.config['CAS_SINGLE_LOGOUT'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            self.assertEqual(self.cas.username, 'bob')
+            with self.app.test_client() as cas:
+                response = cas.post(
+                    '/login/', data=self._logout_request('ST-1'))
+                self.assertEqual(response.status_code, 200)
+            client.get('/')
+            self.assertEqual(self.cas.username, None)
+            self.assertEqual(self.cas.token, None)
+        self.assertEqual(len(self.cas.ticket_cache), 0)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(SUCCESS))
+    def test_single_logout_other_session(self, m):
+        self.app.config['CAS_SINGLE_LOGOUT'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            with self.app.test_client() as cas:
+                cas.post('/login/', data=self._logout_request('ST-2'))
+            client.get('/')
+            self.assertEqual(self.cas.username, 'bob')
+
+    def test_single_logout_disabled(self):
+        with self.app.test_client() as client:
+            response = client.post(
+                '/login/', data=self._logout_request('ST-1'))
+            self.assertEqual(response.status_code, 405)
+
+    def test_single_logout_invalid_request(self):
+        self.app.config['CAS_SINGLE_LOGOUT'] = True
+        with self.app.test_client() as client:
+            response = client.post('/login/', data={'logoutRequest': '<a/>'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_single_logout_batches(self):
+        self.app.config['CAS_SINGLE_LOGOUT'] = True
+        self.app.config['CAS_SLO_BATCH_SIZE'] = 3
+        batches = []
+        state = self.app.extensions['cas']
+        state.session_index.revoke = batches.append
+        # Another thread is applying a batch, the tickets are queued
+        state.logout_lock.acquire()
+        with self.app.test_client() as client:
+            for number in range(4):
+                client.post('/login/', data=self._logout_request(
+                    'ST-{0}'.format(number)))
+        self.assertEqual(batches, [])
+        state.logout_lock.release()
+        with self.app.test_client() as client:
+            client.post('/login/', data=self._logout_request('ST-4'))
+        self.assertEqual(
+            batches, [['ST-0', 'ST-1', 'ST-2'], ['ST-3', 'ST-4']])
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           ATTRIBUTES_SUCCESS))
+    def test_attribute_store(self, m):
+        self.app.config['CAS_ATTRIBUTE_STORE'] = 'memory'
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            self.assertFalse('CAS_ATTRIBUTES' in flask.session)
+            handle = flask.session['_CAS_ATTRIBUTES_HANDLE']
+            self.assertTrue(len(handle) <= 16)
+            self.assertEqual(
+                self.cas.attributes, {'cas:email': 'bob@example.com'})
+            client.get('/logout/')
+            self.assertEqual(self.cas.attributes, None)
+        self.assertEqual(self.cas.attribute_store.get(handle), None)
+
+    def test_attributes_in_session(self):
+        with self.app.test_request_context('/'):
+            self.assertEqual(self.cas.attribute_store, None)
+            flask.session['CAS_ATTRIBUTES'] = {'cas:email': 'bob@example.com'}
+            self.assertEqual(
+                self.cas.attributes, {'cas:email': 'bob@example.com'})
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           GROUPS_SUCCESS))
+    def test_keep_attributes(self, m):
+        self.app.config['CAS_KEEP_ATTRIBUTES'] = ['memberOf']
+        self.app.config['CAS_COMPACT_ATTRIBUTES'] = True
+
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            self.assertEqual(
+                self.cas.attributes, {'memberOf': ['cn=admins', 'cn=users']})
+            self.assertEqual(
+                flask.session['CAS_ATTRIBUTES'][1],
+                ['', 'cn=admins\ncn=users'])
+            client.get('/')
+            self.assertEqual(
+                self.cas.groups, frozenset(['cn=admins', 'cn=users']))
+            self.assertEqual(
+                self.cas.attributes, {'memberOf': ['cn=admins', 'cn=users']})
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           GROUPS_SUCCESS))
+    def test_group_required(self, m):
+        from flask_cas import any_group_required
+        from flask_cas import group_required
+
+        @self.app.route('/admin')
+        @group_required('cn=admins', 'cn=users')
+        def admin():
+            return 'admin'
+
+        @self.app.route('/staff')
+        @group_required('cn=admins', 'cn=staff')
+        def staff():
+            return 'staff'
+
+        @self.app.route('/any')
+        @any_group_required('cn=staff', 'cn=users')
+        def any_():
+            return 'any'
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/admin').status_code, 302)
+            client.get('/login/?ticket=ST-1')
+            self.assertEqual(
+                self.cas.groups, frozenset(['cn=admins', 'cn=users']))
+            self.assertEqual(client.get('/admin').data, b'admin')
+            self.assertEqual(client.get('/staff').status_code, 403)
+            self.assertEqual(client.get('/any').data, b'any')
+            self.assertEqual(
+                flask.session['CAS_ATTRIBUTES']['cas:memberOf'],
+                ['cn=admins', 'cn=users'])
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           GROUPS_SUCCESS))
+    def test_group_required_member_of_not_kept(self, m):
+        from flask_cas import group_required
+        self.app.config['CAS_KEEP_ATTRIBUTES'] = ['email']
+
+        @self.app.route('/admin')
+        @group_required('cn=admins')
+        def admin():
+            return 'admin'
+
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            client.get('/')
+            self.assertEqual(
+                self.cas.groups, frozenset(['cn=admins', 'cn=users']))
+            self.assertEqual(client.get('/admin').data, b'admin')
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           GROUPS_SUCCESS))
+    def test_groups_kept_per_token(self, m):
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            client.get('/')
+            with mock.patch.object(routing, 'attribute_groups') as build:
+                self.assertEqual(
+                    self.cas.groups, frozenset(['cn=admins', 'cn=users']))
+            self.assertFalse(build.called)
+            # Another process validated the ticket
+            group_sets = self.app.extensions['cas'].group_sets
+            group_sets.clear()
+            client.get('/')
+            self.assertEqual(
+                self.cas.groups, frozenset(['cn=admins', 'cn=users']))
+            self.assertEqual(group_sets.get('ST-1')[0], 'bob')
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           GROUPS_SUCCESS))
+    def test_groups_dropped_on_logout(self, m):
+        self.app.config['CAS_SINGLE_LOGOUT'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1')
+            group_sets = self.app.extensions['cas'].group_sets
+            self.assertTrue('ST-1' in group_sets)
+            client.get('/logout/')
+            self.assertFalse('ST-1' in group_sets)
+            client.get('/login/?ticket=ST-2')
+            with self.app.test_client() as cas:
+                cas.post('/login/', data=self._logout_request('ST-2'))
+            self.assertFalse('ST-2' in group_sets)
+
+    def test_group_cache_session_lifetime(self):
+        with self.app.test_request_context('/'):
+            group_sets = self.app.extensions['cas'].group_sets
+            self.assertEqual(group_sets.maxsize, 4096)
+            self.assertEqual(
+                group_sets.ttl,
+                self.app.permanent_session_lifetime.total_seconds())
+
+    def test_group_cache_settings(self):
+        self.app.config['CAS_GROUP_CACHE_SIZE'] = 10
+        self.app.config['CAS_GROUP_CACHE_TTL'] = 60
+        with self.app.test_request_context('/'):
+            group_sets = self.app.extensions['cas'].group_sets
+            self.assertEqual((group_sets.maxsize, group_sets.ttl), (10, 60))
+
+    def test_principal_built_once_per_request(self):
+        with self.app.test_request_context('/'):
+            flask.session['CAS_USERNAME'] = 'bob'
+            principal = self.cas.principal
+            self.assertEqual(self.cas.username, 'bob')
+            self.assertTrue(self.cas.principal is principal)
+
+    def test_login_required_uses_session_key(self):
+        from flask_cas import login_required
+        self.app.config['CAS_USERNAME_SESSION_KEY'] = 'USER'
+
+        @self.app.route('/private')
+        @login_required
+        def private():
+            return 'private'
+
+        with self.app.test_client() as client:
+            with client.session_transaction() as s:
+                s['USER'] = 'bob'
+            self.assertEqual(client.get('/private').data, b'private')
+
+    def test_login_optional_without_sso_session(self):
+        from flask_cas import login_optional
+
+        @self.app.route('/home')
+        @login_optional
+        def home():
+            return self.cas.username or 'anonymous'
+
+        with self.app.test_client() as client:
+            response = client.get('/home')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost'
+                '%2Flogin%2F&gateway=true')
+            # The CAS sends the user back without a ticket
+            response = client.get('/login/')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.headers['Location'].endswith('/home'))
+            self.assertEqual(client.get('/home').data, b'anonymous')
+            # An explicit login still goes to the CAS login page
+            response = client.get('/login/')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost'
+                '%2Flogin%2F')
+
+    @mock.patch.object(routing, 'urlopen',
+                       return_value=io.BytesIO(SUCCESS))
+    def test_login_optional_with_sso_session(self, m):
+        from flask_cas import login_optional
+
+        @self.app.route('/home')
+        @login_optional
+        def home():
+            return self.cas.username or 'anonymous'
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/home').status_code, 302)
+            response = client.get('/login/?ticket=ST-1')
+            self.assertTrue(response.headers['Location'].endswith('/home'))
+            self.assertEqual(client.get('/home').data, b'bob')
+            self.assertFalse('_CAS_GATEWAY' in flask.session)
+
+    def test_login_optional_window(self):
+        from flask_cas import login_optional
+        self.app.config['CAS_GATEWAY_WINDOW'] = 60
+
+        @self.app.route('/home', methods=['GET', 'POST'])
+        @login_optional
+        def home():
+            return 'home'
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.post('/home').data, b'home')
+            with client.session_transaction() as s:
+                s['_CAS_GATEWAY'] = int(time.time()) - 30
+            self.assertEqual(client.get('/home').data, b'home')
+            with client.session_transaction() as s:
+                s['_CAS_GATEWAY'] = int(time.time()) - 90
+            self.assertEqual(client.get('/home').status_code, 302)
+
+    def test_abandoned_gateway_check(self):
+        with self.app.test_client() as client:
+            client.get('/gateway/')
+            # The user never came back from the CAS, and logs in later
+            with client.session_transaction() as s:
+                s['_CAS_GATEWAY'] = [
+                    int(time.time()) - routing._GATEWAY_TIMEOUT - 1]
+            response = client.get('/login/')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost'
+                '%2Flogin%2F')
+            self.assertFalse('_CAS_GATEWAY' in flask.session)
+
+    def test_gateway_route(self):
+        with self.app.test_client() as client:
+            response = client.get('/gateway/')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.server.com/cas?service=http%3A%2F%2Flocalhost'
+                '%2Flogin%2F&gateway=true')
+            response = client.get('/login/')
+            self.assertEqual(response.headers['Location'], '/')
+            with client.session_transaction() as s:
+                s['CAS_USERNAME'] = 'bob'
+            response = client.get('/gateway/')
+            self.assertEqual(response.headers['Location'], '/')
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(
+                           SUCCESS if 'ticket=good' in url else FAILURE))
+    def test_metrics(self, m):
+        self.app.config['CAS_METRICS'] = True
+        self.app.config['CAS_TICKET_CACHE_SIZE'] = 1024
+        self.app.config['CAS_METRICS_ENDPOINT'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=good')
+            client.get('/login/?ticket=good')
+            client.get('/login/?ticket=bad')
+            client.get('/logout/')
+            output = client.get('/metrics').data.decode('utf8')
+        metrics = self.cas.metrics
+        self.assertEqual(metrics.value(
+            'cas_validations_total', (('result', 'success'),)), 1)
+        self.assertEqual(metrics.value(
+            'cas_validations_total', (('result', 'cached'),)), 1)
+        self.assertEqual(metrics.value(
+            'cas_validations_total', (('result', 'failure'),)), 1)
+        self.assertEqual(metrics.value(
+            'cas_redirects_total', (('target', 'after_login'),)), 2)
+        self.assertEqual(metrics.value(
+            'cas_redirects_total', (('target', 'cas_logout'),)), 1)
+        self.assertTrue('cas_request_seconds_count{kind="validate"} 2' in output)
+        self.assertTrue('cas_ticket_cache_hits_total 1' in output)
+        self.assertTrue('cas_breaker_state{state="closed"} 1' in output)
+        self.assertTrue('cas_pool_connections{state="idle"} 0' in output)
+
+    @mock.patch.object(routing, 'urlopen', side_effect=IOError('refused'))
+    def test_metrics_cas_unavailable(self, m):
+        self.app.config['CAS_METRICS'] = True
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=good')
+        self.assertEqual(self.cas.metrics.value(
+            'cas_validations_total', (('result', 'error'),)), 1)
+        self.assertEqual(self.cas.metrics.value(
+            'cas_request_errors_total', (('kind', 'validate'),)), 1)
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(SUCCESS))
+    def test_server_timing(self, m):
+        self.app.config['CAS_SERVER_TIMING'] = True
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+        phases = [entry.split(';')[0] for entry in
+                  response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['urls', 'read', 'parse', 'session', 'total'])
+
+    @mock.patch.object(routing, 'urlopen',
+                       side_effect=lambda url, timeout=None: io.BytesIO(SUCCESS))
+    def test_profile_hook(self, m):
+        calls = []
+
+        def hook(phases):
+            calls.append(dict(phases))
+            raise RuntimeError('hook failures do not break the login')
+
+        self.app.config['CAS_PROFILE_HOOK'] = hook
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=good')
+            self.assertEqual(response.status_code, 302)
+            self.assertFalse('Server-Timing' in response.headers)
+            self.assertEqual(flask.session['CAS_USERNAME'], 'bob')
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(calls[0]['total'] >= calls[0]['parse'] > 0)
+
+    def test_server_timing_disabled(self):
+        with self.app.test_client() as client:
+            response = client.get('/login/')
+        self.assertFalse('Server-Timing' in response.headers)
+        self.assertEqual(timing.current(), None)
+
+    def test_cluster_failover(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_BREAKER_THRESHOLD'] = 1
+        self.app.config['CAS_NODE_PROBE_INTERVAL'] = 0
+        opened = []
+
+        def urlopen(url, timeout=None):
+            opened.append(url.split('/')[2])
+            if url.startswith('http://cas1.'):
+                raise IOError('refused')
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                response = client.get('/login/')
+                # Users log in on the first node
+                self.assertTrue(response.headers['Location'].startswith(
+                    'http://cas1.server.com/cas?'))
+                client.get('/login/?ticket=first')
+                self.assertEqual(self.cas.username, 'bob')
+                client.get('/login/?ticket=second')
+        # The failed node is skipped once its breaker opened
+        self.assertEqual(opened, ['cas1.server.com', 'cas2.server.com',
+                                  'cas2.server.com'])
+        first, second = self.cas.nodes.nodes
+        self.assertFalse(first.healthy)
+        self.assertTrue(second.latency is not None)
+
+    def test_cluster_hedging(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_HEDGE_DELAY'] = 0.01
+        opened = []
+
+        def urlopen(url, timeout=None):
+            opened.append(url.split('/')[2])
+            if url.startswith('http://cas1.'):
+                time.sleep(0.2)
+                return io.BytesIO(FAILURE)
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=ST-1')
+                self.assertEqual(self.cas.username, 'bob')
+        self.assertEqual(opened, ['cas1.server.com', 'cas2.server.com'])
+
+    def test_cluster_hedging_fast_answer(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_HEDGE_DELAY'] = 0.2
+        self.app.config['CAS_SERVER_TIMING'] = True
+        opened = []
+
+        def urlopen(url, timeout=None):
+            opened.append(url.split('/')[2])
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                response = client.get('/login/?ticket=ST-1')
+        time.sleep(0.3)
+        # No hedge, and the request of the first node is timed
+        self.assertEqual(opened, ['cas1.server.com'])
+        phases = [entry.split(';')[0] for entry in
+                  response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['urls', 'read', 'parse', 'session', 'total'])
+
+    def test_cluster_hedging_unexpected_error(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_HEDGE_DELAY'] = 0.01
+
+        with mock.patch.object(routing, 'urlopen',
+                               side_effect=ValueError('bad url')):
+            with self.app.test_client() as client:
+                with self.assertRaises(ValueError):
+                    client.get('/login/?ticket=ST-1')
+
+    def test_cluster_hedging_all_fail(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_HEDGE_DELAY'] = 0.01
+
+        with mock.patch.object(routing, 'urlopen',
+                               side_effect=IOError('refused')):
+            with self.app.test_client() as client:
+                response = client.get('/login/?ticket=ST-1')
+                self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            [node.breaker.failures for node in self.cas.nodes.nodes], [1, 1])
+
+    def test_ticket_affinity(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_TICKET_AFFINITY'] = {
+            'cas2': 'http://cas2.server.com'}
+        opened = []
+
+        def urlopen(url, timeout=None):
+            opened.append(url.split('/')[2])
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=ST-1-abc-cas2')
+                client.get('/login/?ticket=ST-2-abc-cas3')
+        self.assertEqual(opened, ['cas2.server.com', 'cas.server.com'])
+
+    def test_ticket_affinity_in_cluster(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_TICKET_AFFINITY'] = {
+            'cas2': 'http://cas2.server.com'}
+        self.app.config['CAS_BREAKER_THRESHOLD'] = 1
+        self.app.config['CAS_NODE_PROBE_INTERVAL'] = 0
+        opened = []
+        down = set()
+
+        def urlopen(url, timeout=None):
+            host = url.split('/')[2]
+            opened.append(host)
+            if host in down:
+                raise IOError('refused')
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=ST-1-abc-cas2')
+                # The issuing node is down, another node is tried
+                down.add('cas2.server.com')
+                client.get('/login/?ticket=ST-2-abc-cas2')
+                self.assertEqual(self.cas.username, 'bob')
+        self.assertEqual(opened, ['cas2.server.com', 'cas2.server.com',
+                                  'cas1.server.com'])
+
+    def test_metrics_disabled(self):
+        with self.app.test_client() as client:
+            client.get('/login/')
+            self.assertEqual(client.get('/metrics').status_code, 404)
+        self.assertEqual(self.cas.metrics, None)
+
+    def test_warmup(self):
+        self.app.config['SERVER_NAME'] = 'app.example.com'
+        self.cas.transport = mock.Mock()
+        self.cas.warmup(self.app, connections=2)
+        self.cas.transport.warm.assert_called_once_with(
+            'http://cas.server.com', 2, mock.ANY)
+        state = self.app.extensions['cas']
+        self.assertEqual(
+            state.urls.get('http://app.example.com/').login,
+            'http://cas.server.com/cas?service=http%3A%2F%2Fapp.example.com%2Flogin%2F')
+        # The first login uses the urls built by the warmup
+        with mock.patch.object(routing, '_build_urls') as build_urls:
+            with self.app.test_client() as client:
+                client.get('/login/')
+        self.assertFalse(build_urls.called)
+
+    def test_warmup_cas_unreachable(self):
+        self.cas.transport = mock.Mock()
+        self.cas.transport.warm.side_effect = IOError('refused')
+        self.cas.warmup(self.app, url_root='https://app.example.com/')
+        self.assertNotEqual(
+            self.app.extensions['cas'].urls.get('https://app.example.com/'),
+            None)
+
+    def test_warmup_invalid_config(self):
+        self.app.config['CAS_SERVER'] = 'cas.server.com'
+        self.app.config['CAS_NODE_EWMA_ALPHA'] = 2
+        with self.assertRaises(ValueError) as context:
+            self.cas.warmup(self.app)
+        self.assertIn('CAS_SERVER', str(context.exception))
+        self.assertIn('CAS_NODE_EWMA_ALPHA', str(context.exception))
+
+    def test_warmup_unknown_affinity_node(self):
+        self.app.config['CAS_SERVER'] = [
+            'http://cas1.server.com', 'http://cas2.server.com']
+        self.app.config['CAS_TICKET_AFFINITY'] = {
+            'cas2': 'http://cas2.server.com',
+            'cas3': 'http://cas3.server.com'}
+        with self.assertRaises(ValueError) as context:
+            self.cas.warmup(self.app)
+        self.assertEqual(
+            str(context.exception),
+            "Invalid CAS configuration: CAS_TICKET_AFFINITY maps 'cas3' to "
+            "'http://cas3.server.com', which is not a CAS_SERVER url")
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask_cas.storage import MemoryAttributeStore
+from flask_cas.storage import MemorySessionIndex
+from flask_cas.storage import SQLiteAttributeStore
+
+
+class test_memory_session_index(unittest.TestCase):
+
+    def test_revoke(self):
+        index = MemorySessionIndex()
+        index.add('ST-1', 'session-1')
+        index.add('ST-2', 'session-2')
+        self.assertEqual(index.revoke(['ST-1', 'ST-3']), 1)
+        self.assertTrue(index.is_revoked('session-1'))
+        self.assertFalse(index.is_revoked('session-2'))
+        # The ticket is forgotten once revoked
+        self.assertEqual(index.revoke(['ST-1']), 0)
+
+    def test_expiry(self):
+        index = MemorySessionIndex(ttl=0)
+        index.add('ST-1', 'session-1')
+        self.assertEqual(index.revoke(['ST-1']), 0)
+        self.assertFalse(index.is_revoked('session-1'))
+
+
+class test_attribute_stores(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, store):
+        attributes = {'cas:email': 'bob@example.com',
+                      'cas:memberOf': ['cn=admins', 'cn=users']}
+        store.set('handle-1', attributes)
+        self.assertEqual(store.get('handle-1'), attributes)
+        self.assertEqual(store.get('handle-2'), None)
+        store.delete('handle-1')
+        self.assertEqual(store.get('handle-1'), None)
+
+    def test_memory(self):
+        self.check_store(MemoryAttributeStore())
+
+    def test_sqlite(self):
+        path = os.path.join(self.directory, 'attributes.db')
+        self.check_store(SQLiteAttributeStore(path))
+        # The data is shared through the file
+        SQLiteAttributeStore(path).set('handle-3', {'a': 'b'})
+        self.assertEqual(SQLiteAttributeStore(path).get('handle-3'), {'a': 'b'})
+
+    def test_sqlite_expiry(self):
+        store = SQLiteAttributeStore(
+            os.path.join(self.directory, 'attributes.db'), ttl=0)
+        store.set('handle-1', {'a': 'b'})
+        self.assertEqual(store.get('handle-1'), None)
@@ -0,0 +1,215 @@
+import io
+import unittest
+import flask
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from flask_cas import CAS
+from flask_cas import login_required
+from flask_cas import routing
+from flask_cas.tenants import TenantSet
+
+SUCCESS = b"""
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bob</cas:user>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+TENANTS = {
+    'law': {'CAS_SERVER': 'http://cas.law.edu'},
+    'med': {'CAS_SERVER': 'http://cas.med.edu',
+            'CAS_USERNAME_SESSION_KEY': 'MED_USERNAME'},
+}
+
+
+def success(*args, **kwargs):
+    return io.BytesIO(SUCCESS)
+
+
+class test_host_tenants(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/')
+        def root():
+            return ''
+
+        self.app.secret_key = 'SECRET_KEY'
+        self.app.testing = True
+        self.app.config['CAS_SERVER'] = 'http://cas.server.com'
+        self.app.config['CAS_AFTER_LOGIN'] = 'root'
+        self.app.config['CAS_TENANTS'] = {
+            'law.example.edu': TENANTS['law'],
+            'med.example.edu': TENANTS['med'],
+        }
+        self.cas = CAS(self.app)
+
+    def login_location(self, host):
+        with self.app.test_client() as client:
+            response = client.get('/login/', base_url='http://' + host)
+            return response.headers['Location']
+
+    def test_login_redirects_to_tenant_cas(self):
+        self.assertEqual(
+            self.login_location('law.example.edu'),
+            'http://cas.law.edu/cas?service=http%3A%2F%2Flaw.example.edu%2Flogin%2F')
+        self.assertEqual(
+            self.login_location('med.example.edu:8080'),
+            'http://cas.med.edu/cas?service=http%3A%2F%2Fmed.example.edu%3A8080%2Flogin%2F')
+
+    def test_unknown_host_uses_application_config(self):
+        self.assertEqual(
+            self.login_location('other.example.edu'),
+            'http://cas.server.com/cas?service=http%3A%2F%2Fother.example.edu%2Flogin%2F')
+
+    def test_isolated_state(self):
+        states = {}
+        for host in ('law.example.edu', 'med.example.edu', 'localhost'):
+            with self.app.test_request_context(base_url='http://' + host):
+                states[host] = (self.cas.transport, self.cas.ticket_cache,
+                                self.cas.breaker)
+        for members in zip(*states.values()):
+            self.assertEqual(len(set(map(id, members))), 3)
+        tenants = self.app.extensions['cas'].tenants
+        self.assertEqual(len(tenants.states()), 2)
+
+    def test_tenants_are_created_on_first_use(self):
+        self.login_location('law.example.edu')
+        tenants = self.app.extensions['cas'].tenants
+        self.assertEqual(
+            [state.tenant for state in tenants.states()], ['law.example.edu'])
+
+    @mock.patch.object(routing, 'urlopen', side_effect=success)
+    def test_session_keys(self, m):
+        with self.app.test_client() as client:
+            client.get('/login/?ticket=ST-1',
+                       base_url='http://law.example.edu')
+            self.assertEqual(
+                flask.session['CAS_USERNAME:law.example.edu'], 'bob')
+            self.assertEqual(self.cas.username, 'bob')
+            client.get('/login/?ticket=ST-2',
+                       base_url='http://med.example.edu')
+            self.assertEqual(flask.session['MED_USERNAME'], 'bob')
+        self.assertTrue(m.call_args[0][0].startswith(
+            'http://cas.med.edu/cas/serviceValidate?'))
+
+    def test_hedged_cluster(self):
+        self.app.config['CAS_TENANTS']['law.example.edu'] = {
+            'CAS_SERVER': ['http://cas1.law.edu', 'http://cas2.law.edu'],
+            'CAS_HEDGE_DELAY': 0.01,
+        }
+        opened = []
+
+        def urlopen(url, timeout=None):
+            opened.append(url.split('/')[2])
+            return io.BytesIO(SUCCESS)
+
+        with mock.patch.object(routing, 'urlopen', side_effect=urlopen):
+            with self.app.test_client() as client:
+                client.get('/login/?ticket=ST-1',
+                           base_url='http://law.example.edu')
+                self.assertEqual(self.cas.username, 'bob')
+                nodes = self.cas.nodes.nodes
+        self.assertEqual(opened, ['cas1.law.edu'])
+        self.assertTrue(nodes[0].latency is not None)
+
+    @mock.patch.object(routing, 'urlopen', side_effect=success)
+    def test_validate_many(self, m):
+        results = self.cas.validate_many(
+            ['ST-1'], 'http://law.example.edu/login/',
+            tenant='law.example.edu')
+        self.assertEqual(results['ST-1'].user, 'bob')
+        self.assertTrue(m.call_args[0][0].startswith('http://cas.law.edu/'))
+        with self.assertRaises(KeyError):
+            self.cas.validate_many(['ST-2'], 'http://x/', tenant='x')
+
+    def test_warmup_checks_tenants(self):
+        self.app.config['CAS_TENANTS']['law.example.edu'] = {
+            'CAS_SERVER': 'cas.law.edu'}
+        with self.assertRaises(ValueError) as context:
+            self.cas.warmup(self.app)
+        self.assertIn('law.example.edu', str(context.exception))
+
+    def test_warmup_tenants(self):
+        transport = mock.Mock()
+        with mock.patch('flask_cas.create_transport', return_value=transport):
+            self.cas.warmup(self.app, tenants=True)
+        servers = sorted(call[0][0] for call in transport.warm.call_args_list)
+        self.assertEqual(servers, ['http://cas.law.edu', 'http://cas.med.edu',
+                                   'http://cas.server.com'])
+
+
+class test_prefix_tenants(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/')
+        def root():
+            return ''
+
+        @self.app.route('/<tenant>/')
+        @login_required
+        def page(tenant):
+            return tenant
+
+        self.app.secret_key = 'SECRET_KEY'
+        self.app.testing = True
+        self.app.config['CAS_SERVER'] = 'http://cas.server.com'
+        self.app.config['CAS_AFTER_LOGIN'] = 'root'
+        self.app.config['CAS_TENANTS'] = TENANTS
+        self.app.config['CAS_TENANT_SELECTOR'] = 'prefix'
+        self.cas = CAS(self.app, url_prefix='/<cas_tenant>')
+
+    def test_login_redirects_to_tenant_cas(self):
+        with self.app.test_client() as client:
+            response = client.get('/law/login/')
+            self.assertEqual(
+                response.headers['Location'],
+                'http://cas.law.edu/cas?service=http%3A%2F%2Flocalhost%2Flaw%2Flogin%2F')
+
+    def test_unknown_prefix(self):
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/other/login/').status_code, 404)
+
+    def test_login_required_sends_to_tenant_login(self):
+        with self.app.test_client() as client:
+            response = client.get('/med/')
+            self.assertEqual(
+                response.headers['Location'], 'http://localhost/med/login/')
+
+    @mock.patch.object(routing, 'urlopen', side_effect=success)
+    def test_tenants_share_the_session_cookie(self, m):
+        with self.app.test_client() as client:
+            client.get('/law/login/?ticket=ST-1')
+            self.assertEqual(self.cas.username, 'bob')
+            self.assertEqual(client.get('/law/').status_code, 200)
+            # Logged in with the law CAS only
+            response = client.get('/med/')
+            self.assertEqual(response.status_code, 302)
+
+
+class test_tenant_set(unittest.TestCase):
+
+    def test_callable_selector(self):
+        app = flask.Flask(__name__)
+        app.config['CAS_TENANTS'] = TENANTS
+        app.config['CAS_TENANT_SELECTOR'] = (
+            lambda request: request.headers.get('X-Tenant'))
+        CAS(app)
+        with app.test_request_context(headers={'X-Tenant': 'med'}):
+            self.assertEqual(routing._state().tenant, 'med')
+            self.assertEqual(
+                routing._settings().server, 'http://cas.med.edu')
+        with app.test_request_context():
+            self.assertEqual(routing._state().tenant, None)
+
+    def test_unknown_selector(self):
+        with self.assertRaises(ValueError):
+            TenantSet(None, TENANTS, 'cookie', None)
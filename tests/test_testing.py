@@ -0,0 +1,101 @@
+import unittest
+
+import flask
+
+try:
+    from urllib2 import HTTPError
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+from flask_cas import CAS
+from flask_cas.testing import StubCAS
+
+
+class test_stub_cas(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubCAS(attributes=3).start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def validate(self, ticket, service='http://app/login/'):
+        return urlopen(
+            '{0}/cas/serviceValidate?service={1}&ticket={2}'.format(
+                self.stub.url, service, ticket)).read()
+
+    def test_ticket_is_single_use(self):
+        ticket = self.stub.issue_ticket('http://app/login/')
+        body = self.validate(ticket)
+        self.assertTrue(b'<cas:user>user1</cas:user>' in body)
+        self.assertEqual(body.count(b'<cas:group>'), 3)
+        self.assertTrue(b'INVALID_TICKET' in self.validate(ticket))
+
+    def test_service_must_match(self):
+        ticket = self.stub.issue_ticket('http://app/login/')
+        self.assertTrue(
+            b'INVALID_TICKET' in self.validate(ticket, 'http://other/'))
+
+    def test_failure_rate(self):
+        self.stub.failure_rate = 1
+        with self.assertRaises(HTTPError):
+            self.validate('ST-1-stub')
+        self.assertEqual(self.stub.stats['failures'], 1)
+
+
+class test_login_against_stub_cas(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubCAS().start()
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/')
+        def root():
+            return ''
+
+        self.app.secret_key = "SECRET_KEY"
+        self.cas = CAS(self.app)
+        self.app.testing = True
+        self.app.config['CAS_SERVER'] = self.stub.url
+        self.app.config['CAS_AFTER_LOGIN'] = 'root'
+
+    def tearDown(self):
+        self.cas.transport.close()
+        self.stub.stop()
+
+    def test_login(self):
+        ticket = self.stub.issue_ticket('http://localhost/login/')
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=' + ticket)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.cas.username, 'user1')
+        self.assertEqual(self.stub.stats['validations'], 1)
+
+    def test_protocols(self):
+        self.stub.attributes = 2
+        for protocol in ('3.0', '3.0-json', 'saml1.1'):
+            app = flask.Flask(__name__)
+            app.add_url_rule('/', 'root', lambda: '')
+            app.secret_key = "SECRET_KEY"
+            cas = CAS(app)
+            app.config['CAS_SERVER'] = self.stub.url
+            app.config['CAS_AFTER_LOGIN'] = 'root'
+            app.config['CAS_PROTOCOL'] = protocol
+            ticket = self.stub.issue_ticket('http://localhost/login/')
+            with app.test_client() as client:
+                response = client.get('/login/?ticket=' + ticket)
+                self.assertEqual(response.status_code, 302)
+                self.assertTrue(cas.username.startswith('user'), protocol)
+                self.assertEqual(cas.attributes['cas:group'],
+                                 ['cn=group0', 'cn=group1'])
+            cas.transport.close()
+        self.assertEqual(self.stub.stats['validations'], 3)
+
+    def test_cas_failure(self):
+        self.stub.failure_rate = 1
+        ticket = self.stub.issue_ticket('http://localhost/login/')
+        with self.app.test_client() as client:
+            response = client.get('/login/?ticket=' + ticket)
+            self.assertEqual(response.status_code, 503)
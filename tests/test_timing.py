@@ -0,0 +1,37 @@
+import threading
+import unittest
+
+from flask_cas import timing
+
+
+class test_timing(unittest.TestCase):
+
+    def tearDown(self):
+        timing.stop()
+
+    def test_phases_accumulate_in_order(self):
+        timer = timing.PhaseTimer()
+        timer.add('ttfb', 0.02)
+        timer.add('read', 0.001)
+        timer.add('ttfb', 0.01)
+        self.assertEqual(list(timer.phases), ['ttfb', 'read'])
+        self.assertEqual(timer.server_timing(), 'ttfb;dur=30.00, read;dur=1.00')
+
+    def test_record_chains_phases(self):
+        timer = timing.PhaseTimer()
+        started = timing.clock()
+        now = timer.record('dns', started)
+        timer.record('connect', now)
+        self.assertEqual(list(timer.phases), ['dns', 'connect'])
+        self.assertTrue(timer.phases['dns'] >= 0)
+
+    def test_timer_is_per_thread(self):
+        timer = timing.start()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(timing.current()))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+        self.assertTrue(timing.current() is timer)
+        timing.stop()
+        self.assertEqual(timing.current(), None)
@@ -0,0 +1,285 @@
+import os
+import socket
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from urllib2 import HTTPError
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from urllib.error import HTTPError
+
+try:
+    import mock
+except ImportError:
+    import unittest.mock as mock
+
+from flask_cas import timing
+from flask_cas.transport import DeadlineExceeded
+from flask_cas.transport import PooledTransport
+from flask_cas.transport import Timeout
+from flask_cas.transport import UrllibTransport
+from flask_cas.transport import create_transport
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.ports.add(self.client_address[1])
+        self.server.paths.append(self.path)
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        status = 404 if self.path.startswith('/missing') else 200
+        body = self.path.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.path.startswith('/drip'):
+            # The body trickles in, each part within the read timeout
+            for byte in range(len(body)):
+                self.wfile.write(body[byte:byte + 1])
+                self.wfile.flush()
+                time.sleep(0.05)
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ClosingHandler(_Handler):
+
+    protocol_version = 'HTTP/1.0'
+
+
+class test_pooled_transport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.ports = set()
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.transport = PooledTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_read(self):
+        response = self.transport.open(self.url + '/cas?ticket=1')
+        self.assertEqual(response.read(), b'/cas?ticket=1')
+
+    def test_connection_is_reused(self):
+        for ticket in range(3):
+            self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_unread_response_is_not_reused(self):
+        self.transport.open(self.url + '/cas').close()
+        self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 2)
+
+    def test_pool_size(self):
+        self.transport.pool_size = 0
+        for ticket in range(2):
+            self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 2)
+
+    def test_max_idle(self):
+        self.transport.max_idle = -1
+        for ticket in range(2):
+            self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 2)
+
+    def test_fork_drops_connections(self):
+        self.transport.open(self.url + '/cas').read()
+        with mock.patch.object(os, 'getpid', return_value=-1):
+            self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 2)
+
+    def test_http_error(self):
+        with self.assertRaises(HTTPError):
+            self.transport.open(self.url + '/missing')
+        # The connection of the error response is still reusable.
+        self.transport.open(self.url + '/cas').read()
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_read_timeout(self):
+        timeout = Timeout(connect=1, read=0.1, total=5)
+        with self.assertRaises(IOError):
+            self.transport.open(self.url + '/slow', timeout)
+
+    def test_total_timeout(self):
+        timeout = Timeout(total=0.1)
+        with self.assertRaises(IOError):
+            self.transport.open(self.url + '/slow', timeout)
+
+    def test_timeout_on_reused_connection_is_not_retried(self):
+        self.transport.open(self.url + '/cas').read()
+        timeout = Timeout(connect=1, read=0.1, total=5)
+        with self.assertRaises(IOError):
+            self.transport.open(self.url + '/slow?ticket=ST-1', timeout)
+        # A retry would reach the server once the slow request is done
+        time.sleep(1)
+        self.assertEqual(self.server.paths.count('/slow?ticket=ST-1'), 1)
+
+    def test_stale_connection_is_retried(self):
+        self.transport.open(self.url + '/cas').read()
+        for idle in self.transport._idle.values():
+            for connection, _ in idle:
+                # As if the server had closed the idle connection
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        response = self.transport.open(self.url + '/cas?ticket=ST-1')
+        self.assertEqual(response.read(), b'/cas?ticket=ST-1')
+
+    def test_max_per_host_waits_within_deadline(self):
+        self.transport.max_per_host = 1
+        response = self.transport.open(self.url + '/cas')
+        with self.assertRaises(DeadlineExceeded):
+            self.transport.open(self.url + '/cas', Timeout(total=0.1))
+        response.read()
+        self.transport.open(self.url + '/cas', Timeout(total=1)).read()
+
+
+    def test_phases(self):
+        timer = timing.start()
+        try:
+            self.transport.open(self.url + '/cas', Timeout(connect=1)).read()
+            self.assertEqual(list(timer.phases), ['dns', 'connect', 'ttfb'])
+            # A pooled connection skips the connection phases
+            timer = timing.start()
+            self.transport.open(self.url + '/cas').read()
+            self.assertEqual(list(timer.phases), ['ttfb'])
+        finally:
+            timing.stop()
+
+    def test_server_closing_connection(self):
+        server = HTTPServer(('127.0.0.1', 0), _ClosingHandler)
+        server.ports = set()
+        server.paths = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{0}'.format(server.server_port)
+        try:
+            for ticket in range(2):
+                response = self.transport.open(
+                    url + '/cas', Timeout(connect=5, read=10, total=15))
+                self.assertEqual(response.read(4), b'/cas')
+                self.assertEqual(response.read(), b'')
+            self.assertEqual(len(server.ports), 2)
+            self.assertEqual(self.transport.stats()['idle'], 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_warm(self):
+        self.transport.warm(self.url, 1, Timeout(connect=1))
+        self.assertEqual(self.transport.stats()['idle'], 1)
+        timer = timing.start()
+        try:
+            self.transport.open(self.url + '/cas').read()
+            self.assertEqual(list(timer.phases), ['ttfb'])
+        finally:
+            timing.stop()
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_warm_pool_size(self):
+        self.transport.pool_size = 1
+        self.transport.warm(self.url, 3)
+        self.assertEqual(self.transport.stats()['idle'], 1)
+
+    def test_warm_refused(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{0}'.format(listener.getsockname()[1])
+        listener.close()
+        with self.assertRaises(IOError):
+            self.transport.warm(url)
+        self.assertEqual(self.transport.stats()['idle'], 0)
+
+
+class test_urllib_transport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _ClosingHandler)
+        self.server.ports = set()
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.transport = UrllibTransport()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_read(self):
+        response = self.transport.open(
+            self.url + '/cas?ticket=1', Timeout(connect=1, read=1, total=5))
+        self.assertEqual(response.read(), b'/cas?ticket=1')
+        self.assertEqual(response.getcode(), 200)
+
+    def test_http_error(self):
+        with self.assertRaises(HTTPError):
+            self.transport.open(self.url + '/missing', Timeout(connect=1))
+
+    def test_read_timeout(self):
+        timeout = Timeout(connect=1, read=0.1, total=5)
+        with self.assertRaises(IOError):
+            self.transport.open(self.url + '/slow', timeout)
+
+    def test_total_timeout(self):
+        timeout = Timeout(connect=1, read=1, total=0.3)
+        response = self.transport.open(self.url + '/drip/body', timeout)
+        with self.assertRaises(DeadlineExceeded):
+            response.read()
+
+
+class test_timeout(unittest.TestCase):
+
+    def test_unlimited(self):
+        timeout = Timeout()
+        self.assertEqual(timeout.remaining(), None)
+        self.assertEqual(timeout.connect_timeout(), None)
+        self.assertEqual(timeout.read_timeout(), None)
+
+    def test_bounded_by_total(self):
+        timeout = Timeout(connect=5, read=10, total=2)
+        self.assertTrue(timeout.connect_timeout() <= 2)
+        self.assertTrue(timeout.read_timeout() <= 2)
+
+    def test_exceeded(self):
+        timeout = Timeout(total=0)
+        with self.assertRaises(DeadlineExceeded):
+            timeout.check()
+
+
+class test_create_transport(unittest.TestCase):
+
+    def test_pooled(self):
+        transport = create_transport({
+            'CAS_CONNECTION_POOL': True,
+            'CAS_POOL_SIZE': 3,
+            'CAS_POOL_MAX_IDLE': 5,
+            'CAS_POOL_MAX_PER_HOST': 2,
+        })
+        self.assertTrue(isinstance(transport, PooledTransport))
+        self.assertEqual(transport.pool_size, 3)
+        self.assertEqual(transport.max_idle, 5)
+        self.assertEqual(transport.max_per_host, 2)
+
+    def test_urllib(self):
+        transport = create_transport({'CAS_CONNECTION_POOL': False})
+        self.assertTrue(isinstance(transport, UrllibTransport))